@@ -8,10 +8,12 @@ from ost_utils.pytest.fixtures.ansible import *
 
 from ost_utils.pytest.fixtures.artifacts import artifacts
 from ost_utils.pytest.fixtures.artifacts import artifacts_dir
+from ost_utils.pytest.fixtures.artifacts import artifact_collectors
 from ost_utils.pytest.fixtures.artifacts import artifact_list
 from ost_utils.pytest.fixtures.artifacts import collect_artifacts
 from ost_utils.pytest.fixtures.artifacts import dump_dhcp_leases
 from ost_utils.pytest.fixtures.artifacts import generate_sar_stat_plots
+from ost_utils.pytest.fixtures.artifacts import log_tailer
 
 from ost_utils.pytest.fixtures.backend import all_hostnames
 from ost_utils.pytest.fixtures.ansible import ansible_inventory
@@ -37,3 +39,5 @@ from ost_utils.pytest.fixtures.env import root_dir
 from ost_utils.pytest.fixtures.env import ssh_key_file
 from ost_utils.pytest.fixtures.env import suite_dir
 from ost_utils.pytest.fixtures.env import working_dir
+
+from ost_utils.pytest.running_time import *
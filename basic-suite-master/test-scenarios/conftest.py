@@ -16,6 +16,7 @@ from ost_utils.pytest.fixtures.ansible import ansible_clean_private_dirs
 from ost_utils.pytest.fixtures.ansible import ansible_collect_logs
 from ost_utils.pytest.fixtures.ansible import ansible_engine
 from ost_utils.pytest.fixtures.ansible import ansible_engine_facts
+from ost_utils.pytest.fixtures.ansible import ansible_facts_cache
 from ost_utils.pytest.fixtures.ansible import ansible_host0
 from ost_utils.pytest.fixtures.ansible import ansible_host1
 from ost_utils.pytest.fixtures.ansible import ansible_hosts
@@ -24,11 +25,13 @@ from ost_utils.pytest.fixtures.ansible import ansible_storage
 
 from ost_utils.pytest.fixtures.artifacts import artifacts
 from ost_utils.pytest.fixtures.artifacts import artifacts_dir
+from ost_utils.pytest.fixtures.artifacts import artifact_collectors
 from ost_utils.pytest.fixtures.artifacts import artifact_list
 from ost_utils.pytest.fixtures.artifacts import collect_artifacts
 from ost_utils.pytest.fixtures.artifacts import collect_vdsm_coverage_artifacts
 from ost_utils.pytest.fixtures.artifacts import dump_dhcp_leases
 from ost_utils.pytest.fixtures.artifacts import generate_sar_stat_plots
+from ost_utils.pytest.fixtures.artifacts import log_tailer
 
 from ost_utils.pytest.fixtures.backend import all_hostnames
 from ost_utils.pytest.fixtures.backend import backend
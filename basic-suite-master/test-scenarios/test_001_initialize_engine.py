@@ -8,8 +8,10 @@ from __future__ import absolute_import
 import os
 
 from ost_utils.ansible.collection import engine_setup
+from ost_utils.pytest import checkpoint
 
 
+@checkpoint('engine-setup')
 def test_initialize_engine(
     working_dir,
     ansible_engine,
@@ -29,6 +29,7 @@ from ost_utils import host_utils
 from ost_utils.ansible import AnsibleExecutionError
 from ost_utils.ansible.collection import CollectionMapper
 from ost_utils.ansible.collection import image_template
+from ost_utils.pytest import checkpoint
 from ost_utils.pytest import order_by
 from ost_utils.pytest.fixtures import root_password
 from ost_utils.pytest.fixtures.network import storage_network_name
@@ -391,6 +392,7 @@ def test_verify_add_hosts(hosts_service, ost_dc_name):
 
 
 @order_by(_TEST_LIST)
+@checkpoint('hosts-added')
 def test_verify_add_all_hosts(hosts_service, ost_dc_name):
     assert assert_utils.true_within(
         lambda: host_utils.all_hosts_up(hosts_service, ost_dc_name),
@@ -580,6 +582,7 @@ def test_add_secondary_storage_domains(
 
 
 @order_by(_TEST_LIST)
+@checkpoint('storage-attached')
 def test_resize_and_refresh_storage_domain(
     sd_iscsi_ansible_host, engine_api, sd_iscsi_host_luns
 ):
@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+"""
+Micro-benchmark of ssh.drain_ssh_channel against a local, in-process
+paramiko server that pushes multi-megabyte outputs, compared with the
+1024 byte, one chunk per select() draining loop it replaced.
+
+Usage:
+    python3 benchmarks/ssh_drain.py [--sizes MIB ...] [--rounds N]
+"""
+
+import argparse
+import logging
+import os
+import select
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ost_utils import ssh  # noqa: E402
+
+USERNAME = 'ost'
+PASSWORD = 'ost'
+
+# written in blocks like the remote commands do, e.g. journalctl
+_BLOCK = b'2022-03-01 10:00:00,123+0000 INFO (jsonrpc/1) [vdsm.api] ' * 64
+
+
+class _Server(paramiko.ServerInterface):
+    """Accepts any command and answers it with 'size' bytes of output"""
+
+    def __init__(self, size):
+        self._size = size
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self._send, args=(channel,), daemon=True
+        ).start()
+        return True
+
+    def _send(self, channel):
+        # Closing the channel before the reply to the exec request went
+        # out would fail the request, so the client asks for the output
+        # once it got the reply
+        channel.recv(1)
+        left = self._size
+        while left > 0:
+            block = _BLOCK[:left]
+            channel.sendall(block)
+            left -= len(block)
+        channel.send_exit_status(0)
+        channel.close()
+
+
+class _Listener:
+    def __init__(self, size):
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._server = _Server(size)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._transport = None
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def set_size(self, size):
+        self._server._size = size
+
+    def _accept(self):
+        conn, _ = self._sock.accept()
+        self._transport = paramiko.Transport(conn)
+        self._transport.add_server_key(self._host_key)
+        self._transport.start_server(server=self._server)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        self._sock.close()
+
+
+def _legacy_drain(chan, stdout):
+    # drain_ssh_channel before it read adaptively, kept for comparison
+    chan.settimeout(0)
+    out_queue = []
+    out_all = []
+    while True:
+        read_streams = [chan] if not chan.closed else []
+        write_streams = [stdout] if out_queue else []
+        _, write, _ = select.select(read_streams, write_streams, [], 0.1)
+        try:
+            if chan.recv_ready():
+                chunk = chan.recv(1024)
+                out_queue.append(chunk)
+                out_all.append(chunk)
+        except socket.error:
+            pass
+        if stdout in write:
+            stdout.write(out_queue.pop(0))
+            stdout.flush()
+        if chan.closed and not out_queue:
+            break
+    return chan.exit_status, b''.join(out_all), b''
+
+
+def _adaptive_drain(chan, stdout):
+    return ssh.drain_ssh_channel(chan, stdout=stdout, stderr=None)
+
+
+def _streaming_drain(chan, stdout):
+    return ssh.drain_ssh_channel(
+        chan, stdout=stdout, stderr=None, keep_output=False
+    )
+
+
+DRAINS = (
+    ('legacy', _legacy_drain),
+    ('adaptive', _adaptive_drain),
+    ('streaming', _streaming_drain),
+)
+
+
+def _run(client, drain, sink, size):
+    channel = client.get_transport().open_session()
+    channel.exec_command('cat')
+    start = time.monotonic()
+    channel.sendall(b'\n')
+    code, out, _ = drain(channel, sink)
+    duration = time.monotonic() - start
+    channel.close()
+    if code != 0 or (out and len(out) != size):
+        raise RuntimeError(f'Got {len(out)} of {size} bytes, rc {code}')
+    return duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[1, 8, 32],
+        help='output sizes in MiB',
+    )
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args(argv)
+    # tearing the connection down resets it on one of the ends
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    listener = _Listener(0)
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        '127.0.0.1',
+        port=listener.port,
+        username=USERNAME,
+        password=PASSWORD,
+        look_for_keys=False,
+        allow_agent=False,
+    )
+    print(f"{'MiB':>5} {'drain':>10} {'median s':>9} {'MiB/s':>8}")
+    try:
+        with open(os.devnull, 'wb') as sink:
+            for size_mib in args.sizes:
+                size = size_mib * 1024 * 1024
+                listener.set_size(size)
+                for name, drain in DRAINS:
+                    duration = statistics.median(
+                        _run(client, drain, sink, size)
+                        for _ in range(args.rounds)
+                    )
+                    print(
+                        f'{size_mib:>5} {name:>10} {duration:>9.3f} '
+                        f'{size_mib / duration:>8.1f}'
+                    )
+    finally:
+        client.close()
+        listener.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+"""
+Micro-benchmark of resolving the NICs of a synthetic virsh deployment
+with hundreds of VMs to their DHCP host entries, using the MAC indexes
+of VirshNetworks compared with the per-network scans they replaced.
+
+Usage:
+    python3 benchmarks/virsh_topology.py [--vms N ...] [--nics N]
+        [--rounds N]
+"""
+
+import argparse
+import ipaddress
+import os
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ost_utils.backend.virsh import networking  # noqa: E402
+
+_NETWORK_XML = '''
+<network>
+  <name>{libvirt_name}</name>
+  <metadata>
+    <ost:ost xmlns:ost="OST:metadata">
+      <ost-network-type comment="{ost_name}"/>
+    </ost:ost>
+  </metadata>
+  <ip address='{ip4_gw}' netmask='255.255.0.0'>
+    <dhcp>{hosts4}</dhcp>
+  </ip>
+  <ip family='ipv6' address='{ip6_gw}' prefix='64'>
+    <dhcp>{hosts6}</dhcp>
+  </ip>
+</network>
+'''
+
+_NIC_XML = '''
+<interface type='network'>
+  <mac address='{mac}'/>
+  <source network='{libvirt_name}'/>
+  <alias name='net{idx}'/>
+</interface>
+'''
+
+
+class _LegacyNetworks(networking.VirshNetworks):
+    """The MAC lookups before the networks were indexed"""
+
+    def find_host_dhcp4_for_mac(self, mac):
+        for network in self._networks_by_ost_name.values():
+            host_dhcp4 = network.host_dhcps4.host_dhcps.get(mac)
+            if host_dhcp4 is not None:
+                return host_dhcp4
+        return None
+
+    def find_host_dhcp6_for_mac(self, mac):
+        for network in self._networks_by_ost_name.values():
+            host_dhcps6 = network.host_dhcps6.host_dhcps
+            for mac_or_id in host_dhcps6:
+                if mac_or_id.endswith(mac):
+                    return host_dhcps6[mac_or_id]
+        return None
+
+
+NETWORKS = (
+    ('legacy', _LegacyNetworks),
+    ('indexed', networking.VirshNetworks),
+)
+
+
+def _mac(net_idx, vm_idx):
+    return f'54:52:{net_idx:02x}:00:{vm_idx >> 8:02x}:{vm_idx & 0xff:02x}'
+
+
+def _topology(vms, nics):
+    """
+    Returns:
+        tuple: libvirt name -> XML string of the networks, and the list of
+            the domain XMLs, as discovery.discover would find them
+    """
+    network_xmls = {}
+    for net_idx in range(nics):
+        libvirt_name = f'ostbench-{200 + net_idx}'
+        ip4_net = ipaddress.ip_network(f'10.{net_idx}.0.0/16')
+        ip6_net = ipaddress.ip_network(f'fd00:{net_idx:x}::/64')
+        hosts4 = []
+        hosts6 = []
+        for vm_idx in range(vms):
+            mac = _mac(net_idx, vm_idx)
+            hosts4.append(
+                f"<host mac='{mac}' name='vm-{vm_idx}' "
+                f"ip='{ip4_net[vm_idx + 2]}'/>"
+            )
+            hosts6.append(
+                f"<host id='0:3:0:1:{mac}' name='vm-{vm_idx}' "
+                f"ip='{ip6_net[vm_idx + 2]}'/>"
+            )
+        network_xmls[libvirt_name] = _NETWORK_XML.format(
+            libvirt_name=libvirt_name,
+            ost_name=f'net-{net_idx}',
+            ip4_gw=ip4_net[1],
+            ip6_gw=ip6_net[1],
+            hosts4=''.join(hosts4),
+            hosts6=''.join(hosts6),
+        )
+    domain_xmls = []
+    for vm_idx in range(vms):
+        interfaces = ''.join(
+            _NIC_XML.format(
+                mac=_mac(net_idx, vm_idx),
+                libvirt_name=f'ostbench-{200 + net_idx}',
+                idx=net_idx,
+            )
+            for net_idx in range(nics)
+        )
+        domain_xmls.append(
+            ET.fromstring(f'<domain><devices>{interfaces}</devices></domain>')
+        )
+    return network_xmls, domain_xmls
+
+
+def _run(networks, domain_xmls, nics):
+    start = time.monotonic()
+    ip_mapping = [
+        networking.VMNics(domain_xml, networks).get_ips_for_all_networks()
+        for domain_xml in domain_xmls
+    ]
+    duration = time.monotonic() - start
+    resolved = sum(len(ips) for vm in ip_mapping for ips in vm.values())
+    if resolved != 2 * nics * len(domain_xmls):
+        raise RuntimeError(f'Resolved {resolved} addresses only')
+    return duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        '--vms',
+        type=int,
+        nargs='+',
+        default=[10, 100, 300],
+        help='numbers of VMs in the deployment',
+    )
+    parser.add_argument(
+        '--nics', type=int, default=4, help='NICs (and networks) per VM'
+    )
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'VMs':>5} {'NICs':>6} {'lookup':>8} {'median ms':>10}")
+    for vms in args.vms:
+        network_xmls, domain_xmls = _topology(vms, args.nics)
+        for name, networks_class in NETWORKS:
+            networks = networks_class(network_xmls)
+            duration = statistics.median(
+                _run(networks, domain_xmls, args.nics)
+                for _ in range(args.rounds)
+            )
+            print(
+                f'{vms:>5} {vms * args.nics:>6} {name:>8} '
+                f'{duration * 1000:>10.1f}'
+            )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
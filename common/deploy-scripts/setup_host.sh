@@ -16,6 +16,21 @@ EOF
     systemctl enable --now coredump-kill
 }
 
+hugepages() {
+    # Also set on boot, since VMs restored from the image cache are
+    # booted from the deployed disks
+    local hugepages=3
+    cat > /etc/systemd/system/ost-hugepages.service <<EOF
+[Service]
+Type=oneshot
+ExecStart=/bin/sh -c "for node in /sys/devices/system/node/node*; do echo ${hugepages} > \$\$node/hugepages/hugepages-2048kB/nr_hugepages; done"
+RemainAfterExit=yes
+[Install]
+WantedBy=multi-user.target
+EOF
+    systemctl enable --now ost-hugepages
+}
+
 # Only on ovirt-node
 if [[ $(which nodectl) ]]; then
     nodectl check
@@ -23,10 +38,7 @@ if [[ $(which nodectl) ]]; then
 fi
 
 # Set up hugepages
-HUGEPAGES=3
-for node in /sys/devices/system/node/node*; do
-    echo $HUGEPAGES > $node/hugepages/hugepages-2048kB/nr_hugepages;
-done
+hugepages
 
 # Configure libvirtd log
 mkdir -p /etc/libvirt
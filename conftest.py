@@ -9,3 +9,4 @@ from ost_utils.pytest import pytest_addoption
 
 
 from ost_utils.pytest import pytest_fixture_setup
+from ost_utils.pytest import pytest_runtest_makereport
@@ -46,104 +46,37 @@ ost_status() {
 ost_destroy() {
     _get_uuid
     if [[ -n "$uuid" ]]; then
+        # the lock is kept for checkouts still allocating subnets without the leases registry
         (
             flock -w 120 9
             virsh net-list --name | grep ^ost${uuid} | xargs -rn1 virsh net-destroy
             virsh list --name | grep ^${uuid} | xargs -rn1 virsh destroy
         ) 9>/tmp/ost.lock
     fi
+    _ost_leases release
     [[ -s "$PREFIX/sshd_pid" ]] && { echo "killing IPv6 sshd proxy"; kill $(cat "$PREFIX/sshd_pid"); }
     _deployment_exists && rm -rf "$PREFIX" && echo "removed $PREFIX"
     unset OST_INITIALIZED $(env | grep ^OST_IMAGES_ | cut -d= -f1)
 }
 
-# ost_init [-4|-6] [suite] [distro]
-ost_init() {
-
-    # _generate_network "host-1-eth1 host-1-eth2 host-2-eth1..."
-    # create separate networks for each NIC entry.
-    # generate IPs (IPv4, IPv6) on 192.168.$SUBNET.$HOSTIDX where HOSTIDX starts with 2
-    # on management network ($management_net) generates DNS entries in form of ost-{suite}-{iface}
-    _generate_network() {
-        SUBNETHEX=$(printf %x $SUBNET)
-        IPV4=
-        IPV6=
-        HOSTIDX=2
-        NET_NAME="ost$UUID-$SUBNET"
-        for name in $1; do
-            IDXHEX=$(printf "%.2d" ${HOSTIDX})
-            nicidx_map[$name]="${HOSTIDX}"
-            eth_map[$name]="$NET_TYPE"
-            hostname="ost-${SUITE}-${name}"
-            ipv4_ip="192.168.${SUBNET}.${HOSTIDX}"
-            ipv4_mac="54:52:c0:a8:${SUBNETHEX}:${IDXHEX}"
-            ipv6_ip="fd8f:1391:3a82:${SUBNET}::c0a8:${SUBNETHEX}${IDXHEX}"
-            ipv6_mac="0:3:0:1:54:52:c0:a8:${SUBNETHEX}:${IDXHEX}"
-            [[ -n "$ipv6_only" ]] || dns_entries+="<host ip='${ipv4_ip}'><hostname>${hostname}</hostname></host>"
-            [[ -n "$ipv4_only" ]] || dns_entries+="<host ip='${ipv6_ip}'><hostname>${hostname}</hostname></host>"
-            nicip_map[$name]="${ipv6_ip}"
-            [[ -n "$ipv4_only" ]] && nicip_map[$name]="${ipv4_ip}"
-            IPV4+="<host mac='${ipv4_mac}' name='${hostname}' ip='${ipv4_ip}'/>"
-            IPV6+="<host id='${ipv6_mac}' name='${hostname}' ip='${ipv6_ip}'/>"
-            (( HOSTIDX++ ))
-        done
-        if [[ "$NET_TYPE" = "$management_net" ]]; then
-            # adds all acumulated DNS entries so far, i.e. management network needs to be the last one generated
-            DNS="<dns forwardPlainNames='no'>${dns_entries}</dns>"
-        else
-            DNS="<dns enable='no'/>"
-        fi
-    }
-
-    # finds unused subnet in the OST range
-    _find_free_subnet() {
-        SUBNET=$(seq 200 254 | egrep -vw "$(virsh net-list --name | grep ^ost | cut -d- -f2 | tr "\n" '|' | sed 's/^/(/; s/|$/)/')" | head -1)
-        [[ -n "$SUBNET" ]] || { echo -e "\nno available subnet"; return 1; }
-    }
+_ost_leases() {
+    PYTHONPATH="${PYTHONPATH}:${OST_REPO_ROOT}" ${PYTHON} -m ost_utils.deployment_utils.leases "$@"
+}
 
-    # _render <template_file>
-    _render() {
-        sed "
-            s|@UUID@|${UUID}|g;
-            s|@PREFIX@|${PREFIX}|g;
-            s|@VM_FULLNAME@|${VM_FULLNAME}|g;
-            s|@DEPLOY_SCRIPTS@|${DEPLOY_SCRIPTS}|g;
-            s|@MEMSIZE@|${MEMSIZE}|g;
-            s|@MEMSIZE_NUMA@|$((MEMSIZE/2))|g;
-            s|@VCPU_NUM@|${VCPU_NUM}|g;
-            s|@CELL_0_VCPUS@|${CELL_0_VCPUS}|g;
-            s|@CELL_1_VCPUS@|${CELL_1_VCPUS}|g;
-            s|@SERIALLOG@|${SERIALLOG}|g;
-            s|@OST_ROOTDISK@|${OST_ROOTDISK}|g;
-            s|@DISKS@|${DISKS}|g;
-            s|@DISK_DEV@|${DISK_DEV}|g;
-            s|@DISK_SERIAL@|${DISK_SERIAL}|g;
-            s|@DISK_FILE@|${DISK_FILE}|g;
-            s|@NICS@|${NICS}|g;
-            s|@NET_NAME@|${NET_NAME}|g;
-            s|@NET_TYPE@|${NET_TYPE}|g;
-            s|@SUBNET@|${SUBNET}|g;
-            s|@SUBNETHEX@|${SUBNETHEX}|g;
-            s|@IDXHEX@|${IDXHEX}|g;
-            s|@DNS@|${DNS}|g;
-            s|@IPV4@|${IPV4}|g;
-            s|@IPV6@|${IPV6}|g;
-            " "$1"
-    }
+_ost_image_cache() {
+    PYTHONPATH="${PYTHONPATH}:${OST_REPO_ROOT}" ${PYTHON} -m ost_utils.deployment_utils.image_cache "$@"
+}
 
-    # support readable comments in json
-    jqr() {
-        grep -v '^#' ${ost_conf} | jq -r "$@"
-    }
+_ost_provision() {
+    PYTHONPATH="${PYTHONPATH}:${OST_REPO_ROOT}" ${PYTHON} -m ost_utils.deployment_utils.provision "$@"
+}
 
-    declare -A net_map=()
-    declare -A nicidx_map=()
-    declare -A nicip_map=()
-    declare -A eth_map=()
-    ansible_hosts=
-    ipv4_only=; ipv6_only=
-    [[ "$1" == "-4" ]] && { ipv4_only=yes; shift; }
-    [[ "$1" == "-6" ]] && { ipv6_only=yes; shift; }
+# ost_init [-4|-6] [suite] [distro]
+# networks and VMs are created by ost_utils/deployment_utils/provision.py from the suite's ost.json
+# to see what would be created run "_ost_provision --dry-run [-4|-6] <suite>"
+ost_init() {
+    local ip_version=
+    [[ "$1" == "-4" || "$1" == "-6" ]] && { ip_version=$1; shift; }
 
     SUITE="${1:-basic-suite-master}"
     OST_IMAGES_DISTRO="${2:-el8stream}"
@@ -164,120 +97,17 @@ ost_init() {
     mkdir "$PREFIX/logs"
     mkdir "$PREFIX/images"
     chcon -t svirt_image_t "$PREFIX/images"
+    # deployed disks are cached there when set, see "_ost_image_cache list"
+    if [[ -n "$OST_IMAGE_CACHE_DIR" ]]; then
+        mkdir -p "$OST_IMAGE_CACHE_DIR"
+        chcon -t svirt_image_t "$OST_IMAGE_CACHE_DIR"
+    fi
 
-    # generate 8 char UUID common to all resources
-    # VMs with name <uuid>-ost-<suite>-<vmname>
-    UUID=$(uuidgen | cut -c -8)
-
-    ost_conf="$OST_REPO_ROOT/$SUITE/ost.json"
-    [[ -f "$ost_conf" ]] || { echo "no ost.conf in $SUITE"; return 1; }
-
-    # run the whole creation in subshell with a lock so that we do not explode on concurrent network allocation
+    # subnets and UUID are leased from a registry shared by all environments, see "_ost_leases list"
+    [ -f /tmp/ost-leases.sqlite ] || ( umask 0002; sg qemu "touch /tmp/ost-leases.sqlite"; )
+    # and held with /tmp/ost.lock while the networks are created, for checkouts not using the registry yet
     [ -f /tmp/ost.lock ] || ( umask 0002; sg qemu "touch /tmp/ost.lock"; )
-    (
-        flock -w 120 9
-        cd "${OST_REPO_ROOT}"
-
-        # parse networks and create them on unused subnets (sorted so that  management is the last one to include all DNS entries)
-        dns_entries=
-        for NET_TYPE in $(jqr ".networks | to_entries | map ({\"net\":.key} + {\"mgmt\":.value.is_management}) | sort_by(.mgmt==true) | .[].net"); do
-            net_template=$(jqr ".networks[\"${NET_TYPE}\"].template")
-            [[ "$ipv4_only" ]] && net_template+=".ipv4"
-            [[ "$ipv6_only" ]] && net_template+=".ipv6"
-            host_nics=$(jqr ".networks[\"${NET_TYPE}\"].nics[]" | tr '\n' ' ')
-            [[ -n "$(jqr ".networks[\"${NET_TYPE}\"].is_management // empty")" ]] && management_net=$NET_TYPE
-            [[ -r "$net_template" ]] || { echo "net $NET_TYPE: template $net_template does not exist"; return 1; }
-            echo -n "Creating network $NET_TYPE, subnet "
-            _find_free_subnet || return 1
-            echo $SUBNET
-            net_map[$NET_TYPE]="$SUBNET"
-            _generate_network "$host_nics"
-            _render ${net_template} | virsh net-create /dev/stdin || { echo "Network creation failed:"; _render ${net_template}; return 1; }
-        done
-        [[ -z "$management_net" ]] && { echo "no management network defined"; return 1; }
-
-        # parse VMs and create them
-        for VM_NAME in $(jqr ".vms | keys | join(\" \")"); do
-            vm_template=$(jqr ".vms[\"${VM_NAME}\"].template")
-            echo -n "Creating VM $VM_NAME with NICs "
-            [[ -r "$vm_template" ]] || { echo -e "VM $VM_NAME: template $vm_template does not exist"; return 1; }
-
-            # generate VM NICs with network mappings
-            NICS=
-            for NIC_NAME in $(jqr ".vms[\"${VM_NAME}\"].nics | keys | join(\" \")"); do
-                nic_template=$(jqr ".vms[\"${VM_NAME}\"].nics[\"${NIC_NAME}\"].template")
-                [[ -r "$nic_template" ]] || { echo -e "\nNIC $NIC_NAME: template $nic_template does not exist"; return 1; }
-                net="${eth_map[$NIC_NAME]}"
-                echo -n "$NIC_NAME($net) "
-                SUBNET="${net_map[$net]}"
-                SUBNETHEX=$(printf %x $SUBNET)
-                IDXHEX=$(printf %02d ${nicidx_map[$NIC_NAME]})
-                [[ "$net" ]] || { echo -e "\nNIC $NIC_NAME not found in list of networks ${eth_map[@]}"; return 1; }
-                [[ "$SUBNET" ]] || { echo -e "\nnetwork $net not found in defined networks ${net_map[@]}"; return 1; }
-                [[ "$IDXHEX" ]] || { echo -e "\nVM $VM_NAME not found in host ip mappings ${nicidx_map[@]}"; return 1; }
-                # ansible IP is on the management network
-                [[ "$net" == "$management_net" ]] && ansible_ip="${nicip_map[$NIC_NAME]}"
-                NET_NAME="ost$UUID-${SUBNET}"
-                NICS+=$(_render ${nic_template} | tr -d "\t\n")
-            done
-
-            # deploy scripts
-            DEPLOY_SCRIPTS=
-            for script in $(jqr ".vms[\"${VM_NAME}\"][\"deploy-scripts\"][]");
-                do DEPLOY_SCRIPTS+="<script name=\"${script}\"/>"
-            done
-
-            # create root disk
-            echo -n " and disks "
-            vm_rootdisk_var=$(jqr ".vms[\"${VM_NAME}\"].root_disk_var")
-            [[ -r "${!vm_rootdisk_var}" ]] || { echo -e "\nroot disk ${!vm_rootdisk_var} doesn't exist"; return 1; }
-            OST_ROOTDISK="${PREFIX}/images/${VM_NAME}-root.qcow2"
-            qemu-img create -q -f qcow2 -b ${!vm_rootdisk_var} -F qcow2 $OST_ROOTDISK
-            echo -n "root($(basename ${!vm_rootdisk_var})) "
-
-            # create additional empty disks
-            DISKS=
-            DISK_SERIAL=2
-            for DISK_DEV in $(jqr ".vms[\"${VM_NAME}\"].disks | keys | join(\" \")"); do
-                disk_template=$(jqr ".vms[\"${VM_NAME}\"].disks[\"${DISK_DEV}\"].template")
-                DISK_SIZE=$(jqr ".vms[\"${VM_NAME}\"].disks[\"${DISK_DEV}\"].size")
-                [[ -r "${!vm_rootdisk_var}" ]] || { echo -e "\nroot disk ${vm_rootdisk_var}(${!vm_rootdisk_var}) doesn't exist"; return 1; }
-                DISK_FILE="$PREFIX/images/${VM_NAME}-${DISK_DEV}.qcow2"
-                qemu-img create -q -f qcow2 -o preallocation=metadata "${DISK_FILE}" "${DISK_SIZE}"
-                echo -n "${DISK_DEV}(${DISK_SIZE}) "
-                DISKS+=$(_render ${disk_template} | tr -d "\t\n")
-                (( DISK_SERIAL++ ))
-            done
-
-            # create the VM
-            VM_FULLNAME="${UUID}-ost-${SUITE}-${VM_NAME}"
-            MEMSIZE=$(jqr ".vms[\"${VM_NAME}\"].memory")
-            # default to 2 vCPUs and distribute them between NUMA cells
-            VCPU_NUM=$(jqr ".vms[\"${VM_NAME}\"].vcpu_num // 2")
-            CELL_0_VCPUS="0-$((${VCPU_NUM}/2 - 1))"
-            CELL_1_VCPUS="$((${VCPU_NUM}/2))-$((${VCPU_NUM} - 1))"
-
-            SERIALLOG="$PREFIX/logs/$VM_NAME"
-            echo
-            _render ${vm_template} | virsh create /dev/stdin || { echo "VM creation failed:"; _render ${vm_template}; return 1; }
-
-            # generate ansible inventory line per host:
-            # <VM name> ansible_host=<IP> ansible_ssh_private_key_file=<key_file> ansible_ssh_extra_args=<disable updates of known_hosts file>
-            ansible_hosts+="ost-${SUITE}-${VM_NAME} ansible_host=${ansible_ip} ansible_ssh_private_key_file=${OST_IMAGES_SSH_KEY} ansible_ssh_extra_args='-o UserKnownHostsFile=/dev/null'\n"
-
-        done
-
-        # final ansible hosts file
-        echo -e $ansible_hosts > $PREFIX/hosts
-
-        # start IPv6 SOCKS proxy for DNF in IPv6-only networks
-        [[ -n "$ipv6_only" ]] && {
-            echo "Starting sshd on ${ssh_addr:=fd8f:1391:3a82:${net_map[$management_net]}::1}"
-            sleep 5
-            /usr/sbin/sshd -f ${OST_REPO_ROOT}/common/helpers/sshd_config -o PidFile=${PREFIX}/sshd_pid -o AuthorizedKeysFile=${OST_IMAGES_SSH_KEY}.pub -o HostKey=${OST_IMAGES_SSH_KEY} -o AllowUsers=$(id -un) -o ListenAddress=${ssh_addr}
-        }
-
-    true ) 9>/tmp/ost.lock || return 1
+    _ost_provision ${ip_version} "$SUITE" || return 1
     ost_status --dump
 }
 
@@ -307,6 +137,28 @@ ost_console() {
     fi
 }
 
+_ost_checkpoints() {
+    PYTHONPATH="${PYTHONPATH}:${OST_REPO_ROOT}" ${PYTHON} -m ost_utils.deployment_utils.checkpoints "$@"
+}
+
+# ost_checkpoint <name>
+# saves the state of all VMs and their disks, to be restored by ost_restore
+ost_checkpoint() {
+    _deployment_exists || return 1
+    [[ -n "$1" ]] || { echo -e "ost_checkpoint <name>\n"; _ost_checkpoints list; return 1; }
+    _ost_checkpoints create "$1"
+}
+
+# ost_restore <checkpoint>
+# brings the deployment back to a checkpoint, taken by ost_checkpoint or by running tests with --checkpoints
+# to restore it and run only the tests after it use "ost_run_tests --restore-checkpoint <checkpoint>"
+ost_restore() {
+    _deployment_exists || return 1
+    [[ -n "$1" ]] || { echo -e "ost_restore <checkpoint>\n"; _ost_checkpoints list; return 1; }
+    _ost_checkpoints restore "$1" || return 1
+    rm -f "$PREFIX/ansible-facts.json"
+}
+
 # check dependencies
 ost_check_dependencies() {
     ${PYTHON} -V 2>/dev/null | grep -q ^Python || { echo "$PYTHON is not installed"; return 2; }
@@ -9,6 +9,7 @@ from testlib import suite
 
 from ost_utils import ansible
 from ost_utils.ansible import private_dir
+from ost_utils.ansible.connection import PersistentConnections
 
 
 @pytest.fixture(scope="session")
@@ -32,6 +33,7 @@ def ansible_clean_private_dirs():
         yield
     finally:
         private_dir.PrivateDir.cleanup()
+        PersistentConnections.cleanup()
 
 
 @pytest.fixture(scope="session", autouse=True)
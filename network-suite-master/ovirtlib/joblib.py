@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 #
 #
+import ovirtsdk4
 from ovirtsdk4.types import JobStatus
 
 from ovirtlib import eventlib
@@ -10,62 +11,171 @@ from ovirtlib import syncutil
 from ovirtlib.sdkentity import SDKRootEntity
 
 
+UNFINISHED_SEARCH = 'status!=finished'
+STARTED_STATUSES = (JobStatus.STARTED,)
+ILL_FATED_STATUSES = (JobStatus.ABORTED, JobStatus.UNKNOWN, JobStatus.FAILED)
+NOT_DONE_STATUSES = (JobStatus.STARTED, JobStatus.UNKNOWN)
+# the status an engine rejecting the jobs search answers with, other
+# errors (disconnections, 5xx, ...) may be transient and are raised
+SEARCH_UNSUPPORTED_CODE = 400
+
+
 class EngineJobs(SDKRootEntity):
-    def __init__(self, parent_sdk_system, job_description_predicate):
+    """
+    The engine jobs matching a description predicate (and optionally a
+    correlation id). The derived views (describe_started(), done(), ...)
+    can be computed from a snapshot fetched once with fetch() instead of
+    each fetching the jobs again.
+    """
+
+    # cleared once an engine rejects the jobs search, for the session
+    search_supported = True
+
+    def __init__(
+        self, parent_sdk_system, job_description_predicate, correlation_id=None
+    ):
         super(EngineJobs, self).__init__(parent_sdk_system)
         self._job_description_predicate = job_description_predicate
+        self._correlation_id = correlation_id
 
     def _get_parent_service(self, system):
         return system.jobs_service
 
-    def list(self):
+    @property
+    def correlation_id(self):
+        return self._correlation_id
+
+    def fetch(self, unfinished_only=True):
+        """
+        Fetch the jobs once, filtered on the engine side by correlation id
+        and, unless unfinished_only is False, excluding the finished ones
+        (which the engine accumulates by the thousands in long runs).
+
+        :return: list of ovirtsdk4.types.Job
+        """
+        return fetch_jobs(
+            self._parent_service,
+            self._correlation_id,
+            unfinished_only,
+        )
+
+    def list(self, jobs=None):
+        if jobs is None:
+            jobs = self.fetch(unfinished_only=False)
         return [
             job
-            for job in self._parent_service.list()
+            for job in jobs
             if self._job_description_predicate(job.description)
             and 'Adding an External Event' not in job.description
         ]
 
-    def describe_started(self):
-        started = self._list_for_status((JobStatus.STARTED,))
+    def describe_started(self, jobs=None):
+        started = self._list_for_status(STARTED_STATUSES, jobs)
         return [job.description for job in started]
 
-    def describe_ill_fated(self):
-        ill_fated = self._list_for_status(
-            (JobStatus.ABORTED, JobStatus.UNKNOWN, JobStatus.FAILED)
-        )
+    def describe_ill_fated(self, jobs=None):
+        ill_fated = self._list_for_status(ILL_FATED_STATUSES, jobs)
         return [f'{job.description}:{job.status}' for job in ill_fated]
 
-    def done(self):
-        return not self._list_for_status(
-            (JobStatus.STARTED, JobStatus.UNKNOWN)
-        )
+    def done(self, jobs=None):
+        return not self._list_for_status(NOT_DONE_STATUSES, jobs)
 
     def wait_for_done(self):
-        self._report_started()
-        # there is a small window for TOCTTOU error here
-        if not self.done():
+        wait_for_done(self.system, self)
+
+    def _list_for_status(self, job_statuses, jobs=None):
+        if jobs is None:
+            jobs = self.fetch()
+        return [job for job in self.list(jobs) if job.status in job_statuses]
+
+
+def wait_for_done(system, *engine_jobs):
+    """
+    Wait until all the given EngineJobs are done, fetching the jobs once
+    per poll for all of them. The jobs still started or ill-fated are
+    reported to engine.log also when the wait times out.
+
+    :raises syncutil.Timeout: if jobs are still not done after
+                              syncutil.DEFAULT_TIMEOUT seconds
+    """
+    jobs_service = system.jobs_service
+    correlation_ids = {jobs.correlation_id for jobs in engine_jobs}
+    correlation_id = (
+        correlation_ids.pop() if len(correlation_ids) == 1 else None
+    )
+    snapshot = [fetch_jobs(jobs_service, correlation_id)]
+
+    def all_done():
+        snapshot[0] = fetch_jobs(jobs_service, correlation_id)
+        return all(jobs.done(snapshot[0]) for jobs in engine_jobs)
+
+    _report_started(system, engine_jobs, snapshot[0])
+    # there is a small window for TOCTTOU error here
+    if not all(jobs.done(snapshot[0]) for jobs in engine_jobs):
+        try:
             syncutil.sync(
-                exec_func=lambda: self.done,
+                exec_func=all_done,
                 exec_func_args=(),
                 success_criteria=lambda done: done,
             )
-            self._report_started()
-            self._report_ill_fated()
-
-    def _report_started(self):
-        eventlib.EngineEvents(self.system).add(
-            f'OST - jobs: on wait for done - started jobs: '
-            f'{self.describe_started()} '
-        )
-
-    def _report_ill_fated(self):
-        eventlib.EngineEvents(self.system).add(
-            f'OST - jobs: on wait for done:' f'{self.describe_ill_fated()}'
-        )
-
-    def _list_for_status(self, job_statuses):
-        return [job for job in self.list() if job.status in job_statuses]
+        finally:
+            _report_started(system, engine_jobs, snapshot[0])
+            _report_ill_fated(system, engine_jobs, snapshot[0])
+
+
+def fetch_jobs(jobs_service, correlation_id=None, unfinished_only=True):
+    """
+    The search is passed as a raw query parameter, JobsService.list has no
+    'search' argument of its own. Whether an engine honours it or ignores
+    it, the jobs are filtered on our side as well, so the result is the
+    same either way, only the amount of jobs transferred differs.
+    """
+    search = []
+    if correlation_id is not None:
+        search.append(f'correlation_id={correlation_id}')
+    if unfinished_only:
+        search.append(UNFINISHED_SEARCH)
+    if not search:
+        return jobs_service.list()
+    jobs = None
+    if EngineJobs.search_supported:
+        try:
+            jobs = jobs_service.list(query={'search': ' and '.join(search)})
+        except ovirtsdk4.Error as e:
+            if e.code != SEARCH_UNSUPPORTED_CODE:
+                raise
+            # engine rejecting the jobs search: filter on our side only
+            EngineJobs.search_supported = False
+    if jobs is None:
+        jobs = jobs_service.list()
+    return [
+        job
+        for job in jobs
+        if (correlation_id is None or job.correlation_id == correlation_id)
+        and (not unfinished_only or job.status != JobStatus.FINISHED)
+    ]
+
+
+def _report_started(system, engine_jobs, jobs):
+    started = [
+        description
+        for job_set in engine_jobs
+        for description in job_set.describe_started(jobs)
+    ]
+    eventlib.EngineEvents(system).add(
+        f'OST - jobs: on wait for done - started jobs: {started} '
+    )
+
+
+def _report_ill_fated(system, engine_jobs, jobs):
+    ill_fated = [
+        description
+        for job_set in engine_jobs
+        for description in job_set.describe_ill_fated(jobs)
+    ]
+    eventlib.EngineEvents(system).add(
+        f'OST - jobs: on wait for done:' f'{ill_fated}'
+    )
 
 
 class AllJobs(EngineJobs):
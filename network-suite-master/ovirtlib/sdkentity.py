@@ -4,9 +4,20 @@
 #
 #
 import abc
+import contextlib
+import functools
+import os
+import threading
+import time
 
 import ovirtsdk4
 
+_SNAPSHOT_READ_ONLY_CALLS = ('get', 'list')
+
+_live_reads = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'gets': 0, 'saved': 0}
+
 
 class EntityAlreadyInitialized(Exception):
     pass
@@ -20,15 +31,61 @@ class EntityCreationError(Exception):
     pass
 
 
+def set_snapshot_max_age(max_age):
+    """
+    Enable snapshot mode: the SDK object fetched by an entity is reused for
+    'max_age' seconds instead of being fetched again on every property
+    access. None disables snapshot mode.
+    """
+    SDKEntity.snapshot_max_age = max_age
+
+
+def snapshot_stats():
+    """
+    :return: dict with the number of GETs done by entities and the number
+             of GETs saved by snapshot mode
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+@contextlib.contextmanager
+def live_reads():
+    """Bypass snapshots in this thread, e.g. while polling for a status"""
+    previous = getattr(_live_reads, 'enabled', False)
+    _live_reads.enabled = True
+    try:
+        yield
+    finally:
+        _live_reads.enabled = previous
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
 class SDKEntity(metaclass=abc.ABCMeta):
+    # seconds a fetched SDK object is reused for, see set_snapshot_max_age
+    snapshot_max_age = (
+        float(os.environ['OST_SDK_SNAPSHOT_MAX_AGE'])
+        if os.environ.get('OST_SDK_SNAPSHOT_MAX_AGE')
+        else None
+    )
+
     def __init__(self):
         self._service = None
         self._parent_service = None
         self._parent_sdk_system = None
+        self._id = None
+        self._snapshot = None
+        self._snapshot_time = None
 
     @property
     def id(self):
-        return self._service.get().id
+        if self._id is None:
+            self._id = self.get_sdk_type().id
+        return self._id
 
     @property
     def service(self):
@@ -39,7 +96,18 @@ class SDKEntity(metaclass=abc.ABCMeta):
         return self._parent_sdk_system
 
     def get_sdk_type(self):
-        return self._service.get()
+        if self._snapshot_valid():
+            _count('saved')
+            return self._snapshot
+        sdk_type = self._service.get()
+        _count('gets')
+        self._snapshot = sdk_type
+        self._snapshot_time = time.monotonic()
+        return sdk_type
+
+    def refresh(self):
+        """Drop the snapshot so that the next read fetches the entity"""
+        self._snapshot = None
 
     def create(self, *args, **kwargs):
         """This method is responsible for creating and
@@ -60,11 +128,11 @@ class SDKEntity(metaclass=abc.ABCMeta):
                 'entity "{}" was not found.'.format(name)
             )
         service = self._parent_service.service(entity_id)
-        self._set_service(service)
+        self._set_service(service, entity_id)
 
     def import_by_id(self, entity_id):
         service = self._parent_service.service(entity_id)
-        self._set_service(service)
+        self._set_service(service, entity_id)
 
     def remove(self):
         self._service.remove()
@@ -81,12 +149,21 @@ class SDKEntity(metaclass=abc.ABCMeta):
         except ovirtsdk4.Error as err:
             raise EntityCreationError(err.args[0])
         service = self._parent_service.service(entity_id)
-        self._set_service(service)
+        self._set_service(service, entity_id)
 
-    def _set_service(self, service):
+    def _set_service(self, service, entity_id=None):
         if self._service is not None:
             raise EntityAlreadyInitialized
-        self._service = service
+        self._service = _SnapshotTrackingService(service, self.refresh)
+        self._id = entity_id
+
+    def _snapshot_valid(self):
+        return (
+            self.snapshot_max_age is not None
+            and self._snapshot is not None
+            and not getattr(_live_reads, 'enabled', False)
+            and time.monotonic() - self._snapshot_time < self.snapshot_max_age
+        )
 
     def _execute_without_raising(self, func):
         try:
@@ -98,6 +175,37 @@ class SDKEntity(metaclass=abc.ABCMeta):
             )
 
 
+class _SnapshotTrackingService:
+    """
+    Forwards everything to an SDK service, dropping the snapshot of the
+    owning entity after each call that may have changed it (anything but
+    get/list and sub-service lookups).
+    """
+
+    def __init__(self, service, on_change):
+        self._sdk_service = service
+        self._on_change = on_change
+
+    def __getattr__(self, name):
+        attr = getattr(self._sdk_service, name)
+        if (
+            not callable(attr)
+            or name.startswith('_')
+            or name.endswith('_service')
+            or name in _SNAPSHOT_READ_ONLY_CALLS
+        ):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._on_change()
+
+        return call
+
+
 class SDKRootEntity(SDKEntity, metaclass=abc.ABCMeta):
     def __init__(self, parent_sdk_system):
         super(SDKRootEntity, self).__init__()
@@ -5,24 +5,21 @@
 #
 import collections
 import logging
-import os
 import time
 
+from ost_utils import polling
+
 from ovirtlib import eventlib
+from ovirtlib import sdkentity
 
 DEFAULT_DELAY_START = 0
 DEFAULT_INTERVAL = 3
 DEFAULT_TIMEOUT = 120
+DEFAULT_AUDIT_INTERVAL = 60
 DELIM = '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~'
 
 
-class Timeout(Exception):
-    @property
-    def last_result(self):
-        return self.args[0]
-
-    def __str__(self):
-        return "Last evaluated result: {}".format(self.args[0])
+Timeout = polling.Timeout
 
 
 def sync(
@@ -34,6 +31,8 @@ def sync(
     retry_interval=DEFAULT_INTERVAL,
     timeout=DEFAULT_TIMEOUT,
     sdk_entity=None,
+    strategy=None,
+    audit_interval=DEFAULT_AUDIT_INTERVAL,
 ):
     """Sync an operation until it either:
 
@@ -51,13 +50,19 @@ def sync(
     exception. This function will be called back with the exception and
     should return:
 
-    - False if the sync should continue to retry
+    - False if the sync should continue to retry (or return the exception,
+      if the success_criteria accepts it)
     - True if the sync should stop and the exception raised back to the caller
 
     By default, both success_criteria and error_criteria return True, causing
     all results and all errors to return and raise respectively. The default
     timeout is 120 seconds.
 
+    The retries are driven by ost_utils.polling.wait, which also records
+    the statistics of every sync in the session-wide wait stats registry.
+    Entities read during a sync bypass their snapshots, so the polled
+    state is always live.
+
     :param exec_func: callable
     :param exec_func_args: tuple/dict
     :param success_criteria: callable
@@ -66,64 +71,78 @@ def sync(
     :param retry_interval: time between retries of exec_func
     :param timeout: int
     :param sdk_entity: ovirtlib instance for which auditing to engine.log
-                       before each retry is desired
+                       of the retries is desired
+    :param strategy: ost_utils.polling strategy used instead of retrying
+                     every retry_interval seconds
+    :param audit_interval: the retries of a sync are audited to engine.log
+                           as one event per audit_interval seconds, 0
+                           audits each retry separately
     :return: the result of running the exec_func
     """
-    end_time = _monothonic_time() + timeout
-
     args, kwargs = _parse_args(exec_func_args)
     logger = SyncLogger(exec_func, args, kwargs)
+    auditor = _Auditor(exec_func, sdk_entity, audit_interval)
     logger.log_start()
     try:
-        time.sleep(delay_start)
-        _audit(exec_func, sdk_entity, 0)
-        result = exec_func(*args, **kwargs)
-        logger.log_iteration(0, result)
-    except Exception as e:
-        logger.log_iteration(0, e)
-        if error_criteria(e):
-            logger.log_end()
-            raise
-        result = e
-    else:
-        if success_criteria(result):
-            logger.log_end()
-            return result
-
-    i = 0
-    while _monothonic_time() < end_time:
-        i += 1
-        time.sleep(retry_interval)
-        try:
-            _audit(exec_func, sdk_entity, i)
-            result = exec_func(*args, **kwargs)
-            logger.log_iteration(i, result)
-        except Exception as e:
-            logger.log_iteration(i, e)
-            if success_criteria(e):
-                logger.log_end()
-                return e
-            if error_criteria(e):
-                logger.log_end()
-                raise
-            result = e
-        else:
-            if success_criteria(result):
-                logger.log_end()
-                return result
-
-    logger.log_end()
-    raise Timeout(result)
-
+        with sdkentity.live_reads():
+            return polling.wait(
+                exec_func,
+                args,
+                kwargs,
+                success_criteria=success_criteria,
+                error_criteria=error_criteria,
+                timeout=timeout,
+                strategy=strategy or polling.FixedInterval(retry_interval),
+                delay_start=delay_start,
+                before_attempt=auditor.retry,
+                after_attempt=logger.log_iteration,
+            )
+    finally:
+        auditor.flush()
+        logger.log_end()
+
+
+class _Auditor:
+    """
+    Audits the retries of a sync to engine.log. The first retry is audited
+    right away, the following ones are batched into one event per
+    'interval' seconds, each of them costing a REST call (plus the GETs done
+    by the repr() of the entity).
+    """
 
-def _audit(exec_func, sdk_entity, i):
-    if sdk_entity:
+    def __init__(self, exec_func, sdk_entity, interval):
+        self._func_name = exec_func.__name__
+        self._sdk_entity = sdk_entity
+        self._interval = interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def retry(self, i):
+        if not self._sdk_entity:
+            return
+        self._pending.append((i, time.strftime('%H:%M:%S')))
+        if i == 0 or time.monotonic() - self._last_flush >= self._interval:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        first, first_time = self._pending[0]
+        last, last_time = self._pending[-1]
+        self._pending = []
+        self._last_flush = time.monotonic()
+        if first == last:
+            retries = f'retry[{first}]'
+        else:
+            retries = f'retry[{first}-{last}] {first_time}-{last_time}'
         try:
-            repr = sdk_entity.__repr__()
+            repr = self._sdk_entity.__repr__()
         except Exception:
-            repr = f'{sdk_entity.__class__.__name__}.__repr__() call failed'
-        eventlib.EngineEvents(sdk_entity.system).add(
-            f'{DELIM} OST - retry[{i}] {exec_func.__name__}: {repr}'
+            repr = (
+                f'{self._sdk_entity.__class__.__name__}.__repr__() call failed'
+            )
+        eventlib.EngineEvents(self._sdk_entity.system).add(
+            f'{DELIM} OST - {retries} {self._func_name}: {repr}'
         )
 
 
@@ -150,10 +169,6 @@ def _parse_args(exec_func_args):
     return args, kwargs
 
 
-def _monothonic_time():
-    return os.times()[4]
-
-
 class SyncLogger:
     def __init__(self, exec_func, args, kwargs):
         self._func = exec_func
@@ -51,6 +51,7 @@ from ost_utils.pytest.fixtures.ansible import ansible_all
 from ost_utils.pytest.fixtures.ansible import ansible_by_hostname
 from ost_utils.pytest.fixtures.ansible import ansible_engine
 from ost_utils.pytest.fixtures.ansible import ansible_engine_facts
+from ost_utils.pytest.fixtures.ansible import ansible_facts_cache
 from ost_utils.pytest.fixtures.ansible import ansible_host0
 from ost_utils.pytest.fixtures.ansible import ansible_host0_facts
 from ost_utils.pytest.fixtures.ansible import ansible_host1
@@ -60,10 +61,12 @@ from ost_utils.pytest.fixtures.ansible import ansible_inventory
 from ost_utils.pytest.fixtures.ansible import ansible_storage
 from ost_utils.pytest.fixtures.artifacts import artifacts
 from ost_utils.pytest.fixtures.artifacts import artifacts_dir
+from ost_utils.pytest.fixtures.artifacts import artifact_collectors
 from ost_utils.pytest.fixtures.artifacts import artifact_list
 from ost_utils.pytest.fixtures.artifacts import collect_artifacts
 from ost_utils.pytest.fixtures.artifacts import dump_dhcp_leases
 from ost_utils.pytest.fixtures.artifacts import generate_sar_stat_plots
+from ost_utils.pytest.fixtures.artifacts import log_tailer
 from ost_utils.pytest.fixtures.backend import all_hostnames
 from ost_utils.pytest.fixtures.backend import backend
 from ost_utils.pytest.fixtures.backend import backend_engine_hostname
@@ -90,6 +93,7 @@ from ost_utils.pytest.fixtures.env import ost_images_distro
 from ost_utils.pytest.fixtures.env import root_dir
 from ost_utils.pytest.fixtures.env import ssh_key_file
 from ost_utils.pytest.fixtures.env import suite
+from ost_utils.pytest.fixtures.env import suite_dir
 from ost_utils.pytest.fixtures.env import working_dir
 from ost_utils.pytest.fixtures.network import management_network_name
 from ost_utils.pytest.fixtures.sdk import get_user_service_for_user
@@ -98,3 +102,5 @@ from ost_utils.pytest.fixtures.sdk import users_service
 from ost_utils.pytest.fixtures.virt import cirros_image_template_name
 from ost_utils.pytest.fixtures.virt import cirros_serial_console
 from ost_utils.pytest.fixtures.virt import rsa_pair
+
+from ost_utils.pytest.running_time import *
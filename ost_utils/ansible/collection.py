@@ -4,12 +4,31 @@
 #
 #
 
+import atexit
+import functools
 import json
+import logging
 import os
 import socket
+import subprocess
+import threading
+import uuid
 import yaml
 
 from ost_utils.shell import shell
+from ost_utils.shell import ShellError
+
+LOGGER = logging.getLogger(__name__)
+
+# Run all playbooks of the session in a single execution environment
+# container instead of starting a new one with ansible-navigator each time
+PERSISTENT_EE = os.environ.get('OST_ANSIBLE_PERSISTENT_EE', 'false') == 'true'
+# Subdirectory of the working dir holding the playbooks run in the
+# persistent container. Only it is mounted there with a private SELinux
+# label, never the working dir itself, which holds the VM images.
+EE_PLAYBOOKS_DIR = 'ee-playbooks'
+
+_log_lock = threading.Lock()
 
 
 def _run_playbook(
@@ -19,7 +38,11 @@ def _run_playbook(
     execution_environment_tag,
     ansible_inventory=None,
     ssh_key_path=None,
+    result_task=None,
 ):
+    """
+    Returns the result of the task named 'result_task', if given
+    """
     ansible_logs_path = os.path.join(artifacts_dir, 'ansible_logs')
 
     # Move of the run artifacts to the working_dir because
@@ -29,29 +52,69 @@ def _run_playbook(
     )
 
     os.makedirs(ansible_artifacts_tmp_dir, exist_ok=True)
+    # Every run gets its own playbook and artifacts, so that concurrent
+    # runs don't overwrite each other's
+    ident = uuid.uuid4().hex
     # Create playbook file from passed yaml
-    playbook_path = os.path.join(working_dir, 'playbook.yml')
+    if PERSISTENT_EE:
+        working_dir = os.path.join(working_dir, EE_PLAYBOOKS_DIR)
+        os.makedirs(working_dir, exist_ok=True)
+    playbook_path = os.path.join(working_dir, f'playbook-{ident}.yml')
     with open(playbook_path, "w") as file:
         yaml.dump(playbook_yaml, file)
 
     os.makedirs(ansible_logs_path, exist_ok=True)
 
+    run = _run_in_container if PERSISTENT_EE else _run_in_navigator
+    try:
+        stdout, result = run(
+            playbook_path,
+            ident,
+            ansible_logs_path,
+            ansible_artifacts_tmp_dir,
+            execution_environment_tag,
+            ansible_inventory,
+            ssh_key_path,
+            result_task,
+        )
+    finally:
+        os.remove(playbook_path)
+
+    log_path = os.path.join(ansible_logs_path, 'ansible-collection-stdout.log')
+    if stdout:
+        with _log_lock:
+            with open(log_path, 'a+') as file:
+                file.write(stdout + '\n')
+
+    return result
+
+
+def _network_backend_options():
+    network_backend = os.getenv('PODMAN_NETWORK_BACKEND')
+    if network_backend is None:
+        return "--network=slirp4netns:enable_ipv6=true"
+    else:
+        return f"--network={network_backend}:enable_ipv6=true"
+
+
+def _run_in_navigator(
+    playbook_path,
+    ident,
+    ansible_logs_path,
+    ansible_artifacts_tmp_dir,
+    execution_environment_tag,
+    ansible_inventory,
+    ssh_key_path,
+    result_task,
+):
     ansible_navigator_log_path = os.path.join(
         ansible_logs_path, 'ansible-navigator.log'
     )
 
     playbook_log_path = os.path.join(
-        ansible_logs_path, 'playbook-artifacts.json'
+        ansible_logs_path, f'playbook-artifacts-{ident}.json'
     )
 
-    network_backend = os.getenv('PODMAN_NETWORK_BACKEND')
-    if network_backend is None:
-        network_backend_options = "--network=slirp4netns:enable_ipv6=true"
-    else:
-        network_backend_options = (
-            f"--network={network_backend}:enable_ipv6=true"
-        )
-
     # Running the playbook inside a container
     cmd = [
         'ansible-navigator',
@@ -76,7 +139,7 @@ def _run_playbook(
         'debug',
         '--display-color',
         'false',
-        f'--container-options={network_backend_options}',
+        f'--container-options={_network_backend_options()}',
         '--container-options=--log-level=debug',
     ]
 
@@ -86,10 +149,180 @@ def _run_playbook(
 
     stdout = shell(cmd)
 
-    log_path = os.path.join(ansible_logs_path, 'ansible-collection-stdout.log')
-    if stdout:
-        with open(log_path, 'a+') as file:
-            file.write(stdout + '\n')
+    result = None
+    if result_task is not None:
+        result = _find_task_result(playbook_log_path, result_task)
+    return stdout, result
+
+
+def _find_task_result(playbook_log_path, task_name):
+    with open(playbook_log_path) as file:
+        data = json.load(file)
+        tasks = (data.get('plays')[0]).get('tasks')
+        for task in tasks:
+            if (
+                task.get('task') == task_name
+                and task.get('res', None) is not None
+            ):
+                return task.get('res')
+    return None
+
+
+def _run_in_container(
+    playbook_path,
+    ident,
+    ansible_logs_path,
+    ansible_artifacts_tmp_dir,
+    execution_environment_tag,
+    ansible_inventory,
+    ssh_key_path,
+    result_task,
+):
+    # ansible-runner's private data dir is created on the host, so that
+    # the artifacts of the run are kept in our artifacts directory
+    private_data_dir = os.path.join(ansible_artifacts_tmp_dir, ident)
+    os.makedirs(private_data_dir)
+    # Only the directories dedicated to the container get a private
+    # label. The inventory is shared with the ansible runs on the host,
+    # and the ssh key is mounted as is, like ansible-navigator does.
+    volumes = {
+        os.path.dirname(playbook_path): 'Z',
+        ansible_artifacts_tmp_dir: 'Z',
+        ssh_key_path: None,
+        ansible_inventory.dir if ansible_inventory else None: 'z',
+    }
+    container = ExecutionEnvironment.get(execution_environment_tag, volumes)
+
+    cmd = [
+        'ansible-runner',
+        'run',
+        private_data_dir,
+        '--playbook',
+        playbook_path,
+        '--ident',
+        ident,
+        '--json',
+        '-vvv',
+    ]
+    if ansible_inventory:
+        cmd.extend(['--inventory', ansible_inventory.dir])
+
+    # With '--json' every event is printed as a JSON line as soon as it
+    # happens, so the result is picked from the stream and no artifact
+    # needs to be parsed afterwards
+    stdout = []
+    result = None
+    process = container.exec(cmd)
+    for line in process.stdout:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            stdout.append(line.rstrip('\n'))
+            continue
+        if event.get('stdout'):
+            stdout.append(event['stdout'])
+        event_data = event.get('event_data', {})
+        if (
+            result_task is not None
+            and event_data.get('task') == result_task
+            and event_data.get('res') is not None
+        ):
+            result = event_data['res']
+    process.wait()
+    stdout = '\n'.join(stdout)
+    if process.returncode:
+        raise ShellError(process.returncode, stdout, '')
+    return stdout, result
+
+
+class ExecutionEnvironment:
+    """Long-lived execution environment container
+
+    Starting a container for every playbook run, as ansible-navigator does,
+    takes a couple of seconds each time. Instead one container is started
+    per image and set of mounted paths, kept idle for the whole session
+    and every playbook is run with 'podman exec' inside it. All paths are
+    mounted at the same location as on the host.
+
+    """
+
+    _lock = threading.Lock()
+    _containers = {}
+
+    def __init__(self, name):
+        self.name = name
+
+    @classmethod
+    def get(cls, image, volumes):
+        """
+        Args:
+            image (str): Tag of the execution environment image
+            volumes (dict): Paths to mount, each mapped to its SELinux
+                relabeling option ('z', 'Z') or None to mount it as is.
+                None paths are skipped.
+
+        Returns:
+            ExecutionEnvironment: The container running with these mounts
+        """
+        volumes = tuple(
+            sorted((path, option) for path, option in volumes.items() if path)
+        )
+        with cls._lock:
+            container = cls._containers.get((image, volumes))
+            if container is None:
+                container = cls._start(image, volumes)
+                cls._containers[(image, volumes)] = container
+            return container
+
+    @classmethod
+    def _start(cls, image, volumes):
+        name = f'ost-ee-{uuid.uuid4().hex[:12]}'
+        cmd = [
+            'podman',
+            'run',
+            '--detach',
+            '--rm',
+            '--name',
+            name,
+            '--pull',
+            'never',
+            _network_backend_options(),
+        ]
+        for path, option in volumes:
+            volume = f'{path}:{path}'
+            if option is not None:
+                volume = f'{volume}:{option}'
+            cmd.extend(['--volume', volume])
+        cmd.extend([image, 'sleep', 'infinity'])
+        LOGGER.debug('Starting execution environment container %s', name)
+        shell(cmd)
+        return cls(name)
+
+    @classmethod
+    def stop_all(cls):
+        with cls._lock:
+            containers = list(cls._containers.values())
+            cls._containers.clear()
+        for container in containers:
+            try:
+                shell(['podman', 'rm', '--force', container.name])
+            except ShellError:
+                LOGGER.warning(
+                    'Failed removing container %s',
+                    container.name,
+                    exc_info=True,
+                )
+
+    def exec(self, cmd):
+        return subprocess.Popen(
+            ['podman', 'exec', self.name] + cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+
+atexit.register(ExecutionEnvironment.stop_all)
 
 
 def _get_role_playbook(role_name, host, **kwargs):
@@ -199,10 +432,9 @@ class CollectionMapper:
         self.ssh_key_path = ssh_key_path
 
     def __getattr__(self, name):
-        self.name = name
-        return self
+        return functools.partial(self._run_module, name)
 
-    def __call__(self, **kwargs):
+    def _run_module(self, name, **kwargs):
         playbook = f'''
         - hosts: {self.ansible_host}
           gather_facts: no
@@ -214,33 +446,17 @@ class CollectionMapper:
               shell: routel
               delegate_to: localhost
             - setup:
-            - ovirt.ovirt.{self.name}:
+            - ovirt.ovirt.{name}:
         '''
         playbook_yaml = yaml.safe_load(playbook)
-        playbook_yaml[0]['tasks'][-1][f'ovirt.ovirt.{self.name}'] = kwargs
+        playbook_yaml[0]['tasks'][-1][f'ovirt.ovirt.{name}'] = kwargs
 
-        _run_playbook(
+        return _run_playbook(
             playbook_yaml,
             self.working_dir,
             self.artifacts_dir,
             self.execution_environment_tag,
             self.ansible_inventory,
             self.ssh_key_path,
+            result_task=f'ovirt.ovirt.{name}',
         )
-
-        return self._collect_module_data()
-
-    def _collect_module_data(self):
-        playbook_log_path = os.path.join(
-            self.artifacts_dir, 'ansible_logs', 'playbook-artifacts.json'
-        )
-        with open(playbook_log_path) as file:
-            data = json.load(file)
-            tasks = (data.get('plays')[0]).get('tasks')
-            for task in tasks:
-                if (
-                    task.get('task') == f'ovirt.ovirt.{self.name}'
-                    and task.get('res', None) is not None
-                ):
-                    return task.get('res')
-        return None
@@ -4,12 +4,15 @@
 #
 #
 
+import json
 import logging
+import os
+import uuid
 
 import ansible_runner
 
 from ost_utils.debuginfo_utils import obj_info
-from ost_utils.ansible import private_dir as pd
+from ost_utils.ansible.connection import PersistentConnections
 
 LOGGER = logging.getLogger(__name__)
 
@@ -27,21 +30,40 @@ class ConfigBuilder:
         self.host_pattern = None
         self.module = None
         self.module_args = None
+        self.playbook = None
 
-    def prepare(self):
+    def prepare(self, private_data_dir):
+        if self.playbook is not None:
+            target = dict(
+                playbook=self._write_playbook(private_data_dir, self.playbook)
+            )
+        else:
+            target = dict(
+                host_pattern=self.host_pattern,
+                module=self.module,
+                module_args=self.module_args,
+            )
         config = ansible_runner.RunnerConfig(
             inventory=self.inventory,
             extravars=self.extravars,
-            host_pattern=self.host_pattern,
-            module=self.module,
-            module_args=self.module_args,
-            private_data_dir=pd.PrivateDir.get(),
+            **target,
+            private_data_dir=private_data_dir,
+            envvars=PersistentConnections.envvars(),
             quiet=True,
         )
         config.prepare()
         LOGGER.debug(f'ConfigBuilder prepare: {obj_info(config)}')
         return config
 
+    @staticmethod
+    def _write_playbook(private_data_dir, plays):
+        project_dir = os.path.join(private_data_dir, 'project')
+        os.makedirs(project_dir, exist_ok=True)
+        path = os.path.join(project_dir, f'ost-{uuid.uuid4().hex}.json')
+        with open(path, 'w') as playbook_file:
+            json.dump(plays, playbook_file)
+        return path
+
     def __str__(self):
         return (
             f'ConfigBuilder<inventory={self.inventory}, '
@@ -0,0 +1,82 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+
+import glob
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+CONTROL_PERSIST = '30m'
+
+
+class PersistentConnections:
+    """Keeps ansible's ssh connections to the VMs alive between runs
+
+    Every ansible_runner execution is a new ansible process. With ansible's
+    defaults it can reuse an ssh ControlMaster left behind by a previous
+    run only if that run finished less than 60 seconds ago, so a test that
+    runs modules less often pays a full ssh handshake (and python
+    interpreter discovery) on every module call.
+
+    This class provides the environment that makes all runs of a session
+    share one ControlMaster per host, kept alive for CONTROL_PERSIST after
+    its last use, with pipelining enabled so that a module call is a single
+    ssh round trip over the already established connection.
+
+    """
+
+    _lock = threading.Lock()
+    _control_dir = None
+
+    @classmethod
+    def envvars(cls):
+        control_path = os.path.join(cls._get_control_dir(), '%%C')
+        return {
+            'ANSIBLE_SSH_ARGS': (
+                '-C -o ControlMaster=auto '
+                f'-o ControlPersist={CONTROL_PERSIST}'
+            ),
+            'ANSIBLE_SSH_CONTROL_PATH': control_path,
+            'ANSIBLE_PIPELINING': 'True',
+        }
+
+    @classmethod
+    def cleanup(cls):
+        with cls._lock:
+            control_dir = cls._control_dir
+            cls._control_dir = None
+        if control_dir is None:
+            return
+        for socket_path in glob.glob(os.path.join(control_dir, '*')):
+            # The destination is required by ssh but not used, since
+            # the master is found through the control path
+            result = subprocess.run(
+                ['ssh', '-o', f'ControlPath={socket_path}', '-O', 'exit', '_'],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=False,
+            )
+            if result.returncode:
+                LOGGER.debug(
+                    'Failed stopping ssh master %s: %s',
+                    socket_path,
+                    result.stderr,
+                )
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+    @classmethod
+    def _get_control_dir(cls):
+        with cls._lock:
+            if cls._control_dir is None:
+                # unix socket paths are limited to ~108 characters, so the
+                # directory is kept short
+                cls._control_dir = tempfile.mkdtemp(prefix='ost-cp-')
+            return cls._control_dir
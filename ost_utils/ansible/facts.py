@@ -4,21 +4,203 @@
 #
 #
 
+import fnmatch
+import json
+import logging
+import os
+import threading
+
+from ost_utils.ansible.module_mappers import AnsibleExecutionError
+from ost_utils.ansible.module_mappers import ModuleMapper
+
+LOGGER = logging.getLogger(__name__)
+
+ALL_HOSTS = 'all'
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+FACTS_FILE_NAME = 'ansible-facts.json'
+
+# 'min' facts (hostname, fqdn, distribution...) are always gathered
+ALL_SUBSETS = 'all'
+NETWORK_SUBSET = '!all,network'
+
+
+class FactsCache:
+    """
+    Facts of the VMs of the inventory, shared by all Facts instances.
+
+    The first lookup of a host gathers facts of all hosts of the inventory
+    at once, ansible doing that in parallel, so that looking up the facts
+    of another host later on is free. Only the subsets asked for are
+    gathered and gathering more of them later merges them into what's
+    cached.
+
+    If 'path' is set, the facts are saved there, along with the boot id of
+    each VM, and reused by later pytest sessions for VMs that haven't
+    rebooted since.
+    """
+
+    def __init__(self, inventory, path=None, prefetch=True):
+        """
+        :param str inventory: path of the ansible inventory
+        :param str path: file to persist the facts to
+        :param bool prefetch: gather facts of all hosts when looking up
+         a host that isn't cached yet
+        """
+        self._inventory = inventory
+        self._path = path
+        self._prefetch = prefetch
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def get(self, host, gather_subset=ALL_SUBSETS, filter=None):
+        """
+        :param str host: inventory name of the host
+        :param str gather_subset: same as the 'gather_subset' parameter of
+         the 'setup' module
+        :param str filter: same as the 'filter' parameter of the 'setup'
+         module, applied to the cached facts
+        """
+        subsets = _positive_subsets(gather_subset)
+        with self._lock:
+            entry = self._get_entries().get(host)
+            if entry is None:
+                pattern = ALL_HOSTS if self._prefetch else host
+                self._gather(pattern, subsets, fallback=host)
+            elif not _covers(entry['subsets'], subsets):
+                self._gather(host, subsets)
+            entry = self._entries.get(host)
+            if entry is None:
+                raise RuntimeError(f'No facts gathered for {host}')
+            return _filtered(entry['facts'], filter)
+
+    def refresh(self, host, gather_subset=ALL_SUBSETS):
+        """Gathers facts of 'host' again, dropping what was cached"""
+        with self._lock:
+            self._get_entries().pop(host, None)
+            self._gather(host, _positive_subsets(gather_subset))
+
+    def invalidate(self, host=None):
+        """
+        Drops the cached facts of 'host', or of all hosts if None, so that
+        they are gathered again on the next lookup. To be called by tests
+        that change networking or anything else facts are used for.
+        """
+        with self._lock:
+            entries = self._get_entries()
+            if host is None:
+                entries.clear()
+            else:
+                entries.pop(host, None)
+            self._save()
+
+    def _gather(self, pattern, subsets, fallback=None):
+        try:
+            results = self._run(pattern, subsets)
+        except AnsibleExecutionError:
+            if fallback is None or fallback == pattern:
+                raise
+            # e.g. a VM that isn't up yet, try just the one we need
+            LOGGER.warning(
+                'Gathering facts of %s failed, gathering facts of %s only',
+                pattern,
+                fallback,
+                exc_info=True,
+            )
+            results = self._run(fallback, subsets)
+
+        for host, (boot_id, facts) in results.items():
+            entry = self._entries.get(host)
+            if entry is None or entry['boot_id'] != boot_id:
+                entry = {'boot_id': boot_id, 'subsets': [], 'facts': {}}
+                self._entries[host] = entry
+            entry['facts'].update(facts)
+            entry['subsets'] = sorted(set(entry['subsets']) | subsets)
+        self._save()
+
+    def _run(self, pattern, subsets):
+        with ModuleMapper(self._inventory, pattern).batch() as batch:
+            boot_ids = batch.command(f'cat {BOOT_ID_PATH}')
+            setup = batch.setup(gather_subset=_subset_arg(subsets))
+        return {
+            host: (
+                boot_ids.results_by_host[host]['stdout'].strip(),
+                res['ansible_facts'],
+            )
+            for host, res in setup.results_by_host.items()
+        }
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        if self._path is None or not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path) as facts_file:
+                entries = json.load(facts_file)
+        except (OSError, ValueError):
+            LOGGER.warning(
+                'Ignoring unreadable facts file %s', self._path, exc_info=True
+            )
+            return {}
+        if not entries:
+            return {}
+        try:
+            boot_ids = self._boot_ids(':'.join(entries))
+        except AnsibleExecutionError:
+            LOGGER.warning('Failed checking boot ids, ignoring saved facts')
+            return {}
+        return {
+            host: entry
+            for host, entry in entries.items()
+            if boot_ids.get(host) == entry['boot_id']
+        }
+
+    def _boot_ids(self, pattern):
+        with ModuleMapper(self._inventory, pattern).batch() as batch:
+            boot_ids = batch.command(f'cat {BOOT_ID_PATH}')
+        return {
+            host: res['stdout'].strip()
+            for host, res in boot_ids.results_by_host.items()
+        }
+
+    def _save(self):
+        if self._path is None:
+            return
+        tmp_path = self._path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as facts_file:
+                json.dump(self._entries, facts_file)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            LOGGER.warning(
+                'Failed saving facts to %s', self._path, exc_info=True
+            )
+
 
 class Facts:
     """
-    Uses ModuleMapper and gather_facts module to obtain and cache facts
+    Uses ModuleMapper and the setup module to obtain and cache facts
     about a VM.
     """
 
-    def __init__(self, module_mapper):
-        self._module_mapper = module_mapper
-        self._cache = {}
+    def __init__(self, module_mapper, cache=None, gather_subset=ALL_SUBSETS):
+        """
+        :param ModuleMapper module_mapper: mapper of a single VM
+        :param FactsCache cache: cache shared with other Facts instances,
+         a private one is used if None
+        :param str gather_subset: facts subsets needed by the callers
+        """
+        self._host = module_mapper.host_pattern
+        self._cache = cache or FactsCache(
+            module_mapper.inventory, prefetch=False
+        )
+        self._gather_subset = gather_subset
 
-    def get_all(self):
-        if not self._cache:
-            self.refresh()
-        return self._cache
+    def get_all(self, filter=None):
+        return self._cache.get(self._host, self._gather_subset, filter)
 
     def get(self, key):
         """
@@ -26,9 +208,44 @@ class Facts:
          to get a leaf value in the facts dict use -
          self.get('ansible_eth0').get('ipv4').get('address')
         """
-        if not self._cache:
-            self.refresh()
-        return self._cache[key]
+        return self.get_all()[key]
 
     def refresh(self):
-        self._cache = self._module_mapper.gather_facts()['ansible_facts']
+        self._cache.refresh(self._host, self._gather_subset)
+
+
+def facts_file_path(working_dir):
+    if not working_dir:
+        return None
+    return os.path.join(working_dir, FACTS_FILE_NAME)
+
+
+def _positive_subsets(gather_subset):
+    if isinstance(gather_subset, str):
+        gather_subset = gather_subset.split(',')
+    return frozenset(
+        subset.strip()
+        for subset in gather_subset
+        if subset.strip() and not subset.strip().startswith('!')
+    )
+
+
+def _covers(gathered, subsets):
+    return ALL_SUBSETS in gathered or subsets.issubset(gathered)
+
+
+def _subset_arg(subsets):
+    if ALL_SUBSETS in subsets:
+        return ALL_SUBSETS
+    return ','.join(['!all'] + sorted(subsets))
+
+
+def _filtered(facts, filter):
+    if not filter:
+        return facts
+    patterns = filter.split(',') if isinstance(filter, str) else filter
+    return {
+        key: value
+        for key, value in facts.items()
+        if any(fnmatch.fnmatch(key, pattern) for pattern in patterns)
+    }
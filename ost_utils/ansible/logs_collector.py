@@ -4,54 +4,154 @@
 #
 #
 
+import gzip
 import json
+import logging
 import os
 import shutil
+import tempfile
+import threading
 
-from ost_utils.ansible import private_dir as pd
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = 'events.jsonl'
+RAW_EVENTS_FILE_NAME = 'raw-events.jsonl'
 
 
 class LogsCollector:
-    """Handles saving ansible logs from all ansible_runner executions"""
+    """Handles saving ansible logs from all ansible_runner executions
+
+    Events are collected as they happen: 'event_handler' is called with
+    every event of every ansible_runner execution and appends the event's
+    stdout to a log file of its host, a short summary of the event to a
+    JSON Lines index and the whole event to a JSON Lines file of raw
+    events. All of them are written to a staging directory, so that 'save'
+    only needs to move them to the artifacts directory, compressing the
+    raw events.
+
+    Host logs hold the events in the order they were reported, which for
+    events of the same host is the order they were created in.
+
+    """
+
+    _lock = threading.Lock()
+    _staging_dir = None
+    _log_files = {}
+    _index_file = None
+    _raw_file = None
+
+    @classmethod
+    def event_handler(cls, event):
+        try:
+            cls._append(event)
+        except Exception:
+            # losing a log line must never fail the module call
+            LOGGER.exception('Failed collecting ansible event')
 
     @classmethod
     def save(cls, target_dir):
         logs_path = os.path.join(target_dir, "ansible_logs")
-        raw_logs_path = os.path.join(logs_path, "raw")
-        os.makedirs(raw_logs_path, exist_ok=True)
+        os.makedirs(logs_path, exist_ok=True)
 
-        cls._save_raw_events(pd.PrivateDir.event_data_files(), raw_logs_path)
+        cls._flush(logs_path)
 
-        cls._save_events_stdouts(pd.PrivateDir.event_data_files(), logs_path)
+    @classmethod
+    def _append(cls, event):
+        entry = cls._index_entry(event)
+        with cls._lock:
+            index_file = cls._get_index_file()
+            index_file.write(json.dumps(entry) + '\n')
+            raw_file = cls._get_raw_file()
+            raw_file.write(json.dumps(event) + '\n')
+            if cls._should_include_event(event):
+                log_file = cls._get_log_file(entry['host'])
+                log_file.write(event['stdout'])
+                log_file.write('\n')
 
     @classmethod
-    def _save_raw_events(cls, event_data_files, target_dir):
-        for event_file in event_data_files:
-            shutil.copy(event_file, target_dir)
+    def _index_entry(cls, event):
+        event_data = event.get('event_data', {})
+        return {
+            'uuid': event.get('uuid'),
+            'runner_ident': event.get('runner_ident'),
+            'counter': event.get('counter'),
+            'created': event.get('created'),
+            'event': event.get('event'),
+            'host': event_data.get('host'),
+            'task': event_data.get('task'),
+            'duration': event_data.get('duration'),
+        }
 
     @classmethod
-    def _save_events_stdouts(cls, event_data_files, target_dir):
-        all_events = cls._load_events(event_data_files)
+    def _get_index_file(cls):
+        if cls._index_file is None:
+            path = os.path.join(cls._get_staging_dir(), INDEX_FILE_NAME)
+            cls._index_file = open(path, 'a')
+        return cls._index_file
 
-        for host, events in all_events.items():
-            log_path = os.path.join(target_dir, host)
-            with open(log_path, 'w') as log_file:
-                for event in sorted(events, key=lambda e: e['created']):
-                    log_file.write(event['stdout'])
-                    log_file.write('\n')
+    @classmethod
+    def _get_raw_file(cls):
+        if cls._raw_file is None:
+            path = os.path.join(cls._get_staging_dir(), RAW_EVENTS_FILE_NAME)
+            cls._raw_file = open(path, 'a')
+        return cls._raw_file
 
     @classmethod
-    def _load_events(cls, event_data_files):
-        events = {}
+    def _get_log_file(cls, host):
+        log_file = cls._log_files.get(host)
+        if log_file is None:
+            log_dir = os.path.join(cls._get_staging_dir(), 'hosts')
+            os.makedirs(log_dir, exist_ok=True)
+            log_file = open(os.path.join(log_dir, host), 'a')
+            cls._log_files[host] = log_file
+        return log_file
 
-        for path in event_data_files:
-            with open(path) as event_file:
-                event = json.load(event_file)
-                if cls._should_include_event(event):
-                    host = event['event_data']['host']
-                    events.setdefault(host, []).append(event)
+    @classmethod
+    def _get_staging_dir(cls):
+        if cls._staging_dir is None:
+            cls._staging_dir = tempfile.mkdtemp(prefix='ost-ansible-logs-')
+        return cls._staging_dir
 
-        return events
+    @classmethod
+    def _flush(cls, target_dir):
+        with cls._lock:
+            staging_dir = cls._staging_dir
+            for log_file in cls._log_files.values():
+                log_file.close()
+            for stream in (cls._index_file, cls._raw_file):
+                if stream is not None:
+                    stream.close()
+            cls._log_files = {}
+            cls._index_file = None
+            cls._raw_file = None
+            cls._staging_dir = None
+
+        if staging_dir is None:
+            return
+
+        hosts_dir = os.path.join(staging_dir, 'hosts')
+        if os.path.isdir(hosts_dir):
+            for host in os.listdir(hosts_dir):
+                shutil.move(
+                    os.path.join(hosts_dir, host),
+                    os.path.join(target_dir, host),
+                )
+        index_path = os.path.join(staging_dir, INDEX_FILE_NAME)
+        if os.path.exists(index_path):
+            shutil.move(index_path, os.path.join(target_dir, INDEX_FILE_NAME))
+        raw_path = os.path.join(staging_dir, RAW_EVENTS_FILE_NAME)
+        if os.path.exists(raw_path):
+            cls._compress(
+                raw_path,
+                os.path.join(target_dir, RAW_EVENTS_FILE_NAME + '.gz'),
+            )
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    @classmethod
+    def _compress(cls, source_path, target_path):
+        with open(source_path, 'rb') as source:
+            with gzip.open(target_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
 
     @classmethod
     def _should_include_event(cls, event):
@@ -59,11 +159,6 @@ class LogsCollector:
         if len(event.get('stdout', '')) == 0:
             return False
 
-        # if we can't sort an event by its creation time
-        # we can't log it in an understandable way
-        if event.get('created', None) is None:
-            return False
-
         # logs are grouped by host, so we need this information
         if event.get('event_data', {}).get('host', None) is None:
             return False
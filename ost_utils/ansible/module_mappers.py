@@ -4,11 +4,17 @@
 #
 #
 
+import collections
+import contextlib
 import logging
+import threading
+import time
 
 import ansible_runner
 
 from ost_utils.ansible import config_builder as cb
+from ost_utils.ansible import private_dir as pd
+from ost_utils.ansible.logs_collector import LogsCollector
 from ost_utils.debuginfo_utils import obj_info
 
 LOGGER = logging.getLogger(__name__)
@@ -23,17 +29,73 @@ class AnsibleExecutionError(Exception):
         return f"Error running ansible: rc={self.rc}, stdout={self.stdout}"
 
 
-def _run_ansible_runner(config_builder):
-    runner = ansible_runner.Runner(config=config_builder.prepare())
-    LOGGER.debug(f'_run_ansible_runner: before run: {runner}')
-    runner.run()
-    LOGGER.debug(f'_run_ansible_runner: after run: {obj_info(runner)}')
+CallTiming = collections.namedtuple(
+    'CallTiming', ('module', 'host_pattern', 'total', 'startup', 'remote')
+)
+
+_call_timings = []
+_call_timings_lock = threading.Lock()
+
+
+def call_timings():
+    """Returns a CallTiming for each module call run so far, where 'total'
+    is the wall-clock time of the call, 'remote' the longest time any host
+    spent executing its tasks (all of them, for batched calls) and
+    'startup' the rest, spent on starting ansible, parsing the inventory
+    and connecting.
+    """
+    with _call_timings_lock:
+        return list(_call_timings)
+
+
+def _record_timing(config_builder, total, events):
+    # the tasks of a host run one after another, the hosts in parallel
+    per_host = collections.defaultdict(float)
+    for e in events:
+        if e.get('event', '').startswith('runner_on_') and 'event_data' in e:
+            event_data = e['event_data']
+            per_host[event_data.get('host')] += event_data.get('duration') or 0
+    remote = max(per_host.values(), default=0)
+    timing = CallTiming(
+        config_builder.module,
+        config_builder.host_pattern,
+        total,
+        max(total - remote, 0),
+        remote,
+    )
+    LOGGER.debug(f'_run_ansible_runner: {timing}')
+    with _call_timings_lock:
+        _call_timings.append(timing)
+
+
+def _run_ansible_runner(config_builder, find_result=None):
+    events = []
+
+    def event_handler(event):
+        events.append(event)
+        LogsCollector.event_handler(event)
+        # the event is already collected, there's no need for
+        # ansible_runner to write it to the private directory
+        return False
+
+    start_time = time.monotonic()
+    with pd.PrivateDir.lease() as private_data_dir:
+        runner = ansible_runner.Runner(
+            config=config_builder.prepare(private_data_dir),
+            event_handler=event_handler,
+        )
+        LOGGER.debug(f'_run_ansible_runner: before run: {runner}')
+        runner.run()
+        LOGGER.debug(f'_run_ansible_runner: after run: {obj_info(runner)}')
+        stdout = runner.stdout.read() if runner.status != 'successful' else ''
+
+    _record_timing(config_builder, time.monotonic() - start_time, events)
 
     # Always collect results, so that we log them
-    results = _find_result(runner.events)
+    results = (find_result or _find_result)(events)
 
     if runner.status != 'successful':
-        raise AnsibleExecutionError(rc=runner.rc, stdout=runner.stdout.read())
+        raise AnsibleExecutionError(rc=runner.rc, stdout=stdout)
 
     return results
 
@@ -68,6 +130,15 @@ def _find_result(ansible_events):
     return results
 
 
+def _module_args(args, kwargs):
+    return " ".join(
+        (
+            " ".join(args),
+            " ".join("{}={}".format(k, v) for k, v in kwargs.items()),
+        )
+    ).strip()
+
+
 class ModuleArgsMapper:
     """Passes ansible module arguments to ansible_runner's config.
 
@@ -92,12 +163,7 @@ class ModuleArgsMapper:
         self.config_builder.module = module
 
     def __call__(self, *args, **kwargs):
-        self.config_builder.module_args = " ".join(
-            (
-                " ".join(args),
-                " ".join("{}={}".format(k, v) for k, v in kwargs.items()),
-            )
-        ).strip()
+        self.config_builder.module_args = _module_args(args, kwargs)
         LOGGER.debug(
             'ModuleArgsMapper: __call__: '
             f'module_args={self.config_builder.module_args}'
@@ -132,6 +198,27 @@ class ModuleMapper:
         LOGGER.debug(f'ModuleMapper __getattr__: {res}')
         return res
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Runs several module calls as a single ansible execution.
+
+        Calls made on the yielded object are queued and run as the tasks
+        of one ad-hoc playbook when the 'with' block ends, i.e.:
+
+            with ansible_hosts.batch() as b:
+                copied = b.copy(src='/foo', dest='/bar')
+                b.systemd(name='foo', state='restarted')
+            copied.result  # the result of the 'copy' task
+
+        pays the ansible startup cost once instead of twice. The tasks run
+        in order and a failing one raises 'AnsibleExecutionError', like
+        a standalone module call would.
+
+        """
+        batch = Batch(self.inventory, self.host_pattern)
+        yield batch
+        batch.run()
+
     def __str__(self):
         return (
             'ModuleMapper<'
@@ -139,3 +226,87 @@ class ModuleMapper:
             f'host_pattern={self.host_pattern}'
             '>'
         )
+
+
+class BatchedCall:
+    """A module call queued in a Batch, with its result once it ran
+
+    'result' follows the convention of standalone module calls, i.e. it's
+    the result itself if the call ran on a single host, and a dict of
+    results by host otherwise. 'results_by_host' is always the latter.
+    """
+
+    def __init__(self, module, module_args):
+        self.module = module
+        self.module_args = module_args
+        self.result = None
+        self.results_by_host = {}
+
+
+class Batch:
+    """Queues module calls and runs them as tasks of a single playbook"""
+
+    def __init__(self, inventory, host_pattern):
+        self.inventory = inventory
+        self.host_pattern = host_pattern
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            call = BatchedCall(name, _module_args(args, kwargs))
+            LOGGER.debug(f'Batch: queued {name} {call.module_args}')
+            self.calls.append(call)
+            return call
+
+        return queue
+
+    def run(self):
+        if not self.calls:
+            return
+        config_builder = cb.ConfigBuilder()
+        config_builder.inventory = self.inventory
+        config_builder.host_pattern = self.host_pattern
+        config_builder.module = ','.join(call.module for call in self.calls)
+        config_builder.playbook = [
+            {
+                'hosts': self.host_pattern,
+                'gather_facts': False,
+                # a failing task must stop the tasks queued after it on
+                # all the hosts, not only on the one it failed on
+                'any_errors_fatal': True,
+                'tasks': [
+                    {
+                        'name': self._task_name(idx),
+                        call.module: call.module_args,
+                    }
+                    for idx, call in enumerate(self.calls)
+                ],
+            }
+        ]
+        _run_ansible_runner(config_builder, self._assign_results)
+
+    def _assign_results(self, ansible_events):
+        results = {}
+        for event in ansible_events:
+            event_data = event.get('event_data', {})
+            res = event_data.get('res')
+            if res is not None and event_data.get('task') is not None:
+                task_results = results.setdefault(event_data['task'], {})
+                task_results[event_data['host']] = res
+
+        if not results:
+            LOGGER.error('No result from ansible-runner')
+            raise RuntimeError('No result from ansible-runner')
+
+        for idx, call in enumerate(self.calls):
+            task_results = results.get(self._task_name(idx), {})
+            call.results_by_host = task_results
+            if len(task_results) == 1:
+                call.result = next(iter(task_results.values()))
+            elif task_results:
+                call.result = task_results
+        return [call.result for call in self.calls]
+
+    @staticmethod
+    def _task_name(idx):
+        return f'ost-batch-{idx}'
@@ -4,51 +4,99 @@
 #
 #
 
+import contextlib
 import glob
-import itertools
 import os
 import shutil
 import tempfile
 import threading
 
+from ost_utils import utils
+
+# Every ansible_runner execution leaves a directory with its stdout, rc,
+# status etc. in 'artifacts'. Only this many of the most recent ones are
+# kept in each private directory, for debugging.
+ARTIFACT_RUNS_KEPT = 3
+
+# How many ansible_runner executions may run at the same time, each one
+# in its own private directory. The default covers a full shared worker
+# pool (utils.MAX_WORKERS) plus the main thread. Nested fan-outs run on
+# private pools that aren't bounded by it, so their extra runs wait for
+# a directory to be returned.
+MAX_PRIVATE_DIRS = int(
+    os.environ.get('OST_ANSIBLE_MAX_PRIVATE_DIRS', utils.MAX_WORKERS + 1)
+)
+
 
 class PrivateDir:
-    """Creates private directories for ansible_runner
+    """Pool of private directories for ansible_runner
 
     ansible_runner requires providing a path to a "private directory".
-    It uses the private directory to cache stuff.
+    It writes the inventory, the environment, the playbook and the
+    artifacts of each run there.
 
-    When 2 different tests ask for some VM facts, it's good to use the same
-    private directory for both calls. If we don't do that, we'll be gathering
-    facts about the VMs every time, which would slow down OST noticeably.
+    Two runs can't share the private directory at the same time, so each
+    run leases one from the pool and returns it once done. At most
+    'max_dirs' (MAX_PRIVATE_DIRS) directories are created; a run started
+    when all of them are in use waits for one to be returned.
 
-    There's one quirk with this approach - if someone tries to query VM
-    facts from 2 different threads at once, ansible_runner will fail
-    saying that "the private directory should not exist". That's why we need
-    to have one private directory per thread.
+    When a directory is returned, the artifacts of its older runs are
+    removed. The events of the runs aren't kept there at all, since they're
+    passed to LogsCollector as they happen.
 
     """
 
-    thread_local = threading.local()
+    max_dirs = MAX_PRIVATE_DIRS
     all_dirs = set()
 
+    _cond = threading.Condition()
+    _idle = []
+
+    @classmethod
+    @contextlib.contextmanager
+    def lease(cls):
+        path = cls._acquire()
+        try:
+            yield path
+        finally:
+            cls._prune(path)
+            cls._release(path)
+
     @classmethod
-    def get(cls):
-        if 'dir' not in cls.thread_local.__dict__:
-            path = tempfile.mkdtemp()
-            cls.thread_local.__dict__['dir'] = path
+    def cleanup(cls):
+        with cls._cond:
+            for dir in cls.all_dirs:
+                shutil.rmtree(dir)
+            cls.all_dirs.clear()
+            cls._idle.clear()
+
+    @classmethod
+    def _acquire(cls):
+        with cls._cond:
+            while not cls._idle and len(cls.all_dirs) >= cls.max_dirs:
+                cls._cond.wait()
+            if cls._idle:
+                return cls._idle.pop()
+            path = tempfile.mkdtemp(prefix='ost-ansible-')
             cls.all_dirs.add(path)
-        return cls.thread_local.__dict__['dir']
+            return path
 
     @classmethod
-    def event_data_files(cls):
-        return itertools.chain.from_iterable(
-            glob.iglob(os.path.join(dir, "artifacts/*/job_events/*.json"))
-            for dir in cls.all_dirs
-        )
+    def _release(cls, path):
+        with cls._cond:
+            # the directory may have been removed by 'cleanup' meanwhile
+            if path in cls.all_dirs:
+                cls._idle.append(path)
+                cls._cond.notify()
 
     @classmethod
-    def cleanup(cls):
-        for dir in cls.all_dirs:
-            shutil.rmtree(dir)
-        cls.all_dirs.clear()
+    def _prune(cls, path):
+        runs = sorted(
+            glob.glob(os.path.join(path, 'artifacts', '*')),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for run in runs[ARTIFACT_RUNS_KEPT:]:
+            shutil.rmtree(run, ignore_errors=True)
+        for playbook in glob.glob(os.path.join(path, 'project', 'ost-*')):
+            os.remove(playbook)
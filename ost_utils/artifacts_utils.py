@@ -0,0 +1,267 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import logging
+import os
+import shlex
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+from ost_utils import ssh
+from ost_utils import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# Only files up to this size are deduplicated, larger ones are logs that
+# differ between VMs anyway and aren't worth hashing
+DEDUP_MAX_SIZE = 1024 * 1024
+
+# Fetching the journal right before archiving gets all records we can
+JOURNAL_COMMAND = (
+    'journalctl -a --no-pager -o short-iso-precise > /var/log/journalctl.log'
+)
+
+# Seconds each collector run at the end of the session may take
+ARTIFACTS_BUDGET = 15 * 60
+SAR_PLOTS_BUDGET = 5 * 60
+COVERAGE_BUDGET = 15 * 60
+DHCP_LEASES_BUDGET = 60
+
+# A VM that can't be reached quickly is left to the ansible fallback
+SSH_TRIES = 3
+
+SSHTarget = collections.namedtuple('SSHTarget', ('address', 'ssh_key'))
+
+
+class Collectors:
+    """
+    Artifact collectors run together at the end of the session.
+
+    Every collector runs in its own thread and gets a time budget. Once
+    it's spent, the collector is given up on and reported as failed, so
+    that a stuck VM doesn't hold up the teardown. The thread is left
+    running in the background, as there's no way of stopping it.
+    """
+
+    def __init__(self):
+        self._collectors = {}
+
+    def add(self, name, func, budget):
+        """
+        Args:
+            name(str): Name of the collector, e.g. 'sar-plots'
+            func(callable): Called with no arguments to collect
+            budget(int): Seconds the collector is allowed to take
+        """
+        self._collectors[name] = (func, budget)
+
+    def run_all(self):
+        results = {}
+        threads = {}
+        start = time.monotonic()
+        for name, (func, budget) in self._collectors.items():
+            thread = threading.Thread(
+                target=self._run,
+                args=(name, func, results),
+                name=f'ost-collector-{name}',
+                daemon=True,
+            )
+            thread.start()
+            threads[name] = (thread, start + budget)
+
+        failures = []
+        for name, (thread, deadline) in sorted(
+            threads.items(), key=lambda item: item[1][1]
+        ):
+            thread.join(max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                budget = self._collectors[name][1]
+                LOGGER.error(
+                    f'Collector {name} did not finish in {budget}s, '
+                    'giving up on it'
+                )
+                failures.append((name, _timeout_exc_info(name, budget)))
+            elif 'exception' in results[name]:
+                LOGGER.error(
+                    f'Collector {name} failed',
+                    exc_info=results[name]['exception'],
+                )
+                failures.append((name, results[name]['exception']))
+            else:
+                LOGGER.info(
+                    f'Collector {name} finished in '
+                    f"{int(results[name]['duration'])}s"
+                )
+
+        if len(failures) == 1:
+            exc_info = failures[0][1]
+            raise exc_info[1].with_traceback(exc_info[2])
+        if failures:
+            raise utils.ParallelExecutionError(failures) from failures[0][1][1]
+
+    @staticmethod
+    def _run(name, func, results):
+        start = time.monotonic()
+        try:
+            func()
+            result = {}
+        except Exception:
+            result = {'exception': sys.exc_info()}
+        result['duration'] = time.monotonic() - start
+        results[name] = result
+
+
+def _timeout_exc_info(name, budget):
+    try:
+        raise concurrent.futures.TimeoutError(
+            f'Collector {name} did not finish in {budget} seconds'
+        )
+    except concurrent.futures.TimeoutError:
+        return sys.exc_info()
+
+
+def ssh_targets(inventory_dir):
+    """
+    Reads the addresses and ssh keys of the VMs from the ansible inventory,
+    i.e. lines like:
+
+        <host> ansible_host=<ip> ansible_ssh_private_key_file=<key> ...
+
+    Returns:
+        dict: host name -> SSHTarget
+    """
+    targets = {}
+    for path in sorted(glob.glob(os.path.join(inventory_dir, '*'))):
+        with open(path) as inventory_file:
+            for line in inventory_file:
+                if not line.strip() or line.lstrip()[0] in '[#;':
+                    continue
+                host, *variables = shlex.split(line)
+                variables = dict(v.partition('=')[::2] for v in variables)
+                if 'ansible_host' in variables:
+                    targets[host] = SSHTarget(
+                        variables['ansible_host'],
+                        variables.get('ansible_ssh_private_key_file'),
+                    )
+    return targets
+
+
+def stream_archive(
+    hostname, target, paths, target_dir, exclude=(), dump_journal=True
+):
+    """
+    Archives 'paths' on the VM and extracts the archive into 'target_dir'
+    while it's being transferred, over a pooled ssh connection. Paths
+    missing on the VM are skipped.
+
+    Args:
+        hostname(str): Name of the VM, for logging
+        target(SSHTarget): How to connect to the VM
+        paths(list of str): Absolute paths to archive
+        target_dir(str): Where to extract them, with the leading '/'
+            stripped, as ansible's 'archive' module does
+        exclude(list of str): Absolute paths not to archive, e.g. logs
+            that were already transferred
+        dump_journal(bool): Whether to write the journal to
+            /var/log/journalctl.log first
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    relative_paths = ' '.join(shlex.quote(p.lstrip('/')) for p in paths)
+    command = [f'{JOURNAL_COMMAND};'] if dump_journal else []
+    command += [
+        'tar --create --gzip --file=- --directory=/',
+        '--ignore-failed-read --warning=no-file-changed',
+        '--warning=no-failed-read',
+    ]
+    command += [shlex.quote(f"--exclude={p.lstrip('/')}") for p in exclude]
+    command.append(relative_paths)
+    with subprocess.Popen(
+        ['tar', '--extract', '--gzip', '--file=-', '--directory', target_dir],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as extract:
+        try:
+            status = ssh.stream(
+                target.address,
+                command,
+                extract.stdin.write,
+                host_name=hostname,
+                tries=SSH_TRIES,
+                ssh_key=target.ssh_key,
+            )
+            extract.stdin.close()
+        except BrokenPipeError:
+            # tar exited early, its error is reported below
+            status = None
+            with contextlib.suppress(BrokenPipeError):
+                extract.stdin.close()
+        extract_err = extract.stderr.read()
+        extract.wait()
+    if extract.returncode or status is None:
+        raise RuntimeError(
+            f'Extracting artifacts of {hostname} failed with '
+            f'rc={extract.returncode}: {extract_err}'
+        )
+    # 1 means some files changed while being archived, e.g. logs
+    if status.code not in (0, 1):
+        raise RuntimeError(
+            f'Archiving artifacts on {hostname} failed with '
+            f'rc={status.code}: {status.err}'
+        )
+
+
+def deduplicate(root_dir, max_size=DEDUP_MAX_SIZE):
+    """
+    Replaces identical files under 'root_dir', e.g. config files collected
+    from several VMs, by hard links to a single copy.
+
+    Returns:
+        int: Number of bytes saved
+    """
+    by_size = collections.defaultdict(list)
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            path_stat = os.lstat(path)
+            # skips links, sockets etc. and empty files
+            if (
+                stat.S_ISREG(path_stat.st_mode)
+                and 0 < path_stat.st_size <= max_size
+            ):
+                by_size[path_stat.st_size].append((path, path_stat))
+
+    saved = 0
+    for size, files in by_size.items():
+        if len(files) < 2:
+            continue
+        first_by_hash = {}
+        for path, path_stat in files:
+            digest = _sha256(path)
+            first = first_by_hash.setdefault(digest, (path, path_stat))
+            if first[0] == path or first[1].st_ino == path_stat.st_ino:
+                continue
+            tmp_path = f'{path}.ost-dedup'
+            os.link(first[0], tmp_path)
+            os.replace(tmp_path, path)
+            saved += size
+    LOGGER.debug(f'Deduplicating {root_dir} saved {saved} bytes')
+    return saved
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -5,7 +5,8 @@
 #
 
 import logging
-import time
+
+from ost_utils import polling
 
 
 LOGGER = logging.getLogger(__name__)
@@ -57,6 +58,25 @@ def true_within(func, timeout, allowed_exceptions=None, error_message=None):
 
 
 class EqualsWithin:
+    """
+    Poll func() until it returns expected_value or the timeout passes
+
+    Args:
+        func(callable): The condition to poll
+        expected_value: The value func() should eventually return
+        timeout(float): Seconds to keep polling for
+        allowed_exceptions(list): Exception types raised by func() that
+            don't stop the polling
+        error_message(str): Message used in repr() if the value was not
+            reached
+        sleep_interval(float): Poll at this fixed interval instead of using
+            'strategy'
+        strategy: Polling strategy providing the delays between polls,
+            polling.DEFAULT_STRATEGY by default
+        max_attempts(int): Stop after calling func() this many times, even
+            if the timeout hasn't passed yet
+    """
+
     def __init__(
         self,
         func,
@@ -64,7 +84,9 @@ class EqualsWithin:
         timeout,
         allowed_exceptions=None,
         error_message=None,
-        sleep_interval=3,
+        sleep_interval=None,
+        strategy=None,
+        max_attempts=None,
     ):
         self.expected_value = expected_value
         self.error_message = error_message
@@ -73,30 +95,46 @@ class EqualsWithin:
             f'{self.expected_value}'
         )
 
+        if strategy is None:
+            strategy = (
+                polling.DEFAULT_STRATEGY
+                if sleep_interval is None
+                else polling.FixedInterval(sleep_interval)
+            )
+
         self.returned_value = '<no-result-obtained>'
-        allowed_exceptions = allowed_exceptions or []
-        with _EggTimer(timeout) as timer:
-            while not timer.elapsed():
-                try:
-                    self.returned_value = func()
-                    if self.returned_value == self.expected_value:
-                        break
-                except Exception as exc:
-                    if any(isinstance(exc, cls) for cls in allowed_exceptions):
-                        time.sleep(sleep_interval)
-                        continue
-
-                    LOGGER.exception(
-                        'Unexpected exception in %s', func.__name__
-                    )
-                    raise
-
-                time.sleep(sleep_interval)
+        self.attempts = 0
+        allowed_exceptions = tuple(allowed_exceptions or [])
+
+        def poll():
+            self.attempts += 1
+            self.returned_value = func()
+            return self.returned_value
+
+        def unexpected(exc):
+            if isinstance(exc, allowed_exceptions):
+                return False
+            LOGGER.exception('Unexpected exception in %s', func.__name__)
+            return True
+
+        try:
+            polling.wait(
+                poll,
+                success_criteria=lambda value: value == self.expected_value,
+                error_criteria=unexpected,
+                timeout=timeout,
+                strategy=strategy,
+                max_attempts=max_attempts,
+                name=polling.condition_name(func),
+            )
+        except polling.Timeout:
+            pass
 
         if self.error_message is None:
             self.error_message = (
                 f'{func.__name__}() -> {self.returned_value} != '
-                f'{self.expected_value} after {timeout} seconds'
+                f'{self.expected_value} after {timeout} seconds '
+                f'({self.attempts} attempts)'
             )
 
     def __bool__(self):
@@ -104,18 +142,3 @@ class EqualsWithin:
 
     def __repr__(self):
         return self.success_message if bool(self) else self.error_message
-
-
-class _EggTimer:
-    def __init__(self, timeout):
-        self.timeout = timeout
-
-    def __enter__(self):
-        self.start_time = time.time()
-        return self
-
-    def __exit__(self, *_):
-        pass
-
-    def elapsed(self):
-        return (time.time() - self.start_time) > self.timeout
@@ -6,10 +6,12 @@
 
 import xml.etree.ElementTree as ET
 from collections import namedtuple
+from functools import cache
 
 from ost_utils.backend import base
 from ost_utils.shell import shell
 
+from ost_utils.backend.virsh import discovery
 from ost_utils.backend.virsh.networking import VirshNetworks
 from ost_utils.backend.virsh.networking import VMNics
 
@@ -21,15 +23,18 @@ class VirshBackend(base.BaseBackend):
         self._deployment_path = deployment_path
         self._ansible_inventory_str = None
 
-        self._networks = VirshNetworks(self._deployment_path)
-        self._vms = self._get_vms(self._deployment_path)
+        topology = discovery.discover(self._deployment_path)
+        self._networks = VirshNetworks(topology.networks)
+        self._vms = self._get_vms(topology.domains)
 
+    @cache
     def iface_mapping(self):
         return {
             vm_info.name: vm_info.nics.get_nics_for_all_networks()
             for vm_info in self._vms.values()
         }
 
+    @cache
     def ip_mapping(self):
         return {
             vm_info.name: vm_info.nics.get_ips_for_all_networks()
@@ -52,28 +57,18 @@ class VirshBackend(base.BaseBackend):
             ost_net_name
         ).libvirt_name
 
-    def _get_vms(self, deployment_path):
-        vm_names = [
-            name
-            for name in shell("virsh list --name".split()).splitlines()
-            if name[8:13] == "-ost-"
-        ]
+    def invalidate_cache(self):
+        """
+        Makes the next session discover the deployment again, for when
+        its networks or VMs were changed by the tests
+        """
+        discovery.invalidate(self._deployment_path)
 
+    def _get_vms(self, domain_xmls):
         vms = {}
 
-        for libvirt_name in vm_names:
-            xml_str = shell(f"virsh dumpxml {libvirt_name}".split()).strip()
+        for libvirt_name, xml_str in domain_xmls.items():
             xml = ET.fromstring(xml_str)
-
-            try:
-                vm_working_dir = xml.find(
-                    "./metadata/{OST:metadata}ost/ost-working-dir[@comment]"
-                ).get("comment")
-            except AttributeError:
-                continue
-            if vm_working_dir != deployment_path:
-                continue
-
             name = libvirt_name[9:]
             deploy_scripts = [
                 node.get("name")
@@ -0,0 +1,248 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+"""
+Discovery of the libvirt domains and networks of a deployment.
+
+All resources of a deployment share an 8 character UUID, domains are named
+'<uuid>-ost-<suite>-<vm>' and networks 'ost<uuid>-<subnet>', and carry the
+deployment directory in their 'ost-working-dir' metadata. On hypervisors
+running many OST environments most of the resources belong to other
+deployments, so they're filtered out by looking for the deployment
+directory in the raw XML before anything is parsed.
+
+The libvirt bindings are used when they're installed, so discovery doesn't
+run any subprocesses. Otherwise, all XMLs are dumped by a single virsh
+invocation.
+
+The XMLs found are cached in the deployment directory along with the
+UUID. As long as the resources with that UUID are the ones cached, only
+their names need to be listed, regardless of how many other environments
+are running.
+"""
+
+import json
+import logging
+import os
+import re
+import shlex
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+from ost_utils.shell import shell
+from ost_utils.shell import ShellError
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = 'virsh-topology.json'
+
+WORKING_DIR_XPATH = './metadata/{OST:metadata}ost/ost-working-dir[@comment]'
+
+# uuid, domains and networks are dicts of libvirt name -> XML string
+Topology = namedtuple('Topology', ('uuid', 'domains', 'networks'))
+
+_DOMAIN = 'domain'
+_NETWORK = 'network'
+
+_NETWORK_NAME_RE = re.compile(r'^ost([0-9a-f]{8})-')
+_XML_RE = re.compile(r'<(domain|network)\b.*?</\1>', re.DOTALL)
+_NAME_RE = re.compile(r'<name>([^<]+)</name>')
+
+
+def discover(deployment_path):
+    """
+    Args:
+        deployment_path(str): The deployment directory, i.e. $PREFIX
+
+    Returns:
+        Topology: The running domains and networks of the deployment
+    """
+    source = _LibvirtSource() if libvirt is not None else _VirshSource()
+    try:
+        return _discover(source, deployment_path)
+    finally:
+        source.close()
+
+
+def invalidate(deployment_path):
+    """
+    Drops the cached topology, for when the XML of the resources changed,
+    e.g. after a DHCP host was added to a network
+    """
+    try:
+        os.remove(os.path.join(deployment_path, CACHE_FILE_NAME))
+    except FileNotFoundError:
+        pass
+
+
+def _discover(source, deployment_path):
+    running = source.list()
+    cached = _load_cache(deployment_path)
+    if cached is not None:
+        own = _with_uuid(running, cached.uuid)
+        if own == {(_DOMAIN, name) for name in cached.domains} | {
+            (_NETWORK, name) for name in cached.networks
+        }:
+            return cached
+        if own:
+            # VMs were added or removed, but the deployment is the same
+            running = own
+
+    xmls = source.dump(sorted(running))
+    needle = escape(deployment_path, {'"': '&quot;'})
+    uuid = None
+    found = {_DOMAIN: {}, _NETWORK: {}}
+    for (kind, name), xml_str in xmls.items():
+        # most of the resources are from other deployments, only ours
+        # are worth parsing
+        if needle not in xml_str:
+            continue
+        node = ET.fromstring(xml_str).find(WORKING_DIR_XPATH)
+        if node is None or node.get('comment') != deployment_path:
+            continue
+        uuid = name[:8] if kind == _DOMAIN else name[3:11]
+        found[kind][name] = xml_str
+
+    topology = Topology(uuid, found[_DOMAIN], found[_NETWORK])
+    if uuid is not None:
+        _save_cache(deployment_path, topology)
+    return topology
+
+
+def _with_uuid(running, uuid):
+    return {
+        (kind, name)
+        for kind, name in running
+        if (kind == _DOMAIN and name.startswith(f'{uuid}-ost-'))
+        or (kind == _NETWORK and name.startswith(f'ost{uuid}-'))
+    }
+
+
+def _is_ost_domain(name):
+    return name[8:13] == '-ost-'
+
+
+def _is_ost_network(name):
+    return _NETWORK_NAME_RE.match(name) is not None
+
+
+def _load_cache(deployment_path):
+    try:
+        with open(os.path.join(deployment_path, CACHE_FILE_NAME)) as f:
+            cache = json.load(f)
+        return Topology(cache['uuid'], cache['domains'], cache['networks'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_cache(deployment_path, topology):
+    path = os.path.join(deployment_path, CACHE_FILE_NAME)
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(topology._asdict(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        LOGGER.debug(f'Failed caching the topology in {path}: {e}')
+
+
+class _LibvirtSource:
+    """Queries libvirt in-process through the python bindings"""
+
+    def __init__(self):
+        # same default connection URI as virsh
+        self._conn = libvirt.open(None)
+
+    def close(self):
+        self._conn.close()
+
+    def list(self):
+        return {
+            (_DOMAIN, domain.name())
+            for domain in self._conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE
+            )
+            if _is_ost_domain(domain.name())
+        } | {
+            (_NETWORK, network.name())
+            for network in self._conn.listAllNetworks(
+                libvirt.VIR_CONNECT_LIST_NETWORKS_ACTIVE
+            )
+            if _is_ost_network(network.name())
+        }
+
+    def dump(self, resources):
+        xmls = {}
+        for kind, name in resources:
+            lookup = (
+                self._conn.lookupByName
+                if kind == _DOMAIN
+                else self._conn.networkLookupByName
+            )
+            try:
+                xmls[(kind, name)] = lookup(name).XMLDesc(0)
+            except libvirt.libvirtError as e:
+                # resources of other deployments may come and go meanwhile
+                LOGGER.debug(f'Failed dumping {kind} {name}: {e}')
+        return xmls
+
+
+class _VirshSource:
+    """Queries libvirt with batched virsh commands"""
+
+    def close(self):
+        pass
+
+    def list(self):
+        # both lists are printed one after another, the names tell domains
+        # and networks apart
+        running = set()
+        for name in _virsh_batch(['list --name', 'net-list --name']).split():
+            if _is_ost_domain(name):
+                running.add((_DOMAIN, name))
+            elif _is_ost_network(name):
+                running.add((_NETWORK, name))
+        return running
+
+    def dump(self, resources):
+        xmls = {}
+        pending = list(resources)
+        while pending:
+            commands = [
+                f"{'dumpxml' if kind == _DOMAIN else 'net-dumpxml'} "
+                f"{shlex.quote(name)}"
+                for kind, name in pending
+            ]
+            try:
+                out = _virsh_batch(commands)
+                failed = False
+            except ShellError as e:
+                out = e.out
+                failed = True
+            for match in _XML_RE.finditer(out):
+                name = _NAME_RE.search(match.group(0))
+                if name is not None:
+                    xmls[(match.group(1), name.group(1))] = match.group(0)
+            pending = [
+                resource for resource in pending if resource not in xmls
+            ]
+            if not failed:
+                break
+            # virsh stops at the first command that failed, i.e. a resource
+            # of another deployment that went away, and the rest are retried
+            if pending:
+                LOGGER.debug(f'Failed dumping {pending[0]}')
+                pending = pending[1:]
+        return xmls
+
+
+def _virsh_batch(commands):
+    return shell(['virsh', '-q', ' ; '.join(commands)])
@@ -6,12 +6,20 @@
 import ipaddress
 import xml.etree.ElementTree as ET
 
-from ost_utils.shell import shell
+
+# DHCPv6 hosts are identified by DUIDs like '0:3:0:1:54:52:c0:a8:c8:02',
+# ending in the MAC address of the NIC
+MAC_OCTETS = 6
+
+
+def mac_suffix(mac_or_id):
+    return ":".join(mac_or_id.split(":")[-MAC_OCTETS:])
 
 
 class HostDhcps:
     def __init__(self, ip_node=ET.fromstring("<ip></ip>")):
         self._host_dhcps = {}
+        self._host_dhcps_by_mac_suffix = {}
         self._parse(ip_node)
 
     def __repr__(self):
@@ -23,11 +31,24 @@ class HostDhcps:
         for host_dhcp in ip_node.findall("./dhcp/host"):
             entry = HostDhcp(host_dhcp)
             self._host_dhcps[entry.mac_or_id] = entry
+            self._host_dhcps_by_mac_suffix.setdefault(
+                mac_suffix(entry.mac_or_id), entry
+            )
+
+    @property
+    def host_dhcps(self):
+        return self._host_dhcps
+
+    @property
+    def host_dhcps_by_mac_suffix(self):
+        return self._host_dhcps_by_mac_suffix
 
     def get_dhcp_by_mac_or_id(self, mac_or_id):
         return self._host_dhcps.get(mac_or_id)
 
     def get_host_dhcp_by_mac_suffix(self, suffix):
+        if len(suffix.split(":")) == MAC_OCTETS:
+            return self._host_dhcps_by_mac_suffix.get(suffix)
         for mac_or_id in self._host_dhcps:
             if mac_or_id.endswith(suffix):
                 return self._host_dhcps.get(mac_or_id)
@@ -62,10 +83,18 @@ class HostDhcp:
 
 
 class VirshNetworks:
-    def __init__(self, deployment_path):
+    def __init__(self, network_xmls):
+        """
+        Args:
+            network_xmls(dict): libvirt name -> XML string of the networks
+                of the deployment, as discovered by discovery.discover
+        """
         self._networks_by_ost_name = {}
         self._networks_by_libvirt_name = {}
-        self._load(deployment_path)
+        # MAC address -> host DHCP entry, of the first network having one
+        self._host_dhcps4_by_mac = {}
+        self._host_dhcps6_by_mac = {}
+        self._load(network_xmls)
 
     def __repr__(self):
         return (
@@ -74,26 +103,27 @@ class VirshNetworks:
             f"networks_by_libvirt_name: {self._networks_by_libvirt_name} >"
         )
 
-    def _load(self, deployment_path):
-        libvirt_net_names = self._get_libvirt_names_for_ost_nets_on_machine()
-        for name in libvirt_net_names:
+    def _load(self, network_xmls):
+        for name, xml_str in network_xmls.items():
             net = VirshNetwork(name)
-            net.load_xml()
-            if net.is_network_from_current_run(deployment_path):
-                net.parse()
-                self._push_item(net)
+            net.load_xml(xml_str)
+            net.parse()
+            self._push_item(net)
+        self._index()
 
     def _push_item(self, net):
         self._networks_by_ost_name[net.ost_name] = net
         self._networks_by_libvirt_name[net.libvirt_name] = net
 
-    def _get_libvirt_names_for_ost_nets_on_machine(self):
-        libvirt_net_names = [
-            name
-            for name in shell("virsh net-list --name".split()).splitlines()
-            if name.startswith("ost")
-        ]
-        return libvirt_net_names
+    def _index(self):
+        for network in self._networks_by_ost_name.values():
+            for mac, entry in network.host_dhcps4.host_dhcps.items():
+                self._host_dhcps4_by_mac.setdefault(mac, entry)
+            for (
+                mac,
+                entry,
+            ) in network.host_dhcps6.host_dhcps_by_mac_suffix.items():
+                self._host_dhcps6_by_mac.setdefault(mac, entry)
 
     def get_network_for_ost_name(self, ost_net_name):
         return self._networks_by_ost_name[ost_net_name]
@@ -107,18 +137,10 @@ class VirshNetworks:
         return host_dhcp4, host_dhcp6
 
     def find_host_dhcp4_for_mac(self, mac):
-        for network in self._networks_by_ost_name.values():
-            host_dhcp4 = network.get_dhcp4_entries_for_mac(mac)
-            if host_dhcp4 is not None:
-                return host_dhcp4
-        return None
+        return self._host_dhcps4_by_mac.get(mac)
 
     def find_host_dhcp6_for_mac(self, mac):
-        for network in self._networks_by_ost_name.values():
-            host_dhcp6 = network.get_dhcp6_entries_for_mac(mac)
-            if host_dhcp6 is not None:
-                return host_dhcp6
-        return None
+        return self._host_dhcps6_by_mac.get(mac)
 
 
 class VirshNetwork:
@@ -215,26 +237,12 @@ class VirshNetwork:
                 ).prefixlen
                 self._host_dhcps4 = HostDhcps(ip_node)
 
-    def is_network_from_current_run(self, deployment_path):
-        try:
-            return deployment_path == self._find_working_dir()
-        except AttributeError:
-            return False
-
     def _find_ost_name(self):
         self._ost_name = self._xml.find(
             "./metadata/{OST:metadata}ost/ost-network-type[@comment]"
         ).get("comment")
 
-    def _find_working_dir(self):
-        return self._xml.find(
-            "./metadata/{OST:metadata}ost/ost-working-dir[@comment]"
-        ).get("comment")
-
-    def load_xml(self):
-        xml_str = shell(
-            f"virsh net-dumpxml {self._libvirt_name}".split()
-        ).strip()
+    def load_xml(self, xml_str):
         self._xml = ET.fromstring(xml_str)
 
     @property
@@ -253,6 +261,14 @@ class VirshNetwork:
     def libvirt_name(self):
         return self._libvirt_name
 
+    @property
+    def host_dhcps4(self):
+        return self._host_dhcps4
+
+    @property
+    def host_dhcps6(self):
+        return self._host_dhcps6
+
     def get_dhcp4_entries_for_mac(self, mac):
         return self._host_dhcps4.get_dhcp_by_mac_or_id(mac)
 
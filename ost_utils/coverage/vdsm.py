@@ -33,27 +33,26 @@ source = vdsm, yajsonrpc'
 def setup(ansible_hosts):
     logging.debug('Setting up VDSM coverage...')
 
-    # ulgy workaround for FIPS...
-    ansible_hosts.replace(
-        path='/usr/lib64/python3.6/site-packages/coverage/misc.py',
-        regexp='md5',
-        replace='sha1',
-    )
-
-    ansible_hosts.copy(
-        dest=VDSM_COVERAGE_CONF_PATH, content=VDSM_COVERAGE_CONF
-    )
-
-    ansible_hosts.file(path=COVERAGE_DIR, state='directory', mode='0777')
-    ansible_hosts.copy(dest=COVERAGE_RC, content=COVERAGE_CONF)
-
-    added_line = f'COVERAGE_PROCESS_START="{COVERAGE_RC}"'
-    ansible_hosts.lineinfile(
-        path='/etc/sysconfig/vdsm', line=added_line, create=True
-    )
-    ansible_hosts.lineinfile(
-        path='/etc/sysconfig/supervdsmd', line=added_line, create=True
-    )
+    with ansible_hosts.batch() as batch:
+        # ulgy workaround for FIPS...
+        batch.replace(
+            path='/usr/lib64/python3.6/site-packages/coverage/misc.py',
+            regexp='md5',
+            replace='sha1',
+        )
+
+        batch.copy(dest=VDSM_COVERAGE_CONF_PATH, content=VDSM_COVERAGE_CONF)
+
+        batch.file(path=COVERAGE_DIR, state='directory', mode='0777')
+        batch.copy(dest=COVERAGE_RC, content=COVERAGE_CONF)
+
+        added_line = f'COVERAGE_PROCESS_START="{COVERAGE_RC}"'
+        batch.lineinfile(
+            path='/etc/sysconfig/vdsm', line=added_line, create=True
+        )
+        batch.lineinfile(
+            path='/etc/sysconfig/supervdsmd', line=added_line, create=True
+        )
 
 
 def collect(ansible_host0, ansible_hosts, output_path):
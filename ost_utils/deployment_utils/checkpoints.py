@@ -0,0 +1,343 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+"""
+Checkpoints of a running deployment, to get back to a known state without
+deploying and bootstrapping the environment all over again.
+
+The VMs are transient libvirt domains, so libvirt snapshots can't be used.
+Instead, taking a checkpoint pauses all VMs of the deployment and saves
+their memory state with 'virsh save'. Each qcow2 disk then becomes a
+read-only layer, 'images/<disk>.<checkpoint>', and the VM continues on a
+new, empty overlay of it. Restoring a checkpoint destroys the VMs,
+recreates the overlays on top of the checkpoint's layers and restores the
+saved memory state, so both the disks and the guests (running services,
+sessions, caches) are exactly as they were when the checkpoint was taken.
+
+Layers are never written to, so all checkpoints stay restorable no matter
+which one was restored last. Disks that the guest sees as raw can't be
+layered and are copied instead, as cheaply as the filesystem allows.
+
+Usage:
+    python -m ost_utils.deployment_utils.checkpoints create <name>
+    python -m ost_utils.deployment_utils.checkpoints restore <name>
+    python -m ost_utils.deployment_utils.checkpoints list
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+from ost_utils import utils
+from ost_utils.shell import shell
+from ost_utils.shell import ShellError
+
+LOGGER = logging.getLogger(__name__)
+
+CHECKPOINTS_DIR = 'checkpoints'
+METADATA_FILE_NAME = 'checkpoint.json'
+
+# taken at the end of the deployment when checkpoints are enabled
+DEPLOYED = 'deployed'
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def create(working_dir, name):
+    """
+    Takes a checkpoint of all VMs of the deployment. The VMs are paused
+    while it's taken and keep running afterwards.
+
+    Args:
+        working_dir(str): The deployment directory, i.e. $PREFIX
+        name(str): Name of the checkpoint, must not be taken yet
+    """
+    if not name or os.sep in name or name.startswith('.'):
+        raise CheckpointError(f'Invalid checkpoint name: {name!r}')
+    checkpoint_dir = _checkpoint_dir(working_dir, name)
+    if os.path.exists(checkpoint_dir):
+        raise CheckpointError(f'Checkpoint {name} already exists')
+    domains = _domains(working_dir)
+    if not domains:
+        raise CheckpointError(f'No VMs running for {working_dir}')
+
+    LOGGER.info(f'Taking checkpoint {name} of {sorted(domains)}')
+    os.makedirs(checkpoint_dir)
+    vms = {
+        libvirt_name: {
+            'state': f'{libvirt_name}.state',
+            'xml': f'{libvirt_name}.xml',
+            'disks': _disks(working_dir, xml, name),
+        }
+        for libvirt_name, xml in domains.items()
+    }
+    # pausing all VMs first keeps them consistent with each other, e.g.
+    # the engine and the hosts, while their memory is being saved
+    _on_all(_virsh, [('suspend', n) for n in vms])
+    saved = []
+
+    def save(libvirt_name):
+        _virsh(
+            'save',
+            libvirt_name,
+            os.path.join(checkpoint_dir, vms[libvirt_name]['state']),
+        )
+        saved.append(libvirt_name)
+
+    try:
+        _on_all(save, [(n,) for n in vms])
+        for libvirt_name in saved:
+            for disk in vms[libvirt_name]['disks']:
+                _add_layer(disk)
+            _write_restore_xml(checkpoint_dir, vms[libvirt_name])
+    finally:
+        unsaved = [n for n in vms if n not in saved]
+        if unsaved:
+            _on_all(_virsh, [('resume', n) for n in unsaved])
+        if saved:
+            _start(checkpoint_dir, {n: vms[n] for n in saved})
+
+    metadata = {
+        'name': name,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'vms': vms,
+    }
+    with open(os.path.join(checkpoint_dir, METADATA_FILE_NAME), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    LOGGER.info(f'Checkpoint {name} taken')
+
+
+def restore(working_dir, name):
+    """
+    Brings all VMs of the deployment back to the state they were in when
+    checkpoint 'name' was taken. VMs started after that are destroyed.
+
+    Args:
+        working_dir(str): The deployment directory, i.e. $PREFIX
+        name(str): Name of the checkpoint to restore
+    """
+    metadata = _load(working_dir, name)
+    checkpoint_dir = _checkpoint_dir(working_dir, name)
+    LOGGER.info(f'Restoring checkpoint {name}')
+
+    running = list(_domains(working_dir))
+    if running:
+        _on_all(_virsh, [('destroy', n) for n in running])
+    for vm in metadata['vms'].values():
+        for disk in vm['disks']:
+            _reset_to_layer(disk)
+    _start(checkpoint_dir, metadata['vms'])
+    LOGGER.info(f'Checkpoint {name} restored')
+
+
+def list_checkpoints(working_dir):
+    """
+    Returns:
+        list: Metadata of the checkpoints of the deployment, oldest first
+    """
+    checkpoints_dir = os.path.join(working_dir, CHECKPOINTS_DIR)
+    if not os.path.isdir(checkpoints_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(checkpoints_dir):
+        metadata_path = os.path.join(checkpoints_dir, name, METADATA_FILE_NAME)
+        # checkpoints without metadata weren't completed
+        if os.path.isfile(metadata_path):
+            with open(metadata_path) as f:
+                checkpoints.append(json.load(f))
+    return sorted(checkpoints, key=lambda c: c['created'])
+
+
+def exists(working_dir, name):
+    return os.path.isfile(
+        os.path.join(_checkpoint_dir(working_dir, name), METADATA_FILE_NAME)
+    )
+
+
+def _checkpoint_dir(working_dir, name):
+    return os.path.join(working_dir, CHECKPOINTS_DIR, name)
+
+
+def _load(working_dir, name):
+    if not exists(working_dir, name):
+        available = [c['name'] for c in list_checkpoints(working_dir)]
+        raise CheckpointError(
+            f'No checkpoint {name}, available checkpoints: {available}'
+        )
+    path = os.path.join(_checkpoint_dir(working_dir, name), METADATA_FILE_NAME)
+    with open(path) as f:
+        return json.load(f)
+
+
+def _domains(working_dir):
+    domains = {}
+    for libvirt_name in shell(['virsh', 'list', '--name']).splitlines():
+        if libvirt_name[8:13] != '-ost-':
+            continue
+        xml = ET.fromstring(shell(['virsh', 'dumpxml', libvirt_name]))
+        node = xml.find(
+            './metadata/{OST:metadata}ost/ost-working-dir[@comment]'
+        )
+        if node is not None and node.get('comment') == working_dir:
+            domains[libvirt_name] = xml
+    return domains
+
+
+def _disks(working_dir, xml, name):
+    disks = []
+    for disk in xml.findall("./devices/disk[@device='disk']"):
+        source = disk.find('./source[@file]')
+        if source is None:
+            continue
+        path = source.get('file')
+        if not path.startswith(working_dir + os.sep):
+            continue
+        driver = disk.find('./driver')
+        disks.append(
+            {
+                'path': path,
+                'layer': f'{path}.{name}',
+                'format': driver.get('type') if driver is not None else 'raw',
+            }
+        )
+    return disks
+
+
+def _add_layer(disk):
+    if os.path.exists(disk['layer']):
+        raise CheckpointError(f"Layer {disk['layer']} already exists")
+    if disk['format'] != 'qcow2':
+        shell(['cp', '--reflink=auto', disk['path'], disk['layer']])
+        return
+    os.replace(disk['path'], disk['layer'])
+    try:
+        _create_overlay(disk)
+    except ShellError:
+        os.replace(disk['layer'], disk['path'])
+        raise
+    os.chmod(disk['layer'], 0o444)
+
+
+def _reset_to_layer(disk):
+    if disk['format'] != 'qcow2':
+        shell(['cp', '--reflink=auto', disk['layer'], disk['path']])
+        return
+    if os.path.exists(disk['path']):
+        os.remove(disk['path'])
+    _create_overlay(disk)
+
+
+def _create_overlay(disk):
+    shell(
+        [
+            'qemu-img',
+            'create',
+            '-q',
+            '-f',
+            'qcow2',
+            '-b',
+            disk['layer'],
+            '-F',
+            'qcow2',
+            disk['path'],
+        ]
+    )
+
+
+def _write_restore_xml(checkpoint_dir, vm):
+    # The saved domain XML describes the backing chain the disks had when
+    # the state was saved, which doesn't include the checkpoint's layer.
+    # Leaving it out makes libvirt probe the chain of the overlays instead.
+    xml = ET.fromstring(
+        _virsh(
+            'save-image-dumpxml',
+            os.path.join(checkpoint_dir, vm['state']),
+        )
+    )
+    ET.register_namespace('ost', 'OST:metadata')
+    for disk in xml.findall('./devices/disk'):
+        for backing_store in disk.findall('./backingStore'):
+            disk.remove(backing_store)
+    with open(os.path.join(checkpoint_dir, vm['xml']), 'w') as f:
+        f.write(ET.tostring(xml, encoding='unicode'))
+
+
+def _start(checkpoint_dir, vms):
+    _on_all(
+        _virsh,
+        [_restore_args(checkpoint_dir, vm) for vm in vms.values()],
+    )
+    _on_all(_virsh, [('resume', n) for n in vms])
+    for libvirt_name in vms:
+        # the guests' clocks stopped while the VMs were saved
+        try:
+            _virsh('domtime', libvirt_name, '--now')
+        except ShellError as e:
+            LOGGER.warning(f'Failed syncing the clock of {libvirt_name}: {e}')
+
+
+def _restore_args(checkpoint_dir, vm):
+    args = ['restore', os.path.join(checkpoint_dir, vm['state']), '--paused']
+    xml_path = os.path.join(checkpoint_dir, vm['xml'])
+    # missing only if taking the checkpoint failed before the disks were
+    # layered, in which case the saved domain XML is still valid
+    if os.path.exists(xml_path):
+        args += ['--xml', xml_path]
+    return args
+
+
+def _virsh(*args):
+    return shell(['virsh'] + list(args))
+
+
+def _on_all(func, args_list):
+    utils.invoke_different_funcs_in_parallel(
+        *[functools.partial(func, *args) for args in args_list]
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ost_utils.deployment_utils.checkpoints',
+        description='Checkpoints of an OST deployment',
+    )
+    parser.add_argument(
+        '--working-dir',
+        default=os.environ.get('PREFIX'),
+        help='the deployment directory, $PREFIX by default',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('create').add_argument('name')
+    commands.add_parser('restore').add_argument('name')
+    commands.add_parser('list')
+    args = parser.parse_args(argv)
+
+    if not args.working_dir:
+        parser.error('no deployment directory, is lagofy.sh sourced?')
+    working_dir = os.path.realpath(args.working_dir)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        if args.command == 'create':
+            create(working_dir, args.name)
+        elif args.command == 'restore':
+            restore(working_dir, args.name)
+        else:
+            for checkpoint in list_checkpoints(working_dir):
+                print(f"{checkpoint['name']}\t{checkpoint['created']}")
+    except (CheckpointError, ShellError) as e:
+        LOGGER.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,545 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+"""
+Cache of deployed VM disks, to skip deploying environments that would end
+up exactly like one deployed before.
+
+Once a deployment succeeds, the disks of its VMs are copied into the cache
+directory, under a key hashed from everything the deployment depends on:
+the base images, ost.json, the deploy scripts, the custom repos, the
+addresses of the VMs etc. The guests' filesystems are frozen through the
+guest agent while their disks are copied, so the copies are consistent.
+A later deployment with the same key restarts its VMs on new overlays of
+the cached root disks, and copies of the other disks, instead of
+deploying. Cached root disks are read-only layers on top of the base
+images, so any number of deployments can share them.
+
+Restored VMs boot from the cached disks, so only what the deployment
+persisted survives. Settings applied to the running system only, e.g.
+in /proc or /sys, must be applied again at boot by the deploy scripts,
+e.g. from a systemd unit they enable.
+
+Copies are as cheap as the filesystem allows, i.e. reflinks where
+supported. Once the cache grows over its budget, the least recently used
+entries are evicted, except those a deployment directory still uses.
+
+The cache is enabled by setting OST_IMAGE_CACHE_DIR. OST_IMAGE_CACHE_BUDGET
+is its size in GiB, DEFAULT_BUDGET by default.
+
+Usage:
+    python -m ost_utils.deployment_utils.image_cache list
+    python -m ost_utils.deployment_utils.image_cache evict [--budget GIB]
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import xml.etree.ElementTree as ET
+
+from ost_utils import utils
+from ost_utils.shell import shell
+from ost_utils.shell import ShellError
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 100
+METADATA_FILE_NAME = 'entry.json'
+USERS_DIR = 'users'
+
+# bumped whenever what an entry contains changes
+FORMAT_VERSION = 1
+
+_GIB = 1024 ** 3
+
+
+class ImageCacheError(Exception):
+    pass
+
+
+def cache_dir():
+    """
+    Returns:
+        str: The cache directory, None if the cache is disabled
+    """
+    return os.environ.get('OST_IMAGE_CACHE_DIR') or None
+
+
+def budget():
+    """
+    Returns:
+        int: Bytes the cache may take
+    """
+    return int(
+        float(os.environ.get('OST_IMAGE_CACHE_BUDGET', DEFAULT_BUDGET)) * _GIB
+    )
+
+
+def key(inputs):
+    """
+    Args:
+        inputs(dict): Everything the deployment depends on, serializable
+            to JSON. Files are represented by their hashes, as returned by
+            file_digest, and base images by image_identity.
+
+    Returns:
+        str: The key of the deployment's entry
+    """
+    serialized = json.dumps(
+        {'format': FORMAT_VERSION, 'inputs': inputs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(serialized.encode()).hexdigest()[:32]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_identity(path):
+    # hashing images of several GiB every run would take longer than what
+    # the cache saves; images are replaced, not modified, when updated
+    image_stat = os.stat(path)
+    return [os.path.realpath(path), image_stat.st_size, image_stat.st_mtime]
+
+
+def base_images(working_dir):
+    """
+    Returns:
+        dict: VM name -> identities of the base images its disks are
+            layered on, as returned by image_identity
+    """
+    return {
+        _vm_name(libvirt_name): [
+            image_identity(backing_file)
+            for backing_file in (
+                _backing_file(disk['path'])
+                for disk in disks
+                if disk['format'] == 'qcow2'
+            )
+            if backing_file is not None
+        ]
+        for libvirt_name, disks in _deployment_disks(working_dir).items()
+    }
+
+
+def exists(cache_key):
+    directory = cache_dir()
+    return directory is not None and os.path.isfile(
+        os.path.join(directory, cache_key, METADATA_FILE_NAME)
+    )
+
+
+def commit(working_dir, cache_key, inputs=None):
+    """
+    Copies the disks of all VMs of the deployment into a new entry. The
+    guests' filesystems are frozen and the VMs paused meanwhile, and they
+    keep running afterwards. Nothing is cached if any of the filesystems
+    can't be frozen, e.g. because the guest agent isn't running.
+
+    Args:
+        working_dir(str): The deployment directory, i.e. $PREFIX
+        cache_key(str): As returned by 'key'
+        inputs(dict): What the key was hashed from, kept for reference
+    """
+    directory = cache_dir()
+    entry_dir = os.path.join(directory, cache_key)
+    if os.path.exists(entry_dir):
+        LOGGER.info(f'Image cache entry {cache_key} already exists')
+        return
+    domains = _deployment_disks(working_dir)
+    tmp_dir = f'{entry_dir}.tmp-{os.getpid()}'
+    os.makedirs(tmp_dir)
+    LOGGER.info(f'Caching the disks of {sorted(domains)} as {cache_key}')
+    frozen = []
+
+    def freeze(libvirt_name):
+        _virsh('domfsfreeze', libvirt_name)
+        frozen.append(libvirt_name)
+
+    try:
+        try:
+            # all of them are tried, so that the frozen ones are known
+            utils.invoke_different_funcs_in_parallel(
+                *[functools.partial(freeze, n) for n in domains]
+            )
+            _on_all(_virsh, [('suspend', n) for n in domains])
+            try:
+                # the entry is thrown away on any failed copy anyway
+                _on_all(
+                    _copy_disks,
+                    [(tmp_dir, disks) for disks in domains.values()],
+                    fail_fast=True,
+                )
+            finally:
+                _on_all(_virsh, [('resume', n) for n in domains])
+                for libvirt_name in domains:
+                    _sync_clock(libvirt_name)
+        finally:
+            # the guest agents only answer once the VMs run again
+            if frozen:
+                _on_all(_virsh, [('domfsthaw', n) for n in frozen])
+        now = _now()
+        metadata = {
+            'key': cache_key,
+            'created': now,
+            'last_used': now,
+            'size': _allocated_size(tmp_dir),
+            'inputs': inputs,
+            'vms': {
+                _vm_name(libvirt_name): [
+                    {'name': disk['name'], 'format': disk['format']}
+                    for disk in disks
+                ]
+                for libvirt_name, disks in domains.items()
+            },
+        }
+        _write_metadata(tmp_dir, metadata)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # committed meanwhile by another deployment with the same key
+        if not os.path.isfile(os.path.join(entry_dir, METADATA_FILE_NAME)):
+            raise
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    LOGGER.info(f'Image cache entry {cache_key} committed')
+    evict(budget(), keep=cache_key)
+
+
+def restore(working_dir, cache_key):
+    """
+    Restarts all VMs of the deployment on the disks of an entry. The VMs
+    are only touched once the entry is known to be complete, so when
+    ImageCacheError or FileNotFoundError (the entry was evicted) is raised
+    the deployment is still as it was and can be deployed instead.
+
+    Args:
+        working_dir(str): The deployment directory, i.e. $PREFIX
+        cache_key(str): As returned by 'key'
+    """
+    entry_dir = os.path.join(cache_dir(), cache_key)
+    metadata = _load_metadata(entry_dir)
+    domains = _deployment_disks(working_dir)
+    for libvirt_name, disks in domains.items():
+        cached = {
+            disk['name']
+            for disk in metadata['vms'].get(_vm_name(libvirt_name)) or ()
+        }
+        if cached != {disk['name'] for disk in disks}:
+            raise ImageCacheError(
+                f'Image cache entry {cache_key} has disks {sorted(cached)}, '
+                f'which are not the ones of {libvirt_name}'
+            )
+
+    # keeps the entry from being evicted from now on
+    _mark_used(entry_dir, working_dir)
+    missing = [
+        disk['name']
+        for disks in domains.values()
+        for disk in disks
+        if not os.path.isfile(os.path.join(entry_dir, disk['name']))
+    ]
+    if missing:
+        raise ImageCacheError(
+            f'Image cache entry {cache_key} is missing disks {missing}'
+        )
+
+    LOGGER.info(f'Restarting {sorted(domains)} on image cache {cache_key}')
+    _on_all(
+        _restart,
+        [(entry_dir, n, disks) for n, disks in domains.items()],
+    )
+
+
+def list_entries():
+    """
+    Returns:
+        list: Metadata of the entries, least recently used first
+    """
+    directory = cache_dir()
+    if directory is None or not os.path.isdir(directory):
+        return []
+    entries = []
+    for name in os.listdir(directory):
+        try:
+            entries.append(_load_metadata(os.path.join(directory, name)))
+        except (OSError, ValueError):
+            # incomplete entries are being committed, or were abandoned
+            continue
+    return sorted(entries, key=lambda e: e['last_used'])
+
+
+def evict(budget_bytes, keep=None):
+    """
+    Removes the least recently used entries not used by any deployment,
+    until the cache fits the budget
+
+    Returns:
+        list: Keys of the entries removed
+    """
+    entries = list_entries()
+    total = sum(entry['size'] for entry in entries)
+    evicted = []
+    for entry in entries:
+        if total <= budget_bytes:
+            break
+        entry_dir = os.path.join(cache_dir(), entry['key'])
+        if entry['key'] == keep or _in_use(entry_dir):
+            continue
+        LOGGER.info(
+            f"Evicting image cache entry {entry['key']}, last used "
+            f"{entry['last_used']}"
+        )
+        shutil.rmtree(entry_dir)
+        total -= entry['size']
+        evicted.append(entry['key'])
+    if total > budget_bytes:
+        LOGGER.warning(
+            f'Image cache takes {total // _GIB}GiB, over its budget of '
+            f'{budget_bytes // _GIB}GiB, but the rest is in use'
+        )
+    return evicted
+
+
+def _deployment_disks(working_dir):
+    domains = {}
+    for libvirt_name in shell(['virsh', 'list', '--name']).splitlines():
+        if libvirt_name[8:13] != '-ost-':
+            continue
+        xml = ET.fromstring(_virsh('dumpxml', libvirt_name))
+        node = xml.find(
+            './metadata/{OST:metadata}ost/ost-working-dir[@comment]'
+        )
+        if node is not None and node.get('comment') == working_dir:
+            domains[libvirt_name] = _disks(working_dir, xml)
+    if not domains:
+        raise ImageCacheError(f'No VMs running for {working_dir}')
+    return domains
+
+
+def _disks(working_dir, xml):
+    disks = []
+    for disk in xml.findall("./devices/disk[@device='disk']"):
+        source = disk.find('./source[@file]')
+        if source is None:
+            continue
+        path = source.get('file')
+        if not path.startswith(working_dir + os.sep):
+            continue
+        driver = disk.find('./driver')
+        disks.append(
+            {
+                'path': path,
+                'name': os.path.basename(path),
+                'format': driver.get('type') if driver is not None else 'raw',
+            }
+        )
+    return disks
+
+
+def _vm_name(libvirt_name):
+    # <uuid>-ost-<suite>-<vm>, the UUID differs between deployments
+    return libvirt_name[9:]
+
+
+def _copy_disks(target_dir, disks):
+    for disk in disks:
+        target = os.path.join(target_dir, disk['name'])
+        _copy(disk['path'], target)
+        if disk['format'] != 'qcow2':
+            continue
+        # the layer moved away from the base image, which a relative
+        # backing file name would no longer point to
+        backing_file = _backing_file(disk['path'])
+        if backing_file is not None:
+            shell(
+                [
+                    'qemu-img',
+                    'rebase',
+                    '-u',
+                    '-b',
+                    backing_file,
+                    '-F',
+                    'qcow2',
+                    target,
+                ]
+            )
+        # root disks become layers, which must never change
+        os.chmod(target, 0o444)
+
+
+def _restart(entry_dir, libvirt_name, disks):
+    xml = ET.fromstring(_virsh('dumpxml', '--inactive', libvirt_name))
+    ET.register_namespace('ost', 'OST:metadata')
+    # the backing chain is different now
+    for disk in xml.findall('./devices/disk'):
+        for backing_store in disk.findall('./backingStore'):
+            disk.remove(backing_store)
+    xml_path = os.path.join(
+        os.path.dirname(disks[0]['path']), f'{libvirt_name}.xml'
+    )
+    with open(xml_path, 'w') as f:
+        f.write(ET.tostring(xml, encoding='unicode'))
+
+    _virsh('destroy', libvirt_name)
+    for disk in disks:
+        cached = os.path.join(entry_dir, disk['name'])
+        os.remove(disk['path'])
+        if disk['format'] == 'qcow2':
+            shell(
+                [
+                    'qemu-img',
+                    'create',
+                    '-q',
+                    '-f',
+                    'qcow2',
+                    '-b',
+                    cached,
+                    '-F',
+                    'qcow2',
+                    disk['path'],
+                ]
+            )
+        else:
+            _copy(cached, disk['path'])
+    try:
+        _virsh('create', xml_path)
+    finally:
+        os.remove(xml_path)
+
+
+def _backing_file(path):
+    info = json.loads(shell(['qemu-img', 'info', '-U', '--output=json', path]))
+    return info.get('full-backing-filename')
+
+
+def _copy(source, target):
+    shell(['cp', '--reflink=auto', '--sparse=always', source, target])
+
+
+def _sync_clock(libvirt_name):
+    try:
+        _virsh('domtime', libvirt_name, '--now')
+    except ShellError as e:
+        LOGGER.warning(f'Failed syncing the clock of {libvirt_name}: {e}')
+
+
+def _mark_used(entry_dir, working_dir):
+    users_dir = os.path.join(entry_dir, USERS_DIR)
+    os.makedirs(users_dir, exist_ok=True)
+    user = hashlib.sha256(working_dir.encode()).hexdigest()[:16]
+    user_path = os.path.join(users_dir, user)
+    with open(user_path, 'w') as f:
+        f.write(working_dir)
+    try:
+        metadata = _load_metadata(entry_dir)
+    except FileNotFoundError:
+        # evicted meanwhile, what was just created mustn't look like an
+        # entry being committed
+        os.remove(user_path)
+        for directory in (users_dir, entry_dir):
+            with contextlib.suppress(OSError):
+                os.rmdir(directory)
+        raise
+    metadata['last_used'] = _now()
+    _write_metadata(entry_dir, metadata)
+
+
+def _in_use(entry_dir):
+    users_dir = os.path.join(entry_dir, USERS_DIR)
+    if not os.path.isdir(users_dir):
+        return False
+    in_use = False
+    for user in os.listdir(users_dir):
+        path = os.path.join(users_dir, user)
+        with open(path) as f:
+            working_dir = f.read()
+        # destroying a deployment removes its directory
+        if os.path.isdir(working_dir):
+            in_use = True
+        else:
+            os.remove(path)
+    return in_use
+
+
+def _allocated_size(directory):
+    return sum(
+        os.stat(os.path.join(dirpath, name)).st_blocks * 512
+        for dirpath, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def _load_metadata(entry_dir):
+    with open(os.path.join(entry_dir, METADATA_FILE_NAME)) as f:
+        return json.load(f)
+
+
+def _write_metadata(entry_dir, metadata):
+    path = os.path.join(entry_dir, METADATA_FILE_NAME)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _virsh(*args):
+    return shell(['virsh'] + list(args))
+
+
+def _on_all(func, args_list, fail_fast=False):
+    utils.invoke_different_funcs_in_parallel(
+        *[functools.partial(func, *args) for args in args_list],
+        fail_fast=fail_fast,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ost_utils.deployment_utils.image_cache',
+        description='Cache of deployed OST VM disks',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    evict_parser = commands.add_parser('evict')
+    evict_parser.add_argument(
+        '--budget',
+        type=float,
+        help='GiB to shrink the cache to, OST_IMAGE_CACHE_BUDGET by default',
+    )
+    args = parser.parse_args(argv)
+
+    if cache_dir() is None:
+        parser.error('OST_IMAGE_CACHE_DIR is not set')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'evict':
+        evict(int(args.budget * _GIB) if args.budget is not None else budget())
+    else:
+        for entry in list_entries():
+            print(
+                f"{entry['key']}\t{entry['size'] // 1024**2}MiB\t"
+                f"{entry['last_used']}\t{', '.join(sorted(entry['vms']))}"
+            )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+"""
+Leases of subnets and deployment UUIDs, shared by all OST environments on
+the machine.
+
+Each deployment claims the subnets of its networks and its UUID in a
+single SQLite transaction in a registry every OST checkout uses, so
+concurrent deployments never pick the same ones. Subnets of OST networks
+created without a lease, and subnets already routed on the machine, are
+never handed out. Checkouts that still pick subnets from the running
+networks don't see claims whose networks aren't created yet, so for the
+transition the provisioner claims and creates the networks holding
+/tmp/ost.lock, which those checkouts take around the same steps.
+
+A lease is released when its deployment is destroyed. If that doesn't
+happen, e.g. because the directory was removed by hand, the lease becomes
+stale once none of its networks are running anymore. Stale leases are
+reaped when subnets are claimed. Freshly claimed leases get a grace
+period, since their networks don't exist yet.
+
+Usage:
+    python -m ost_utils.deployment_utils.leases list
+    python -m ost_utils.deployment_utils.leases release
+    python -m ost_utils.deployment_utils.leases reap
+"""
+
+import argparse
+import contextlib
+import ipaddress
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+import uuid as uuid_lib
+from collections import namedtuple
+
+from ost_utils.shell import shell
+
+LOGGER = logging.getLogger(__name__)
+
+# next to /tmp/ost.lock, see provision.LOCK_FILE
+DEFAULT_DB_PATH = '/tmp/ost-leases.sqlite'
+
+# Networks are 192.168.<subnet>.0/24, fd8f:1391:3a82:<subnet>::/64, and
+# their MACs end with <subnet in hex>:<index>, so subnets can be up to
+# 255. The ones OST always used come first.
+DEFAULT_SUBNETS = list(range(200, 255)) + list(range(100, 200))
+
+# Seconds a claimed lease is kept without any of its networks running
+GRACE_PERIOD = 10 * 60
+
+# Seconds to wait for other deployments' claims to finish
+DB_TIMEOUT = 60
+
+Lease = namedtuple('Lease', ('uuid', 'subnets'))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS leases (
+    subnet INTEGER PRIMARY KEY,
+    uuid TEXT NOT NULL,
+    working_dir TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    claimed REAL NOT NULL
+)
+'''
+
+_OST_IPV4_SPACE = ipaddress.ip_network('192.168.0.0/16')
+
+
+class LeaseError(Exception):
+    pass
+
+
+def claim(working_dir, count, subnets=None, uuid=None, db_path=None):
+    """
+    Claims 'count' free subnets and a UUID for a new deployment. Leases
+    the deployment directory still has are released first, since a new
+    deployment can only be created once the old one is gone.
+
+    Args:
+        working_dir(str): The deployment directory, i.e. $PREFIX
+        count(int): Number of subnets, one per network
+        subnets(list of int): Candidate subnets, in order of preference,
+            OST_SUBNETS or DEFAULT_SUBNETS by default
+        uuid(str): UUID to claim, a random one by default
+        db_path(str): The registry, OST_LEASES_DB or DEFAULT_DB_PATH by
+            default
+
+    Returns:
+        Lease: The UUID and the subnets claimed
+    """
+    candidates = subnets if subnets is not None else configured_subnets()
+    running = _running_networks()
+    routed = _routed_subnets()
+    with _transaction(db_path) as db:
+        _reap(db, running)
+        db.execute('DELETE FROM leases WHERE working_dir = ?', (working_dir,))
+        leased = dict(db.execute('SELECT subnet, uuid FROM leases'))
+        taken = set(leased).union(*running.values()) | routed
+        free = [subnet for subnet in candidates if subnet not in taken]
+        if len(free) < count:
+            raise LeaseError(
+                f'no available subnet, {count} needed but only '
+                f'{len(free)} of {len(candidates)} free'
+            )
+        taken_uuids = set(leased.values()) | set(running)
+        if uuid is None:
+            uuid = _new_uuid(taken_uuids)
+        elif uuid in taken_uuids:
+            raise LeaseError(f'UUID {uuid} is taken')
+        lease = Lease(uuid, free[:count])
+        now = time.time()
+        db.executemany(
+            'INSERT INTO leases VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    subnet,
+                    uuid,
+                    working_dir,
+                    socket.gethostname(),
+                    os.getpid(),
+                    now,
+                )
+                for subnet in lease.subnets
+            ],
+        )
+    LOGGER.debug(f'Claimed {lease} for {working_dir}')
+    return lease
+
+
+def release(working_dir, db_path=None):
+    """
+    Releases the leases of a deployment, once its networks are destroyed
+    """
+    with _transaction(db_path) as db:
+        db.execute('DELETE FROM leases WHERE working_dir = ?', (working_dir,))
+
+
+def reap(db_path=None):
+    """
+    Releases stale leases
+
+    Returns:
+        list: The subnets released
+    """
+    running = _running_networks()
+    with _transaction(db_path) as db:
+        return _reap(db, running)
+
+
+def list_leases(db_path=None):
+    """
+    Returns:
+        list: dicts with the subnet, UUID, deployment directory, host, pid
+            and time of every lease, ordered by subnet
+    """
+    with _transaction(db_path) as db:
+        cursor = db.execute('SELECT * FROM leases ORDER BY subnet')
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+
+def configured_subnets():
+    """
+    Returns:
+        list: Subnets in OST_SUBNETS, e.g. '200-254,150-199', or
+            DEFAULT_SUBNETS
+    """
+    value = os.environ.get('OST_SUBNETS')
+    if not value:
+        return list(DEFAULT_SUBNETS)
+    subnets = []
+    for part in value.split(','):
+        first, _, last = part.strip().partition('-')
+        subnets += range(int(first), int(last or first) + 1)
+    invalid = [subnet for subnet in subnets if not 0 <= subnet <= 255]
+    if invalid:
+        raise LeaseError(f'Invalid subnets in OST_SUBNETS: {invalid}')
+    return subnets
+
+
+def _reap(db, running):
+    stale = [
+        subnet
+        for subnet, uuid in db.execute(
+            'SELECT subnet, uuid FROM leases WHERE claimed < ?',
+            (time.time() - GRACE_PERIOD,),
+        )
+        if uuid not in running
+    ]
+    if stale:
+        LOGGER.info(f'Releasing stale leases of subnets {stale}')
+        db.executemany(
+            'DELETE FROM leases WHERE subnet = ?', [(s,) for s in stale]
+        )
+    return stale
+
+
+def _new_uuid(taken):
+    while True:
+        candidate = uuid_lib.uuid4().hex[:8]
+        if candidate not in taken:
+            return candidate
+
+
+def _running_networks():
+    """
+    Returns:
+        dict: UUID -> subnets of the running OST networks, named
+            ost<uuid>-<subnet>, of all deployments on the machine
+    """
+    running = {}
+    for name in shell(['virsh', 'net-list', '--name']).split():
+        prefix, _, subnet = name.partition('-')
+        if prefix.startswith('ost') and subnet.isdigit():
+            running.setdefault(prefix[3:], set()).add(int(subnet))
+    return running
+
+
+def _routed_subnets():
+    # e.g. libvirt's default network on 192.168.122.0/24, or the LAN
+    routed = set()
+    try:
+        with open('/proc/net/route') as f:
+            routes = f.readlines()[1:]
+    except OSError:
+        return routed
+    for route in routes:
+        fields = route.split()
+        network = ipaddress.ip_network(
+            (
+                socket.inet_ntoa(bytes.fromhex(fields[1])[::-1]),
+                socket.inet_ntoa(bytes.fromhex(fields[7])[::-1]),
+            ),
+            strict=False,
+        )
+        if network.prefixlen < 16 or not network.subnet_of(_OST_IPV4_SPACE):
+            continue
+        for subnet in range(256):
+            if network.overlaps(
+                ipaddress.ip_network(f'192.168.{subnet}.0/24')
+            ):
+                routed.add(subnet)
+    return routed
+
+
+@contextlib.contextmanager
+def _transaction(db_path):
+    db_path = db_path or os.environ.get('OST_LEASES_DB', DEFAULT_DB_PATH)
+    # the registry is shared by all users in the qemu group
+    umask = os.umask(0o002)
+    try:
+        db = sqlite3.connect(db_path, timeout=DB_TIMEOUT, isolation_level=None)
+    finally:
+        os.umask(umask)
+    try:
+        # claims of concurrent deployments are serialized by sqlite
+        db.execute('BEGIN IMMEDIATE')
+        db.execute(_SCHEMA)
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ost_utils.deployment_utils.leases',
+        description='Subnet and UUID leases of OST deployments',
+    )
+    parser.add_argument(
+        '--working-dir',
+        default=os.environ.get('PREFIX'),
+        help='the deployment directory, $PREFIX by default',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    commands.add_parser('release')
+    commands.add_parser('reap')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'release':
+        if not args.working_dir:
+            parser.error('no deployment directory, is lagofy.sh sourced?')
+        release(os.path.realpath(args.working_dir))
+    elif args.command == 'reap':
+        reap()
+    else:
+        for lease in list_leases():
+            print(
+                f"{lease['subnet']}\t{lease['uuid']}\t{lease['working_dir']}"
+                f"\t{lease['host']}:{lease['pid']}\t"
+                + time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.localtime(lease['claimed'])
+                )
+            )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+
+from ost_utils import utils
+
+LOGGER = logging.getLogger(__name__)
+
+TIMELINE_FILE_NAME = 'deploy-timeline.json'
+
+Stage = collections.namedtuple(
+    'Stage', ('key', 'name', 'host', 'func', 'requires')
+)
+
+
+def stage_key(name, host=None):
+    return name if host is None else f'{host}:{name}'
+
+
+class Timeline:
+    """
+    Records when each deployment stage started and ended, relative to the
+    creation of the timeline, and finds the critical path among them.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._start = time.monotonic()
+        self._entries = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name, host=None, requires=()):
+        start = self._now()
+        outcome = 'failed'
+        try:
+            yield
+            outcome = 'succeeded'
+        finally:
+            self.record(name, host, requires, start, self._now(), outcome)
+
+    def record(self, name, host, requires, start, end, outcome):
+        entry = {
+            'stage': stage_key(name, host),
+            'name': name,
+            'host': host,
+            'requires': list(requires),
+            'start': round(start, 3),
+            'end': round(end, 3),
+            'duration': round(end - start, 3),
+            'outcome': outcome,
+        }
+        LOGGER.info(
+            f"[{host or 'all'}] Stage {name} {outcome} "
+            f"({int(entry['duration'])}s)"
+        )
+        with self._lock:
+            self._entries.append(entry)
+
+    def critical_path(self):
+        """
+        Returns:
+            list: keys of the chain of stages that determined when the last
+                stage ended, each one being the requirement of the next one
+                that ended last
+        """
+        with self._lock:
+            entries = {entry['stage']: entry for entry in self._entries}
+        if not entries:
+            return []
+        path = []
+        entry = max(entries.values(), key=lambda e: (e['end'], e['start']))
+        while entry is not None:
+            path.append(entry['stage'])
+            requirements = [
+                entries[key] for key in entry['requires'] if key in entries
+            ]
+            entry = max(
+                requirements,
+                key=lambda e: (e['end'], e['start']),
+                default=None,
+            )
+        return path[::-1]
+
+    def summary(self):
+        with self._lock:
+            entries = list(self._entries)
+        stages = {}
+        for entry in entries:
+            stage = stages.setdefault(
+                entry['name'], {'count': 0, 'total': 0.0, 'max': 0.0}
+            )
+            stage['count'] += 1
+            stage['total'] = round(stage['total'] + entry['duration'], 3)
+            stage['max'] = max(stage['max'], entry['duration'])
+        critical_path = self.critical_path()
+        by_key = {entry['stage']: entry for entry in entries}
+        return {
+            'duration': max((e['end'] for e in entries), default=0),
+            'critical_path': critical_path,
+            'critical_path_busy': round(
+                sum(by_key[key]['duration'] for key in critical_path), 3
+            ),
+            'stages': stages,
+        }
+
+    def save(self, path):
+        with self._lock:
+            entries = sorted(self._entries, key=lambda e: e['start'])
+        with open(path, 'w') as timeline_file:
+            json.dump(
+                {
+                    'started_at': self.started_at.isoformat(),
+                    'stages': entries,
+                    'summary': self.summary(),
+                },
+                timeline_file,
+                indent=2,
+            )
+
+    def succeeded(self):
+        with self._lock:
+            return {
+                entry['stage']
+                for entry in self._entries
+                if entry['outcome'] == 'succeeded'
+            }
+
+    def _now(self):
+        return time.monotonic() - self._start
+
+
+class Pipeline:
+    """
+    Runs deployment stages as soon as the stages they require are done.
+
+    Stages are run on the shared worker pool, so independent stages of
+    different VMs run concurrently. Once a stage fails no new stages are
+    started; the ones already running are waited for.
+
+    Stages may also require stages measured on the timeline outside of
+    the pipeline, which then have to have succeeded before it's run.
+    """
+
+    def __init__(self, timeline=None):
+        self.timeline = timeline or Timeline()
+        self._stages = {}
+
+    def add(self, name, func, host=None, requires=()):
+        """
+        Args:
+            name(str): Name of the stage, e.g. 'repos'
+            func(callable): Called with no arguments to run the stage
+            host(str): VM the stage runs on, None for stages of all VMs
+            requires(list): Keys of the stages that have to be done first,
+                as returned by 'add' (or 'stage_key')
+
+        Returns:
+            str: The key of the stage
+        """
+        key = stage_key(name, host)
+        if key in self._stages:
+            raise ValueError(f'Stage {key} added twice')
+        self._stages[key] = Stage(key, name, host, func, tuple(requires))
+        return key
+
+    def add_requires(self, key, requires):
+        """Makes the stage 'key' also require the stages 'requires'"""
+        stage = self._stages.get(key)
+        if stage is None:
+            raise ValueError(f'Unknown stage {key}')
+        self._stages[key] = stage._replace(
+            requires=stage.requires + tuple(requires)
+        )
+
+    def keys(self, name=None, host=None):
+        return [
+            stage.key
+            for stage in self._stages.values()
+            if (name is None or stage.name == name)
+            and (host is None or stage.host == host)
+        ]
+
+    def run(self):
+        done = self.timeline.succeeded()
+        self._validate(done)
+        pending = dict(self._stages)
+        running = {}
+        failures = []
+        while pending or running:
+            if not failures:
+                for key in self._ready(pending, done):
+                    stage = pending.pop(key)
+                    running[utils.submit(self._run_stage, stage)] = stage
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                stage = running.pop(future)
+                exc_info = future.result()
+                if exc_info is None:
+                    done.add(stage.key)
+                else:
+                    failures.append((stage.key, exc_info))
+
+        if len(failures) == 1:
+            exc_info = failures[0][1]
+            raise exc_info[1].with_traceback(exc_info[2])
+        if failures:
+            raise utils.ParallelExecutionError(failures) from failures[0][1][1]
+
+    def _run_stage(self, stage):
+        try:
+            with self.timeline.measure(stage.name, stage.host, stage.requires):
+                stage.func()
+        except Exception:
+            return sys.exc_info()
+        return None
+
+    @staticmethod
+    def _ready(pending, done):
+        return [
+            key
+            for key, stage in pending.items()
+            if all(required in done for required in stage.requires)
+        ]
+
+    def _validate(self, done):
+        for stage in self._stages.values():
+            unknown = [
+                r
+                for r in stage.requires
+                if r not in self._stages and r not in done
+            ]
+            if unknown:
+                raise ValueError(
+                    f'Stage {stage.key} requires unknown stages {unknown}'
+                )
+        # every stage must become ready at some point, or there's a cycle
+        done = set(done)
+        pending = dict(self._stages)
+        while pending:
+            ready = self._ready(pending, done)
+            if not ready:
+                raise ValueError(
+                    f'Dependency cycle among stages {sorted(pending)}'
+                )
+            for key in ready:
+                done.add(key)
+                del pending[key]
+
+
+def declared_requires(ost_json_path, hostname_for_vm):
+    """
+    Reads the dependencies between deploy scripts declared in ost.json, i.e.
+    for a VM defined as:
+
+        "host-0": {
+            "deploy-scripts": ["common/deploy-scripts/setup_host.sh"],
+            "deploy-requires": {
+                "common/deploy-scripts/setup_host.sh": [
+                    "storage:common/deploy-scripts/setup_storage.sh"
+                ]
+            }
+        }
+
+    setup_host.sh will be run on host-0 only once setup_storage.sh is done
+    on the storage VM. A requirement without a script, e.g. "storage",
+    means all deploy scripts of that VM.
+
+    Args:
+        ost_json_path(str): Path of the suite's ost.json
+        hostname_for_vm(callable): Maps VM names of ost.json to host names
+
+    Returns:
+        dict: (host name, script) -> list of (host name, script or None)
+    """
+    try:
+        with open(ost_json_path) as ost_json:
+            # lines starting with '#' are comments, as for
+            # provision.load_config, which can't be imported from here
+            lines = [line for line in ost_json if not line.startswith('#')]
+    except FileNotFoundError:
+        return {}
+    vms = json.loads(''.join(lines)).get('vms', {})
+    requires = {}
+    for vm, definition in vms.items():
+        for script, required in definition.get('deploy-requires', {}).items():
+            requires[(hostname_for_vm(vm), script)] = [
+                _parse_requirement(requirement, hostname_for_vm)
+                for requirement in required
+            ]
+    return requires
+
+
+def _parse_requirement(requirement, hostname_for_vm):
+    vm, _, script = requirement.partition(':')
+    return hostname_for_vm(vm), script or None
@@ -0,0 +1,648 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+"""
+Provisioning of the libvirt networks and VMs of a suite, as described by
+its ost.json and the templates in common/libvirt-templates.
+
+ost.json is read and all templates are rendered once, in-process. The
+subnets of the networks and the UUID of the deployment are claimed from
+the registry shared by all OST environments on the machine, see
+leases.py, and the networks are created. Disks of all VMs are created
+concurrently meanwhile, and every VM is booted as soon as its disks and
+the networks are ready. How long each of these stages took is printed
+at the end and saved to the deployment directory.
+
+Until no OST checkout allocates subnets without the registry anymore,
+the claim and the creation of the networks also hold the lock those
+checkouts serialize on.
+
+With --dry-run nothing is created; the rendered network and VM XMLs and
+the ansible inventory are printed instead, which needs neither libvirt
+nor the images.
+
+Usage:
+    python -m ost_utils.deployment_utils.provision [-4|-6] [--dry-run] \\
+        <suite>
+"""
+
+import argparse
+import contextlib
+import fcntl
+import functools
+import json
+import logging
+import os
+import pwd
+import re
+import subprocess
+import sys
+import time
+import uuid
+from collections import namedtuple
+
+from ost_utils import utils
+from ost_utils.deployment_utils import leases
+from ost_utils.deployment_utils import pipeline
+from ost_utils.shell import shell
+from ost_utils.shell import ShellError
+
+LOGGER = logging.getLogger(__name__)
+
+# Shared with the checkouts picking subnets without leases.py, see lagofy.sh
+LOCK_FILE = '/tmp/ost.lock'
+LOCK_TIMEOUT = 120
+
+TIMELINE_FILE_NAME = 'provision-timeline.json'
+INVENTORY_FILE_NAME = 'hosts'
+
+NETWORKS_STAGE = 'networks'
+ROOT_DISK_STAGE = 'root-disk'
+BOOT_STAGE = 'boot'
+
+Network = namedtuple('Network', ('type', 'libvirt_name', 'subnet', 'xml'))
+Disk = namedtuple('Disk', ('path', 'size', 'backing_file'))
+VM = namedtuple(
+    'VM', ('name', 'libvirt_name', 'root_disk', 'disks', 'xml', 'inventory')
+)
+
+_TOKEN_RE = re.compile(r'@([A-Z0-9_]+)@')
+
+
+class ProvisionError(Exception):
+    pass
+
+
+def load_config(path):
+    """
+    Reads ost.json, where lines starting with '#' are comments
+    """
+    try:
+        with open(path) as f:
+            lines = [line for line in f if not line.startswith('#')]
+    except FileNotFoundError:
+        raise ProvisionError(f'no ost.json in {os.path.dirname(path)}')
+    return json.loads(''.join(lines))
+
+
+class Provisioner:  # pylint: disable=too-many-instance-attributes
+    """
+    Renders the networks and VMs of a suite and creates them.
+
+    NICs listed by a network get consecutive host indexes on its subnet,
+    starting with 2, from which their MAC and IP addresses are derived:
+
+        54:52:c0:a8:<subnet hex>:<index>
+        192.168.<subnet>.<index>
+        fd8f:1391:3a82:<subnet>::c0a8:<subnet hex><index>
+
+    The management network also serves the DNS entries of all NICs, named
+    ost-<suite>-<NIC>, so it's rendered after all other networks.
+    """
+
+    def __init__(
+        self,
+        suite,
+        working_dir,
+        repo_root,
+        images,
+        ssh_key,
+        ip_version=None,
+        deployment_uuid=None,
+    ):
+        """
+        Args:
+            suite(str): Name of the suite, e.g. basic-suite-master
+            working_dir(str): The deployment directory, i.e. $PREFIX
+            repo_root(str): Where suites and templates are, i.e.
+                $OST_REPO_ROOT
+            images(dict): Variable name -> image path, the root disks of
+                the VMs are layered on, e.g. OST_IMAGES_HOST_INSTALLED
+            ssh_key(str): Private key for connecting to the VMs
+            ip_version(int): 4 or 6 for single stack networks, None for
+                dual stack
+            deployment_uuid(str): 8 characters all libvirt names start
+                with, a random one by default
+        """
+        self._suite = suite
+        self._working_dir = working_dir
+        self._repo_root = repo_root
+        self._images = images
+        self._ssh_key = ssh_key
+        self._ip_version = ip_version
+        self._requested_uuid = deployment_uuid
+        self.uuid = deployment_uuid or uuid.uuid4().hex[:8]
+        self._config = load_config(os.path.join(repo_root, suite, 'ost.json'))
+        self._templates = {}
+        self._validate()
+
+    @property
+    def network_types(self):
+        # management is last, to get the DNS entries of all NICs
+        return [
+            net_type
+            for net_type, _ in sorted(
+                self._config['networks'].items(),
+                key=lambda item: item[1].get('is_management') is True,
+            )
+        ]
+
+    @property
+    def management_network(self):
+        return next(
+            net_type
+            for net_type in self.network_types
+            if self._config['networks'][net_type].get('is_management')
+        )
+
+    def render(self, subnets):
+        """
+        Args:
+            subnets(list of int): Subnets of the networks, in the order of
+                'network_types'
+
+        Returns:
+            tuple: list of Network, list of VM
+        """
+        nics = {}
+        dns_entries = []
+        networks = []
+        for net_type, subnet in zip(self.network_types, subnets):
+            networks.append(
+                self._render_network(net_type, subnet, nics, dns_entries)
+            )
+        vms = [
+            self._render_vm(vm_name, nics)
+            for vm_name in sorted(self._config['vms'])
+        ]
+        return networks, vms
+
+    def provision(self, timeline=None):
+        """
+        Creates the networks, disks and VMs and writes the ansible
+        inventory, returning the timeline of the stages
+        """
+        self._check_images()
+        for subdir in ('logs', 'images'):
+            os.makedirs(os.path.join(self._working_dir, subdir), exist_ok=True)
+        rendered = {}
+        deployment = pipeline.Pipeline(timeline)
+        networks_key = deployment.add(
+            NETWORKS_STAGE, functools.partial(self._create_networks, rendered)
+        )
+        # the disks don't depend on the networks, so they're layered or
+        # allocated while the networks are created
+        for vm_name, definition in sorted(self._config['vms'].items()):
+            disk_keys = [
+                deployment.add(
+                    ROOT_DISK_STAGE,
+                    functools.partial(self._create_root_disk, vm_name),
+                    host=vm_name,
+                )
+            ]
+            for dev in sorted(definition.get('disks', {})):
+                disk_keys.append(
+                    deployment.add(
+                        f'disk-{dev}',
+                        functools.partial(self._create_disk, vm_name, dev),
+                        host=vm_name,
+                    )
+                )
+            deployment.add(
+                BOOT_STAGE,
+                functools.partial(self._boot, rendered, vm_name),
+                host=vm_name,
+                requires=[networks_key] + disk_keys,
+            )
+        deployment.run()
+
+        vms = rendered['vms']
+        inventory = ''.join(vm.inventory for vm in vms)
+        with open(
+            os.path.join(self._working_dir, INVENTORY_FILE_NAME), 'w'
+        ) as f:
+            f.write(inventory)
+        if self._ip_version == 6:
+            with deployment.timeline.measure('ipv6-proxy'):
+                self._start_ipv6_proxy(rendered['networks'])
+        return deployment.timeline
+
+    def _validate(self):
+        networks = self._config.get('networks', {})
+        if not any(n.get('is_management') for n in networks.values()):
+            raise ProvisionError('no management network defined')
+        templates = [n['template'] for n in networks.values()]
+        for vm_name, vm in self._config.get('vms', {}).items():
+            templates.append(vm['template'])
+            templates += [n['template'] for n in vm.get('nics', {}).values()]
+            templates += [d['template'] for d in vm.get('disks', {}).values()]
+            unknown = [
+                nic
+                for nic in vm.get('nics', {})
+                if not any(nic in n.get('nics', ()) for n in networks.values())
+            ]
+            if unknown:
+                raise ProvisionError(
+                    f'VM {vm_name}: NICs {unknown} not found in any network'
+                )
+        for template in set(templates):
+            self._template(template)
+
+    def _check_images(self):
+        for vm_name, definition in sorted(self._config['vms'].items()):
+            variable = definition['root_disk_var']
+            path = self._images.get(variable)
+            if not path or not os.access(path, os.R_OK):
+                raise ProvisionError(
+                    f'VM {vm_name}: root disk {variable}({path}) '
+                    'does not exist'
+                )
+
+    def _template(self, path):
+        if path not in self._templates:
+            full_path = os.path.join(self._repo_root, path)
+            if self._ip_version is not None and path in {
+                n['template'] for n in self._config['networks'].values()
+            }:
+                full_path += f'.ipv{self._ip_version}'
+            try:
+                with open(full_path) as f:
+                    self._templates[path] = f.read()
+            except OSError:
+                raise ProvisionError(f'template {full_path} does not exist')
+        return self._templates[path]
+
+    def _render_template(self, path, **values):
+        values.setdefault('UUID', self.uuid)
+        values.setdefault('PREFIX', self._working_dir)
+        # tokens without a value are left as they are
+        return _TOKEN_RE.sub(
+            lambda m: str(values.get(m.group(1), m.group(0))),
+            self._template(path),
+        )
+
+    def _render_network(self, net_type, subnet, nics, dns_entries):
+        definition = self._config['networks'][net_type]
+        subnet_hex = f'{subnet:x}'
+        libvirt_name = f'ost{self.uuid}-{subnet}'
+        ipv4_hosts = []
+        ipv6_hosts = []
+        for host_idx, nic in enumerate(definition['nics'], start=2):
+            hostname = f'ost-{self._suite}-{nic}'
+            mac = f'54:52:c0:a8:{subnet_hex}:{host_idx:02d}'
+            ipv4 = f'192.168.{subnet}.{host_idx}'
+            ipv6 = f'fd8f:1391:3a82:{subnet}::c0a8:{subnet_hex}{host_idx:02d}'
+            if self._ip_version != 6:
+                dns_entries.append(
+                    f"<host ip='{ipv4}'><hostname>{hostname}</hostname></host>"
+                )
+            if self._ip_version != 4:
+                dns_entries.append(
+                    f"<host ip='{ipv6}'><hostname>{hostname}</hostname></host>"
+                )
+            ipv4_hosts.append(
+                f"<host mac='{mac}' name='{hostname}' ip='{ipv4}'/>"
+            )
+            ipv6_hosts.append(
+                f"<host id='0:3:0:1:{mac}' name='{hostname}' ip='{ipv6}'/>"
+            )
+            nics[nic] = {
+                'network': net_type,
+                'libvirt_name': libvirt_name,
+                'subnet_hex': subnet_hex,
+                'index': f'{host_idx:02d}',
+                'ip': ipv4 if self._ip_version == 4 else ipv6,
+            }
+        if net_type == self.management_network:
+            dns = f"<dns forwardPlainNames='no'>{''.join(dns_entries)}</dns>"
+        else:
+            dns = "<dns enable='no'/>"
+        xml = self._render_template(
+            definition['template'],
+            NET_NAME=libvirt_name,
+            NET_TYPE=net_type,
+            SUBNET=subnet,
+            SUBNETHEX=subnet_hex,
+            DNS=dns,
+            IPV4=''.join(ipv4_hosts),
+            IPV6=''.join(ipv6_hosts),
+        )
+        return Network(net_type, libvirt_name, subnet, xml)
+
+    def _render_vm(self, vm_name, nics):
+        definition = self._config['vms'][vm_name]
+        libvirt_name = f'{self.uuid}-ost-{self._suite}-{vm_name}'
+        ansible_ip = None
+        nic_xmls = []
+        for nic in sorted(definition.get('nics', {})):
+            mapping = nics[nic]
+            if mapping['network'] == self.management_network:
+                ansible_ip = mapping['ip']
+            nic_xmls.append(
+                self._render_template(
+                    definition['nics'][nic]['template'],
+                    NET_NAME=mapping['libvirt_name'],
+                    SUBNETHEX=mapping['subnet_hex'],
+                    IDXHEX=mapping['index'],
+                )
+            )
+        if ansible_ip is None:
+            raise ProvisionError(
+                f'VM {vm_name} has no NIC on the management network'
+            )
+
+        root_disk = self._root_disk(vm_name)
+        disks = []
+        disk_xmls = []
+        for serial, dev in enumerate(
+            sorted(definition.get('disks', {})), start=2
+        ):
+            disk = self._disk(vm_name, dev)
+            disks.append(disk)
+            disk_xmls.append(
+                self._render_template(
+                    definition['disks'][dev]['template'],
+                    DISK_FILE=disk.path,
+                    DISK_DEV=dev,
+                    DISK_SERIAL=serial,
+                )
+            )
+
+        memory = int(definition['memory'])
+        # distributed between two NUMA cells
+        vcpus = int(definition.get('vcpu_num', 2))
+        xml = self._render_template(
+            definition['template'],
+            VM_FULLNAME=libvirt_name,
+            DEPLOY_SCRIPTS=''.join(
+                f'<script name="{script}"/>'
+                for script in definition.get('deploy-scripts', [])
+            ),
+            MEMSIZE=memory,
+            MEMSIZE_NUMA=memory // 2,
+            VCPU_NUM=vcpus,
+            CELL_0_VCPUS=f'0-{vcpus // 2 - 1}',
+            CELL_1_VCPUS=f'{vcpus // 2}-{vcpus - 1}',
+            SERIALLOG=os.path.join(self._working_dir, 'logs', vm_name),
+            OST_ROOTDISK=root_disk.path,
+            DISKS=_inline(disk_xmls),
+            NICS=_inline(nic_xmls),
+        )
+        inventory = (
+            f'ost-{self._suite}-{vm_name} ansible_host={ansible_ip} '
+            f'ansible_ssh_private_key_file={self._ssh_key} '
+            "ansible_ssh_extra_args='-o UserKnownHostsFile=/dev/null'\n"
+        )
+        return VM(vm_name, libvirt_name, root_disk, disks, xml, inventory)
+
+    def _root_disk(self, vm_name):
+        variable = self._config['vms'][vm_name]['root_disk_var']
+        return Disk(
+            os.path.join(self._working_dir, 'images', f'{vm_name}-root.qcow2'),
+            None,
+            self._images.get(variable),
+        )
+
+    def _disk(self, vm_name, dev):
+        return Disk(
+            os.path.join(
+                self._working_dir, 'images', f'{vm_name}-{dev}.qcow2'
+            ),
+            self._config['vms'][vm_name]['disks'][dev]['size'],
+            None,
+        )
+
+    def _create_networks(self, rendered):
+        with _locked(LOCK_FILE, LOCK_TIMEOUT):
+            lease = leases.claim(
+                self._working_dir,
+                len(self.network_types),
+                uuid=self._requested_uuid,
+            )
+            self.uuid = lease.uuid
+            networks, vms = self.render(lease.subnets)
+            # One after the other: this already runs in a pipeline worker,
+            # next to the disks, and a network takes well below a second
+            for network in networks:
+                LOGGER.info(
+                    f'Creating network {network.type}, '
+                    f'subnet {network.subnet}'
+                )
+                _virsh_create('net-create', network.xml)
+        rendered['networks'] = networks
+        rendered['vms'] = vms
+
+    def _create_root_disk(self, vm_name):
+        disk = self._root_disk(vm_name)
+        shell(
+            [
+                'qemu-img',
+                'create',
+                '-q',
+                '-f',
+                'qcow2',
+                '-b',
+                disk.backing_file,
+                '-F',
+                'qcow2',
+                disk.path,
+            ]
+        )
+
+    def _create_disk(self, vm_name, dev):
+        disk = self._disk(vm_name, dev)
+        shell(
+            [
+                'qemu-img',
+                'create',
+                '-q',
+                '-f',
+                'qcow2',
+                '-o',
+                'preallocation=metadata',
+                disk.path,
+                disk.size,
+            ]
+        )
+
+    def _boot(self, rendered, vm_name):
+        vm = next(vm for vm in rendered['vms'] if vm.name == vm_name)
+        LOGGER.info(f'Creating VM {vm.name}')
+        _virsh_create('create', vm.xml)
+
+    def _start_ipv6_proxy(self, networks):
+        # sshd acting as a SOCKS proxy for dnf on the VMs
+        subnet = next(
+            n.subnet for n in networks if n.type == self.management_network
+        )
+        address = f'fd8f:1391:3a82:{subnet}::1'
+        LOGGER.info(f'Starting sshd on {address}')
+        # the address only becomes usable once the bridge is up
+        time.sleep(5)
+        shell(
+            [
+                '/usr/sbin/sshd',
+                '-f',
+                os.path.join(self._repo_root, 'common/helpers/sshd_config'),
+                '-o',
+                f"PidFile={os.path.join(self._working_dir, 'sshd_pid')}",
+                '-o',
+                f'AuthorizedKeysFile={self._ssh_key}.pub',
+                '-o',
+                f'HostKey={self._ssh_key}',
+                '-o',
+                f'AllowUsers={_user_name()}',
+                '-o',
+                f'ListenAddress={address}',
+            ]
+        )
+
+
+def _inline(xmls):
+    return ''.join(xml.replace('\t', '').replace('\n', '') for xml in xmls)
+
+
+def _user_name():
+    return pwd.getpwuid(os.getuid()).pw_name
+
+
+def _virsh_create(command, xml):
+    process = subprocess.run(
+        ['virsh', command, '/dev/stdin'],
+        input=xml,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if process.returncode:
+        LOGGER.error(f'virsh {command} failed for:\n{xml}')
+        raise ShellError(process.returncode, process.stdout, process.stderr)
+
+
+@contextlib.contextmanager
+def _locked(path, timeout):
+    with open(path, 'a') as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise ProvisionError(
+                        f'{path} still locked after {timeout}s'
+                    )
+                time.sleep(0.5)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _print_summary(timeline):
+    summary = timeline.summary()
+    if not summary['stages']:
+        return
+    print(f"Provisioning took {summary['duration']:.1f}s")
+    for name, stage in sorted(
+        summary['stages'].items(), key=lambda item: -item[1]['max']
+    ):
+        print(
+            f"  {name:<16} {stage['count']:>3}x  "
+            f"max {stage['max']:6.1f}s  total {stage['total']:7.1f}s"
+        )
+    print(f"  critical path: {' -> '.join(summary['critical_path'])}")
+
+
+def _print_dry_run(provisioner):
+    networks, vms = provisioner.render(
+        leases.configured_subnets()[: len(provisioner.network_types)]
+    )
+    for network in networks:
+        print(f'<!-- network {network.type}: {network.libvirt_name} -->')
+        print(network.xml)
+    for vm in vms:
+        print(f'<!-- VM {vm.name}: {vm.libvirt_name} -->')
+        print(vm.xml)
+    print(f'<!-- {INVENTORY_FILE_NAME} -->')
+    print(''.join(vm.inventory for vm in vms))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ost_utils.deployment_utils.provision',
+        description='Creates the networks and VMs of an OST suite',
+    )
+    ip_version = parser.add_mutually_exclusive_group()
+    ip_version.add_argument(
+        '-4', dest='ip_version', action='store_const', const=4
+    )
+    ip_version.add_argument(
+        '-6', dest='ip_version', action='store_const', const=6
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='print the rendered XMLs instead of creating anything',
+    )
+    parser.add_argument(
+        '--uuid', help='UUID of the deployment, random by default'
+    )
+    parser.add_argument(
+        '--working-dir',
+        default=os.environ.get('PREFIX'),
+        help='the deployment directory, $PREFIX by default',
+    )
+    parser.add_argument(
+        '--repo-root',
+        default=os.environ.get('OST_REPO_ROOT', os.getcwd()),
+        help='the OST repository, $OST_REPO_ROOT by default',
+    )
+    parser.add_argument('suite')
+    args = parser.parse_args(argv)
+
+    if not args.working_dir:
+        parser.error('no deployment directory, is lagofy.sh sourced?')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    images = {
+        name: value
+        for name, value in os.environ.items()
+        if name.startswith('OST_IMAGES_')
+    }
+    try:
+        provisioner = Provisioner(
+            args.suite,
+            os.path.realpath(args.working_dir),
+            os.path.realpath(args.repo_root),
+            images,
+            images.get('OST_IMAGES_SSH_KEY'),
+            ip_version=args.ip_version,
+            deployment_uuid=args.uuid,
+        )
+        if args.dry_run:
+            _print_dry_run(provisioner)
+            return 0
+        timeline = pipeline.Timeline()
+        try:
+            provisioner.provision(timeline)
+        finally:
+            if os.path.isdir(args.working_dir):
+                timeline.save(
+                    os.path.join(args.working_dir, TIMELINE_FILE_NAME)
+                )
+            _print_summary(timeline)
+    except (
+        ProvisionError,
+        leases.LeaseError,
+        ShellError,
+        utils.ParallelExecutionError,
+    ) as e:
+        LOGGER.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
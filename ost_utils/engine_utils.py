@@ -4,9 +4,26 @@
 #
 #
 
+import collections
 import contextlib
+import logging
+import threading
+import time
+import weakref
 
 from ost_utils import assert_utils
+from ost_utils import polling
+
+
+EVENT_POLL_INTERVAL = 3
+
+LOGGER = logging.getLogger(__name__)
+
+# keyed by the connection, since every call to system_service() returns a
+# new service object, and weakly, so that a closed connection's stream
+# goes away with it
+_STREAMS = weakref.WeakKeyDictionary()
+_STREAMS_LOCK = threading.Lock()
 
 
 @contextlib.contextmanager
@@ -16,22 +33,218 @@ def wait_for_event(engine, event_id, timeout=assert_utils.LONG_TIMEOUT):
     event ID or a list - multiple event IDs
     that all will be checked
     '''
-    events = engine.events_service()
-    last_event = int(events.list(max=2)[0].id)
+    stream = event_stream(engine)
+    subscription = stream.subscribe()
     try:
         yield
     finally:
         if isinstance(event_id, int):
             event_id = [event_id]
-        for e_id in event_id:
-            assert assert_utils.true_within(
-                lambda: any(
-                    e.code == e_id for e in events.list(from_=last_event)
-                ),
-                timeout,
+        try:
+            missing = stream.wait(subscription, event_id, timeout=timeout)
+        finally:
+            stream.unsubscribe(subscription)
+        assert (
+            not missing
+        ), f'Events {sorted(missing)} did not occur within {timeout} seconds'
+
+
+def event_stream(engine):
+    """
+    Returns:
+        EngineEventStream: The stream shared by all waiters on the
+            connection of 'engine'
+    """
+    connection = engine._connection  # pylint: disable=protected-access
+    with _STREAMS_LOCK:
+        if connection not in _STREAMS:
+            _STREAMS[connection] = EngineEventStream(engine)
+        return _STREAMS[connection]
+
+
+class EngineEventStream:  # pylint: disable=too-many-instance-attributes
+    """
+    Follows the engine events with a single cursor that only moves
+    forward, fetching just the events newer than it. A single poller thread
+    runs while there are waiters and indexes the new events by code and
+    correlation id, so any number of waiters costs one REST call per
+    poll interval.
+
+    Waiters subscribe before triggering the action they expect events from
+    and only events newer than the latest one at subscription time count
+    for them.
+
+    Failed polls are retried on the next interval, a waiter only gives up
+    at its own deadline.
+    """
+
+    def __init__(self, engine, poll_interval=EVENT_POLL_INTERVAL):
+        # only a weak reference, the registry of streams must not keep the
+        # connection alive
+        self._connection = weakref.ref(
+            engine._connection  # pylint: disable=protected-access
+        )
+        self._poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._cursor = None
+        self._by_code = collections.defaultdict(list)
+        self._by_correlation_id = collections.defaultdict(list)
+        self._subscriptions = []
+        self._waiters = 0
+        self._poller = None
+        self._error = None
+
+    def subscribe(self):
+        latest = self._latest_event_id()
+        with self._cond:
+            # Without anyone following the events the cursor stopped
+            # moving, and the events since then are of no interest
+            if self._poller is None and not self._subscriptions:
+                self._cursor = latest
+            subscription = _Subscription(latest)
+            self._subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._cond:
+            self._subscriptions.remove(subscription)
+            if not self._subscriptions:
+                self._by_code.clear()
+                self._by_correlation_id.clear()
+
+    def wait(
+        self,
+        subscription,
+        codes,
+        correlation_id=None,
+        timeout=assert_utils.LONG_TIMEOUT,
+    ):
+        """
+        Wait until an event of each of 'codes' newer than the subscription
+        arrives
+
+        Args:
+            subscription: As returned by subscribe()
+            codes(list of int): The event codes to wait for
+            correlation_id(str): Only count events with this correlation id
+            timeout(float): Seconds to wait for
+
+        Returns:
+            set: The codes no event arrived for within the timeout
+        """
+        deadline = polling.Deadline(timeout)
+        with self._cond:
+            self._waiters += 1
+            self._ensure_poller()
+            try:
+                while True:
+                    missing = self._missing(
+                        subscription.since, codes, correlation_id
+                    )
+                    if not missing:
+                        return missing
+                    if deadline.expired():
+                        if self._error is not None:
+                            LOGGER.warning(
+                                'Last poll of engine events failed: %s',
+                                self._error,
+                            )
+                        return missing
+                    self._cond.wait(deadline.remaining())
+            finally:
+                self._waiters -= 1
+
+    def events_for_correlation_id(self, subscription, correlation_id):
+        """
+        Returns:
+            list of (int, int): Id and code of the events with the given
+                correlation id seen since the subscription
+        """
+        with self._cond:
+            return [
+                (event_id, code)
+                for event_id, code in self._by_correlation_id[correlation_id]
+                if event_id > subscription.since
+            ]
+
+    def _missing(self, since, codes, correlation_id):
+        if correlation_id is None:
+            seen = {
+                code
+                for code in codes
+                if any(event_id > since for event_id in self._by_code[code])
+            }
+        else:
+            seen = {
+                code
+                for event_id, code in self._by_correlation_id[correlation_id]
+                if event_id > since
+            }
+        return set(codes) - seen
+
+    def _events_service(self):
+        connection = self._connection()
+        if connection is None:
+            raise RuntimeError('The engine connection is gone')
+        return connection.system_service().events_service()
+
+    def _latest_event_id(self):
+        events = self._events_service().list(max=1)
+        return int(events[0].id) if events else 0
+
+    def _ensure_poller(self):
+        if self._poller is None:
+            self._poller = threading.Thread(
+                target=self._poll_loop,
+                name='engine-events',
+                daemon=True,
+            )
+            self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                if not self._waiters:
+                    self._poller = None
+                    return
+                cursor = self._cursor
+            try:
+                events = self._events_service().list(from_=cursor)
+            except Exception as err:
+                LOGGER.debug(
+                    'Failed polling engine events, retrying', exc_info=True
+                )
+                with self._cond:
+                    self._error = err
+                    self._cond.notify_all()
+            else:
+                with self._cond:
+                    self._index(events)
+                    self._error = None
+                    self._cond.notify_all()
+            time.sleep(self._poll_interval)
+
+    def _index(self, events):
+        for event in events:
+            event_id = int(event.id)
+            if event_id <= self._cursor:
+                continue
+            self._by_code[event.code].append(event_id)
+            if event.correlation_id:
+                self._by_correlation_id[event.correlation_id].append(
+                    (event_id, event.code)
+                )
+        if events:
+            self._cursor = max(
+                self._cursor, max(int(event.id) for event in events)
             )
 
 
+class _Subscription:
+    def __init__(self, since):
+        self.since = since
+
+
 def get_jobs_statuses(engine, correlation_id):
     # Gets a list of jobs statuses by the specified correlation id.
     jobs = engine.jobs_service().list(
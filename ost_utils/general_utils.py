@@ -7,6 +7,8 @@
 import logging
 import time
 
+from ost_utils import polling
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,10 +42,15 @@ def exponential_retrier(
     if not sleep_at_first_attempt:
         yield 0
         attempt_num += 1
+    delays = polling.Backoff(
+        fast_probes=0,
+        initial=base_coefficient * base ** attempt_num,
+        factor=base,
+        max_interval=max_iteration_sleeptime,
+        jitter=0,
+    ).delays()
     for attempt_num in range(attempt_num, attempts):
-        actual_sleeptime = min(
-            base_coefficient * base ** attempt_num, max_iteration_sleeptime
-        )
+        actual_sleeptime = min(next(delays), max_iteration_sleeptime)
         logger.debug(
             "attempt {}/{}, {} seconds sleeping".format(
                 attempt_num + 1, attempts, actual_sleeptime
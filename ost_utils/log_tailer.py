@@ -0,0 +1,431 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+
+import datetime
+import json
+import logging
+import os
+import re
+import shlex
+import shutil
+import threading
+
+from ost_utils import ssh
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30
+
+# Files followed on every VM, those missing on a VM are skipped
+TAILED_FILES = (
+    '/var/log/ovirt-engine/engine.log',
+    '/var/log/vdsm/vdsm.log',
+    '/var/log/vdsm/supervdsm.log',
+)
+# Where the journal is written to, same as when collecting artifacts
+JOURNAL_FILE = '/var/log/journalctl.log'
+JOURNAL_COMMAND = 'journalctl -a --no-pager -o short-iso-precise --show-cursor'
+
+# At most this much of each file is transferred per transfer, the rest
+# waits for the next poll, or the next transfer of a poll catching up
+CHUNK_LIMIT = 16 * 1024 * 1024
+
+STATE_FILE_NAME = '.log-tailer.json'
+
+# e.g. '2022-03-01 10:00:00,123+01' (engine), '2022-03-01 10:00:00,123+0000'
+# (vdsm) or '2022-03-01T10:00:00.123456+0000' (journal)
+_TIMESTAMP_RE = re.compile(
+    rb'^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})(?:[.,](\d+))?'
+    rb'([+-]\d{2}(?::?\d{2})?|Z)?'
+)
+
+
+class LogTailer:  # pylint: disable=too-many-instance-attributes
+    """
+    Follows the main logs and the journal of the VMs during the session.
+
+    Every 'interval' seconds whatever was appended to the logs since the
+    previous poll is transferred over pooled ssh connections and appended
+    to the same paths under 'logs_dir' that collecting the artifacts
+    would extract them to, so that a run that hangs or gets killed still
+    leaves them behind, and the artifacts collected at the end of the
+    session can skip them. Stopping the tailer polls one last time, and
+    collecting the artifacts of a VM polls it again right before its
+    archive is made, both until the logs are caught up with; a log still
+    behind after a failed poll is archived all the same. Whatever is
+    appended to the followed logs in between that poll and the archive
+    (usually well below a second) is in neither.
+
+    The offsets reached (inode and size of the files, cursor of the
+    journal) are saved in 'logs_dir', so that a later session writing to
+    the same artifacts continues where this one stopped.
+    """
+
+    def __init__(self, get_targets, logs_dir, interval=DEFAULT_INTERVAL):
+        """
+        Args:
+            get_targets(callable): Returns the VMs to follow, as a dict of
+                host name -> artifacts_utils.SSHTarget, called before
+                every poll since VMs may be added during the session
+            logs_dir(str): Where to write the logs, <host>/<remote path>
+            interval(int): Seconds between polls
+        """
+        self._get_targets = get_targets
+        self._logs_dir = logs_dir
+        self._interval = interval
+        self._state_path = os.path.join(logs_dir, STATE_FILE_NAME)
+        self._state = self._load_state()
+        # (host, remote path) of the logs the last poll fetched completely
+        self._caught_up = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='ost-log-tailer', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.poll(catch_up=True)
+
+    def poll(self, host_name=None, catch_up=False):
+        """
+        Args:
+            host_name(str): Only polls the logs of this VM, if given
+            catch_up(bool): Keep transferring the files more than
+                CHUNK_LIMIT behind until all of them are caught up with,
+                instead of leaving the rest for the next poll
+        """
+        with self._lock:
+            for host, target in self._get_targets().items():
+                if host_name is not None and host != host_name:
+                    continue
+                host_state = self._state.setdefault(host, {})
+                for path in TAILED_FILES:
+                    behind = self._poll_file(host, target, path, host_state)
+                    while behind and catch_up:
+                        behind = self._poll_file(
+                            host, target, path, host_state
+                        )
+                self._poll_journal(host, target, host_state)
+            self._save_state()
+
+    def tailed_paths(self, host):
+        """
+        Returns:
+            list: Remote paths of the logs of 'host' that the last poll
+                caught up with, including JOURNAL_FILE if it was the
+                journal. Logs still behind, or whose poll failed, aren't
+                listed.
+        """
+        with self._lock:
+            return sorted(
+                path
+                for path in self._state.get(host, {})
+                if (host, path) in self._caught_up
+            )
+
+    def local_paths(self):
+        """
+        Returns:
+            dict: host name -> local paths of the logs followed
+        """
+        with self._lock:
+            return {
+                host: [self._local_path(host, path) for path in sorted(paths)]
+                for host, paths in self._state.items()
+            }
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.poll()
+            except Exception:
+                LOGGER.debug('Polling logs failed', exc_info=True)
+
+    def _poll_file(self, host, target, path, host_state):
+        """
+        Returns:
+            bool: Whether the file is still behind after this transfer
+        """
+        self._caught_up.discard((host, path))
+        state = host_state.get(path, {'inode': None, 'offset': 0})
+        quoted = shlex.quote(path)
+        # starts over when the file was rotated or truncated
+        command = [
+            f'st=$(stat -c "%i %s" {quoted} 2>/dev/null) || exit 3;',
+            'set -- $st;',
+            f'off={state["offset"]};',
+            f'[ "$1" = "{state["inode"]}" ] && [ "$2" -ge $off ] || off=0;',
+            'echo "$1 $off";',
+            f'tail -c +$((off + 1)) {quoted} | head -c {CHUNK_LIMIT}',
+        ]
+        local_path = self._local_path(host, path)
+        sink = _FileSink(local_path, header=True)
+        try:
+            status = ssh.stream(
+                target.address,
+                command,
+                sink.write,
+                host_name=host,
+                tries=1,
+                ssh_key=target.ssh_key,
+            )
+        except Exception as e:
+            LOGGER.debug(f'Tailing {path} on {host} failed: {e}')
+            return False
+        finally:
+            sink.close()
+        if status.code or sink.header is None:
+            return False
+        inode, offset = sink.header.split()
+        if int(offset) == 0 and state['inode'] is not None:
+            LOGGER.debug(f'{path} on {host} was rotated, starting over')
+        host_state[path] = {
+            'inode': inode,
+            'offset': int(offset) + sink.written,
+            'local_size': _local_size(local_path),
+        }
+        if sink.written >= CHUNK_LIMIT:
+            return True
+        self._caught_up.add((host, path))
+        return False
+
+    def _poll_journal(self, host, target, host_state):
+        self._caught_up.discard((host, JOURNAL_FILE))
+        state = host_state.get(JOURNAL_FILE, {'cursor': None})
+        command = [JOURNAL_COMMAND]
+        if state['cursor'] is not None:
+            command.append(shlex.quote(f'--after-cursor={state["cursor"]}'))
+        local_path = self._local_path(host, JOURNAL_FILE)
+        sink = _JournalSink(local_path)
+        try:
+            status = ssh.stream(
+                target.address,
+                command,
+                sink.write,
+                host_name=host,
+                tries=1,
+                ssh_key=target.ssh_key,
+            )
+        except Exception as e:
+            LOGGER.debug(f'Tailing the journal of {host} failed: {e}')
+            return
+        finally:
+            sink.close()
+        if status.code:
+            return
+        host_state[JOURNAL_FILE] = {
+            'cursor': sink.cursor or state['cursor'],
+            'local_size': _local_size(local_path),
+        }
+        # journalctl has no chunk limit, everything up to the cursor is in
+        self._caught_up.add((host, JOURNAL_FILE))
+
+    def _local_path(self, host, path):
+        return os.path.join(self._logs_dir, host, path.lstrip('/'))
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+        # offsets are only valid for the files they were reached in
+        return {
+            host: {
+                path: entry
+                for path, entry in paths.items()
+                if _local_size(self._local_path(host, path))
+                == entry.get('local_size')
+            }
+            for host, paths in state.items()
+        }
+
+    def _save_state(self):
+        os.makedirs(self._logs_dir, exist_ok=True)
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self._state, state_file)
+        os.replace(tmp_path, self._state_path)
+
+
+def _local_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _unshare(path):
+    # collected artifacts may have been deduplicated into hard links,
+    # which must not be appended to
+    try:
+        if os.stat(path).st_nlink < 2:
+            return
+    except FileNotFoundError:
+        return
+    tmp_path = path + '.tmp'
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class _FileSink:
+    """Appends streamed output to a file, after an optional header line"""
+
+    def __init__(self, path, header=False):
+        self._path = path
+        self._file = None
+        self._pending = b'' if header else None
+        self.header = None
+        self.written = 0
+
+    def write(self, data):
+        if self._pending is not None:
+            data = self._pending + data
+            header, newline, data = data.partition(b'\n')
+            if not newline:
+                self._pending = header
+                return
+            self.header = header.decode()
+            self._pending = None
+        self._append(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def _append(self, data):
+        if not data:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            _unshare(self._path)
+            self._file = open(self._path, 'ab')
+        self._file.write(data)
+        self.written += len(data)
+
+
+class _JournalSink(_FileSink):
+    """
+    Appends streamed journalctl output to a file, leaving out the cursor
+    that '--show-cursor' prints last
+    """
+
+    _CURSOR_PREFIX = b'-- cursor: '
+    _NO_ENTRIES = b'-- No entries --'
+    _HELD_BACK = 4096
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._tail = b''
+        self.cursor = None
+
+    def write(self, data):
+        data = self._tail + data
+        self._tail = data[-self._HELD_BACK :]
+        self._append(data[: -self._HELD_BACK])
+
+    def close(self):
+        lines = self._tail.splitlines(keepends=True)
+        while lines and (
+            lines[-1].startswith(self._CURSOR_PREFIX)
+            or lines[-1].startswith(self._NO_ENTRIES)
+        ):
+            line = lines.pop()
+            if line.startswith(self._CURSOR_PREFIX):
+                self.cursor = line[len(self._CURSOR_PREFIX) :].strip().decode()
+        self._append(b''.join(lines))
+        super().close()
+
+
+def write_slices(local_paths, periods, nodeids, target_dir):
+    """
+    Cuts the part of each followed log written while each of the tests
+    ran, for triaging them without going through the whole logs.
+
+    Args:
+        local_paths(dict): host name -> local paths of the logs, as
+            returned by LogTailer.local_paths
+        periods(dict): Test node id -> (start, end) as aware datetimes
+        nodeids(iterable): Tests to cut slices for
+        target_dir(str): Slices are written to
+            <target_dir>/<test>/<host>/<log file name>
+    """
+    periods = {
+        nodeid: periods[nodeid]
+        for nodeid in nodeids
+        if nodeid in periods and periods[nodeid][1] is not None
+    }
+    if not periods:
+        return
+    for host, paths in local_paths.items():
+        for path in paths:
+            if os.path.exists(path):
+                _slice_file(host, path, periods, target_dir)
+
+
+def _slice_file(host, path, periods, target_dir):
+    outputs = {}
+    timestamp = None
+    try:
+        with open(path, 'rb') as log_file:
+            for line in log_file:
+                # lines without a timestamp, e.g. tracebacks, belong to the
+                # last line that had one
+                timestamp = _parse_timestamp(line) or timestamp
+                if timestamp is None:
+                    continue
+                for nodeid, (start, end) in periods.items():
+                    if start <= timestamp <= end:
+                        if nodeid not in outputs:
+                            outputs[nodeid] = _open_slice(
+                                target_dir, nodeid, host, path
+                            )
+                        outputs[nodeid].write(line)
+    finally:
+        for output in outputs.values():
+            output.close()
+
+
+def _open_slice(target_dir, nodeid, host, path):
+    test_dir = re.sub(r'[^\w.-]+', '_', nodeid).strip('_')
+    slice_dir = os.path.join(target_dir, test_dir, host)
+    os.makedirs(slice_dir, exist_ok=True)
+    return open(os.path.join(slice_dir, os.path.basename(path)), 'wb')
+
+
+def _parse_timestamp(line):
+    match = _TIMESTAMP_RE.match(line)
+    if match is None:
+        return None
+    date, time, fraction, offset = (
+        group.decode() if group is not None else None
+        for group in match.groups()
+    )
+    microseconds = int((fraction or '0')[:6].ljust(6, '0'))
+    if offset is None or offset == 'Z':
+        tz = datetime.timezone.utc
+    else:
+        offset = offset.replace(':', '').ljust(5, '0')
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        tz = datetime.timezone(
+            datetime.timedelta(
+                minutes=-minutes if offset[0] == '-' else minutes
+            )
+        )
+    try:
+        parsed = datetime.datetime.strptime(
+            f'{date} {time}', '%Y-%m-%d %H:%M:%S'
+        )
+    except ValueError:
+        return None
+    return parsed.replace(microsecond=microseconds, tzinfo=tz)
@@ -0,0 +1,278 @@
+#
+# Copyright oVirt Authors
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+#
+
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+
+STATS_FILE_NAME = 'wait-stats.jsonl'
+
+
+class FixedInterval:
+    """
+    Poll every 'interval' seconds
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def delays(self):
+        return itertools.repeat(self.interval)
+
+
+class Backoff:
+    """
+    Poll quickly a few times first, so that conditions which are already
+    (almost) met return right away, then back off exponentially so that
+    slow conditions don't hammer the engine.
+
+    Args:
+        fast_probes(int): Number of polls done every 'fast_interval' seconds
+            before backing off
+        fast_interval(float): Seconds between the fast polls
+        initial(float): First delay after the fast polls
+        factor(float): Multiplier applied to the delay after each poll
+        max_interval(float): Upper bound of a single delay
+        jitter(float): Fraction of each delay randomly added or removed, so
+            that parallel waiters don't poll in lockstep
+    """
+
+    def __init__(
+        self,
+        fast_probes=3,
+        fast_interval=0.5,
+        initial=1,
+        factor=1.5,
+        max_interval=10,
+        jitter=0.1,
+    ):
+        self.fast_probes = fast_probes
+        self.fast_interval = fast_interval
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+
+    def delays(self):
+        for _ in range(self.fast_probes):
+            yield self.fast_interval
+        delay = self.initial
+        while True:
+            yield self._jittered(delay)
+            delay = min(delay * self.factor, self.max_interval)
+
+    def _jittered(self, delay):
+        if not self.jitter:
+            return delay
+        return max(0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+DEFAULT_STRATEGY = Backoff()
+
+
+class Deadline:
+    """
+    Monotonic-clock deadline, unaffected by changes of the system time
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.start_time = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def remaining(self):
+        return max(0, self.timeout - self.elapsed())
+
+    def expired(self):
+        return self.elapsed() >= self.timeout
+
+    def sleep(self, delay):
+        time.sleep(min(delay, self.remaining()))
+
+
+class Timeout(Exception):
+    @property
+    def last_result(self):
+        return self.args[0]
+
+    def __str__(self):
+        return "Last evaluated result: {}".format(self.args[0])
+
+
+def wait(
+    func,
+    args=(),
+    kwargs=None,
+    success_criteria=lambda result: True,
+    error_criteria=lambda error: True,
+    timeout=None,
+    strategy=DEFAULT_STRATEGY,
+    delay_start=0,
+    max_attempts=None,
+    before_attempt=None,
+    after_attempt=None,
+    name=None,
+):
+    """
+    Call func until its result meets the success criteria, it raises an
+    error meeting the error criteria or the timeout passes.
+
+    An exception raised by func on the first attempt is passed to
+    error_criteria: if it returns True the exception is raised back to the
+    caller. On later attempts it's passed to success_criteria first, and
+    returned if that accepts it, since retrying an action may fail only
+    because an earlier attempt already did it, e.g. activating a host that
+    went up meanwhile. Exceptions that neither ends the wait on are
+    retried.
+
+    Args:
+        func(callable): Function to call
+        args(tuple): Positional arguments of func
+        kwargs(dict): Keyword arguments of func
+        success_criteria(callable): Takes the result, True ends the wait
+        error_criteria(callable): Takes an exception raised by func, True
+            re-raises it
+        timeout(float): Seconds to keep trying, forever if None
+        strategy: Provides the delays between attempts
+        delay_start(float): Seconds to wait before the first attempt
+        max_attempts(int): Give up after this many attempts
+        before_attempt(callable): Called with the attempt number (starting
+            at 0) before each attempt
+        after_attempt(callable): Called with the attempt number and the
+            result or exception after each attempt
+        name(str): Name the wait is recorded under in the stats registry,
+            derived from func by default
+
+    Returns:
+        The result that met the success criteria
+
+    Raises:
+        :exc:`~Timeout`: The timeout passed or max_attempts were made, with
+            the last result
+    """
+    kwargs = kwargs or {}
+    deadline = Deadline(float('inf') if timeout is None else timeout)
+    delays = strategy.delays()
+    attempts = 0
+    succeeded = False
+    try:
+        time.sleep(delay_start)
+        while True:
+            if before_attempt is not None:
+                before_attempt(attempts)
+            attempts += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if after_attempt is not None:
+                    after_attempt(attempts - 1, e)
+                if attempts > 1 and success_criteria(e):
+                    succeeded = True
+                    return e
+                if error_criteria(e):
+                    raise
+                result = e
+            else:
+                if after_attempt is not None:
+                    after_attempt(attempts - 1, result)
+                if success_criteria(result):
+                    succeeded = True
+                    return result
+            if deadline.expired() or attempts == max_attempts:
+                raise Timeout(result)
+            deadline.sleep(next(delays))
+    finally:
+        REGISTRY.record(
+            condition=name or condition_name(func),
+            attempts=attempts,
+            elapsed=round(deadline.elapsed(), 3),
+            timeout=timeout,
+            succeeded=succeeded,
+        )
+
+
+class StatsRegistry:
+    """
+    Collects statistics of every wait done in the session and appends each
+    of them as a JSON line to 'path' (if set) as soon as the wait is over.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+
+    def summary(self):
+        """
+        Returns:
+            dict: condition -> number of waits, total attempts and total
+                seconds spent waiting on it in this session
+        """
+        summary = {}
+        with self._lock:
+            for record in self.records:
+                entry = summary.setdefault(
+                    record['condition'],
+                    {'waits': 0, 'attempts': 0, 'elapsed': 0.0},
+                )
+                entry['waits'] += 1
+                entry['attempts'] += record['attempts']
+                entry['elapsed'] += record['elapsed']
+        return summary
+
+    def record(self, **record):
+        with self._lock:
+            self.records.append(record)
+            if self.path is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a') as stats_file:
+                    stats_file.write(json.dumps(record, default=str) + '\n')
+            except OSError:
+                LOGGER.debug(
+                    'Failed writing wait stats to %s', self.path, exc_info=True
+                )
+
+
+def condition_name(func):
+    """
+    Name identifying a polled condition across runs, including where it's
+    defined, since many of them are lambdas
+    """
+    name = getattr(func, '__qualname__', None) or repr(func)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return name
+    path = os.path.relpath(code.co_filename, _repo_root())
+    return f'{name}@{path}:{code.co_firstlineno}'
+
+
+def _repo_root():
+    return os.environ.get('OST_REPO_ROOT', os.getcwd())
+
+
+def _default_stats_path():
+    path = os.environ.get('OST_WAIT_STATS_FILE')
+    if path:
+        return path
+    if 'OST_REPO_ROOT' in os.environ:
+        return os.path.join(
+            os.environ['OST_REPO_ROOT'], 'exported-artifacts', STATS_FILE_NAME
+        )
+    return None
+
+
+REGISTRY = StatsRegistry(_default_stats_path())
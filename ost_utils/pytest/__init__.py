@@ -5,9 +5,12 @@
 #
 
 import logging
+import os
 
 import pytest
 
+from ost_utils.deployment_utils import checkpoints
+
 
 LOGGER = logging.getLogger(__name__)
 
@@ -15,6 +18,18 @@ LOGGER = logging.getLogger(__name__)
 def pytest_addoption(parser):
     parser.addoption('--custom-repo', action='append')
     parser.addoption('--skip-custom-repos-check', action='store_true')
+    parser.addoption(
+        '--checkpoints',
+        action='store_true',
+        help='take a checkpoint of the VMs after deployment and after '
+        'each test marked as a checkpoint',
+    )
+    parser.addoption(
+        '--restore-checkpoint',
+        metavar='NAME',
+        help='restore checkpoint NAME instead of deploying and run only '
+        'the tests after the one it was taken after',
+    )
 
 
 def pytest_collection_modifyitems(session, config, items):
@@ -45,6 +60,48 @@ def pytest_collection_modifyitems(session, config, items):
             module_items = sorted(module_items, key=get_item_ordering)
         items.extend(module_items)
 
+    restored = config.getoption('--restore-checkpoint')
+    if restored is not None:
+        _deselect_until_checkpoint(config, items, restored)
+
+
+def _deselect_until_checkpoint(config, items, name):
+    for idx, item in enumerate(items):
+        mark = item.get_closest_marker('checkpoint')
+        if mark is not None and mark.kwargs.get('name') == name:
+            config.hook.pytest_deselected(items=items[: idx + 1])
+            items[:] = items[idx + 1 :]
+            return
+    if name != checkpoints.DEPLOYED:
+        LOGGER.warning(
+            f'No test is marked as checkpoint {name}, running all tests'
+        )
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    report = outcome.get_result()
+    mark = item.get_closest_marker('checkpoint')
+    if (
+        mark is None
+        or report.when != 'call'
+        or not report.passed
+        or not item.config.getoption('--checkpoints')
+    ):
+        return
+    name = mark.kwargs['name']
+    working_dir = os.environ.get('PREFIX')
+    # e.g. tests run again after restoring this or a later checkpoint
+    if checkpoints.exists(working_dir, name):
+        LOGGER.info(f'Checkpoint {name} already exists, not taking it')
+        return
+    try:
+        checkpoints.create(working_dir, name)
+    except Exception:
+        # the test itself passed, and checkpoints are only a shortcut
+        LOGGER.exception(f'Failed taking checkpoint {name}')
+
 
 @pytest.hookimpl(hookwrapper=True)
 def pytest_fixture_setup(fixturedef, request):
@@ -61,3 +118,12 @@ def order_by(test_list):
             return pytest.mark.skip(reason="Not found in test list")(test_fn)
 
     return wrapper
+
+
+def checkpoint(name):
+    """
+    Marks the test after which checkpoint 'name' is taken, if checkpoints
+    are enabled with '--checkpoints'. Restoring the checkpoint with
+    '--restore-checkpoint' skips the test and all tests ordered before it.
+    """
+    return pytest.mark.checkpoint(name=name)
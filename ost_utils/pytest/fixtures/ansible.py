@@ -9,9 +9,10 @@ import pytest
 
 from ost_utils import ansible
 from ost_utils.ansible import inventory
+from ost_utils.ansible.connection import PersistentConnections
 from ost_utils.ansible import module_mappers
 from ost_utils.ansible import private_dir
-from ost_utils.ansible.facts import Facts
+from ost_utils.ansible import facts
 
 from ost_utils.pytest.fixtures.artifacts import artifacts_dir
 
@@ -81,29 +82,47 @@ def ansible_by_hostname(ansible_inventory):
 
 
 @pytest.fixture(scope="session")
-def ansible_engine_facts(ansible_engine):
-    return Facts(ansible_engine)
+def ansible_facts_cache(ansible_inventory, working_dir):
+    return facts.FactsCache(
+        ansible_inventory.dir, path=facts.facts_file_path(working_dir)
+    )
 
 
 @pytest.fixture(scope="session")
-def ansible_storage_facts(ansible_storage):
-    return Facts(ansible_storage)
+def ansible_engine_facts(ansible_engine, ansible_facts_cache):
+    return facts.Facts(
+        ansible_engine, ansible_facts_cache, gather_subset=facts.NETWORK_SUBSET
+    )
 
 
 @pytest.fixture(scope="session")
-def ansible_host0_facts(ansible_host0):
-    return Facts(ansible_host0)
+def ansible_storage_facts(ansible_storage, ansible_facts_cache):
+    return facts.Facts(
+        ansible_storage,
+        ansible_facts_cache,
+        gather_subset=facts.NETWORK_SUBSET,
+    )
 
 
 @pytest.fixture(scope="session")
-def ansible_host1_facts(ansible_host1):
-    return Facts(ansible_host1)
+def ansible_host0_facts(ansible_host0, ansible_facts_cache):
+    return facts.Facts(
+        ansible_host0, ansible_facts_cache, gather_subset=facts.NETWORK_SUBSET
+    )
+
+
+@pytest.fixture(scope="session")
+def ansible_host1_facts(ansible_host1, ansible_facts_cache):
+    return facts.Facts(
+        ansible_host1, ansible_facts_cache, gather_subset=facts.NETWORK_SUBSET
+    )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def ansible_clean_private_dirs():
     yield
     private_dir.PrivateDir.cleanup()
+    PersistentConnections.cleanup()
 
 
 @pytest.fixture(scope="session", autouse=True)
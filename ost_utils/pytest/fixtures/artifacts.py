@@ -5,18 +5,34 @@
 #
 
 import functools
+import json
 import logging
 import os
 
 import pytest
 
+from ost_utils import artifacts_utils
 from ost_utils import coverage
+from ost_utils import log_tailer as log_tailer_module
 from ost_utils import utils
 from ost_utils import shell
+from ost_utils import ssh
 from ost_utils.ansible import AnsibleExecutionError
+from ost_utils.pytest import running_time
 
 LOGGER = logging.getLogger(__name__)
 
+TASK_TIMINGS_FILE_NAME = 'task-timings.json'
+
+# DEV and EDEV statistics are excluded, since they contain the iface
+# names - semicolons in ';vdsmdummy;' iface name cause sadf to fail.
+# TODO: change the name of the iface in question
+SAR_PLOT_COMMAND = (
+    'sadf -g -- -bBdFHqSuvwWy -I SUM -I ALL -m ALL -n NFS,NFSD,'
+    'SOCK,IP,EIP,ICMP,EICMP,TCP,ETCP,UDP,SOCK6,IP6,EIP6,ICMP6,'
+    'EICMP6,UDP6 -r ALL -u ALL -P ALL > /tmp/sarstat.svg'
+)
+
 
 @pytest.fixture(scope="session")
 def artifacts_dir():
@@ -59,26 +75,111 @@ def artifacts(all_hostnames, artifact_list):
     return {hostname: artifact_list for hostname in all_hostnames}
 
 
+@pytest.fixture(scope="session")
+def artifact_collectors(artifacts_dir):
+    collectors = artifacts_utils.Collectors()
+    yield collectors
+    try:
+        collectors.run_all()
+    finally:
+        _save_task_timings(artifacts_dir)
+
+
+def _save_task_timings(artifacts_dir):
+    # how long each of the tasks run in parallel during the session took
+    os.makedirs(artifacts_dir, exist_ok=True)
+    with open(os.path.join(artifacts_dir, TASK_TIMINGS_FILE_NAME), 'w') as f:
+        json.dump(
+            [timing._asdict() for timing in utils.task_timings()],
+            f,
+            indent=2,
+        )
+
+
+@pytest.fixture(scope="session")
+def log_tailer(artifacts_dir, ansible_inventory):
+    interval = int(
+        os.environ.get(
+            'OST_LOG_TAIL_INTERVAL', log_tailer_module.DEFAULT_INTERVAL
+        )
+    )
+    if interval <= 0:
+        yield None
+        return
+    tailer = log_tailer_module.LogTailer(
+        lambda: artifacts_utils.ssh_targets(ansible_inventory.dir),
+        os.path.join(artifacts_dir, "test_logs"),
+        interval,
+    )
+    tailer.start()
+    yield tailer
+    tailer.stop()
+    log_tailer_module.write_slices(
+        tailer.local_paths(),
+        running_time.TEST_PERIODS,
+        running_time.FAILED_TESTS,
+        os.path.join(artifacts_dir, "test_slices"),
+    )
+
+
 @pytest.fixture(scope="session", autouse=True)
-def collect_artifacts(artifacts_dir, artifacts, ansible_by_hostname):
+def collect_artifacts(
+    artifact_collectors,
+    log_tailer,
+    artifacts_dir,
+    artifacts,
+    ansible_by_hostname,
+):
     def collect(hostname, artifacts_list, target_dir):
-        artifacts_list_string = ','.join(artifacts_list)
         ansible_handle = ansible_by_hostname(hostname)
-        archive_name = "artifacts.tar.gz"
         local_archive_dir = os.path.join(target_dir, "test_logs", hostname)
+        ssh_target = artifacts_utils.ssh_targets(ansible_handle.inventory).get(
+            ansible_handle.host_pattern
+        )
+        # logs followed during the session are already there, up to a
+        # last poll made as close to the archive as possible
+        tailed = []
+        if log_tailer is not None:
+            log_tailer.poll(ansible_handle.host_pattern, catch_up=True)
+            tailed = log_tailer.tailed_paths(ansible_handle.host_pattern)
+        if ssh_target is not None:
+            try:
+                artifacts_utils.stream_archive(
+                    hostname,
+                    ssh_target,
+                    artifacts_list,
+                    local_archive_dir,
+                    exclude=tailed,
+                    dump_journal=log_tailer_module.JOURNAL_FILE not in tailed,
+                )
+                return
+            except Exception:
+                LOGGER.warning(
+                    f"Streaming artifacts of '{hostname}' failed, "
+                    "collecting them with ansible",
+                    exc_info=True,
+                )
+        collect_with_ansible(
+            ansible_handle, artifacts_list, local_archive_dir, tailed
+        )
+
+    def collect_with_ansible(
+        ansible_handle, artifacts_list, local_archive_dir, tailed
+    ):
+        artifacts_list_string = ','.join(artifacts_list)
+        archive_name = "artifacts.tar.gz"
         local_archive_path = os.path.join(local_archive_dir, archive_name)
         remote_archive_path = os.path.join("/tmp", archive_name)
         os.makedirs(local_archive_dir, exist_ok=True)
-        # Get the journal right before collecting, so that we get all
-        # records we can. Does not make that much sense here, but doing
-        # this in its own fixture, including making the effort to schedule
-        # it right before current, would needlessly complicate the code.
-        ansible_handle.shell(
-            'journalctl -a --no-pager -o short-iso-precise > '
-            '/var/log/journalctl.log'
-        )
+        if log_tailer_module.JOURNAL_FILE not in tailed:
+            ansible_handle.shell(artifacts_utils.JOURNAL_COMMAND)
+        archive_args = {}
+        if tailed:
+            archive_args['exclude_path'] = ','.join(tailed)
         ansible_handle.archive(
-            path=artifacts_list_string, dest=remote_archive_path
+            path=artifacts_list_string,
+            dest=remote_archive_path,
+            **archive_args,
         )
         ansible_handle.fetch(
             src=remote_archive_path, dest=local_archive_path, flat='yes'
@@ -88,68 +189,129 @@ def collect_artifacts(artifacts_dir, artifacts, ansible_by_hostname):
         )
         shell.shell(["rm", local_archive_path])
 
-    yield
-    calls = [
-        functools.partial(collect, hostname, artifact_list, artifacts_dir)
-        for hostname, artifact_list in artifacts.items()
-    ]
-    utils.invoke_different_funcs_in_parallel(*calls)
+    def collect_all():
+        calls = [
+            functools.partial(collect, hostname, artifact_list, artifacts_dir)
+            for hostname, artifact_list in artifacts.items()
+        ]
+        try:
+            utils.invoke_different_funcs_in_parallel(*calls)
+        finally:
+            # e.g. config files that are the same on all hosts
+            artifacts_utils.deduplicate(
+                os.path.join(artifacts_dir, "test_logs")
+            )
+
+    # the hosts to collect from are only known at the end of the session,
+    # since tests may add some, e.g. the hosted engine VM
+    artifact_collectors.add(
+        'artifacts', collect_all, artifacts_utils.ARTIFACTS_BUDGET
+    )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def generate_sar_stat_plots(
-    collect_artifacts, ansible_all, ansible_by_hostname, artifacts_dir
+    artifact_collectors, ansible_all, ansible_by_hostname, artifacts_dir
 ):
     def generate(hostname):
         ansible_handle = ansible_by_hostname(hostname)
         try:
-            # DEV and EDEV statistics are excluded, since they contain
-            # the iface names - semicolons in ';vdsmdummy;' iface name cause
-            # sadf to fail.
-            # TODO: change the name of the iface in question
-            ansible_handle.shell(
-                'sadf -g -- -bBdFHqSuvwWy -I SUM -I ALL -m ALL -n NFS,NFSD,'
-                'SOCK,IP,EIP,ICMP,EICMP,TCP,ETCP,UDP,SOCK6,IP6,EIP6,ICMP6,'
-                'EICMP6,UDP6 -r ALL -u ALL -P ALL > /tmp/sarstat.svg'
-            )
+            ansible_handle.shell(SAR_PLOT_COMMAND)
         except AnsibleExecutionError as err:
             # sar error should not fail the run
             LOGGER.error(
                 f"Failed generating sar report on '{hostname}': {err}"
             )
         else:
-            ansible_handle.fetch(
-                src='/tmp/sarstat.svg',
-                dest=f'{artifacts_dir}/{hostname}.sarstat.svg',
-                flat=True,
+            fetch(hostname)
+
+    def fetch(hostname):
+        ansible_by_hostname(hostname).fetch(
+            src='/tmp/sarstat.svg',
+            dest=f'{artifacts_dir}/{hostname}.sarstat.svg',
+            flat=True,
+        )
+
+    def generate_over_ssh(hostnames):
+        """
+        Runs sadf on all VMs reachable over ssh at once, grouped by the
+        key they're reached with, and returns the VMs it couldn't run on
+        """
+        by_key = {}
+        unreachable = []
+        for hostname in hostnames:
+            ansible_handle = ansible_by_hostname(hostname)
+            target = artifacts_utils.ssh_targets(ansible_handle.inventory).get(
+                ansible_handle.host_pattern
             )
+            if target is None:
+                unreachable.append(hostname)
+            else:
+                by_key.setdefault(target.ssh_key, {})[hostname] = target
+        generated = []
+        for ssh_key, targets in by_key.items():
+            results = ssh.run_on_many(
+                {hostname: t.address for hostname, t in targets.items()},
+                [SAR_PLOT_COMMAND],
+                ssh_key=ssh_key,
+                tries=artifacts_utils.SSH_TRIES,
+            )
+            for hostname, result in results.items():
+                if result.error is not None:
+                    unreachable.append(hostname)
+                elif result.status.code:
+                    # sar error should not fail the run
+                    LOGGER.error(
+                        f"Failed generating sar report on '{hostname}': "
+                        f"rc={result.status.code} {result.status.err.decode()}"
+                    )
+                else:
+                    generated.append(hostname)
+        return generated, unreachable
 
-    yield
-    calls = [
-        functools.partial(generate, res['stdout'])
-        for res in ansible_all.shell("hostname").values()
-    ]
-    utils.invoke_different_funcs_in_parallel(*calls)
+    def generate_all():
+        hostnames = [
+            res['stdout'] for res in ansible_all.shell("hostname").values()
+        ]
+        generated, unreachable = generate_over_ssh(hostnames)
+        calls = [functools.partial(fetch, h) for h in generated] + [
+            functools.partial(generate, h) for h in unreachable
+        ]
+        utils.invoke_different_funcs_in_parallel(*calls)
+
+    artifact_collectors.add(
+        'sar-plots', generate_all, artifacts_utils.SAR_PLOTS_BUDGET
+    )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def collect_vdsm_coverage_artifacts(
-    artifacts_dir, ansible_host0, ansible_hosts
+    artifact_collectors, artifacts_dir, ansible_host0, ansible_hosts
 ):
-    yield
-    if os.environ.get("coverage", "false") == "true":
+    def collect():
         output_path = os.path.join(artifacts_dir, "coverage/")
         os.makedirs(output_path, exist_ok=True)
         coverage.vdsm.collect(ansible_host0, ansible_hosts, output_path)
 
+    if os.environ.get("coverage", "false") == "true":
+        artifact_collectors.add(
+            'vdsm-coverage', collect, artifacts_utils.COVERAGE_BUDGET
+        )
+
 
 @pytest.fixture(scope="session", autouse=True)
-def dump_dhcp_leases(artifacts_dir, backend, management_network_name):
-    yield
-    shell.shell(
-        [
-            'bash',
-            '-c',
-            f'virsh net-dhcp-leases {backend.libvirt_net_name(management_network_name)} > {artifacts_dir}/libvirt-leases',
-        ]
+def dump_dhcp_leases(
+    artifact_collectors, artifacts_dir, backend, management_network_name
+):
+    def dump():
+        shell.shell(
+            [
+                'bash',
+                '-c',
+                f'virsh net-dhcp-leases {backend.libvirt_net_name(management_network_name)} > {artifacts_dir}/libvirt-leases',
+            ]
+        )
+
+    artifact_collectors.add(
+        'dhcp-leases', dump, artifacts_utils.DHCP_LEASES_BUDGET
     )
@@ -17,11 +17,17 @@ import pytest
 from ost_utils import coverage
 from ost_utils import deployment_utils
 from ost_utils import utils
+from ost_utils.ansible import facts
+from ost_utils.deployment_utils import checkpoints
+from ost_utils.deployment_utils import image_cache
 from ost_utils.deployment_utils import package_mgmt
+from ost_utils.deployment_utils import pipeline
 
 
 LOGGER = logging.getLogger(__name__)
 
+DNF_UPGRADE = 'dnf upgrade --nogpgcheck -y --disableplugin versionlock -x ovirt-release-master,ovirt-release-master-tested,ovirt-engine-appliance,rhvm-appliance,ovirt-node-ng-image-update,redhat-virtualization-host-image-update'
+
 
 @pytest.fixture(scope="session")
 def run_scripts(ansible_by_hostname, root_dir):
@@ -64,40 +70,45 @@ def set_sar_interval(ansible_all, root_dir):
 
 
 def start_sshd_proxy(vms, host, root_dir, ssh_key_file):
-    vms.copy(
-        src=ssh_key_file,
-        dest='/root/.ssh/id_rsa',
-        mode='0600',
-    )
-    vms.copy(
-        src=os.path.join(root_dir, 'common/helpers/sshd_proxy.service'),
-        dest='/etc/systemd/system/sshd_proxy.service',
-    )
     user = getpass.getuser()
-    vms.copy(
-        dest='/usr/local/sbin/sshd_proxy.sh',
-        content=f'"#!/bin/bash\\nssh -D 1234 -p2222 -N -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -i /root/.ssh/id_rsa {user}@{host}"',
-        mode='0655',
-    )
-    vms.systemd(
-        daemon_reload='yes',
-        name='sshd_proxy.service',
-        state='started',
-        enabled='yes',
-    )
-    vms.lineinfile(
-        path='/etc/dnf/dnf.conf',
-        line='"proxy=socks5://localhost:1234\\nip_resolve=4"',
-    )
+    with vms.batch() as batch:
+        batch.copy(
+            src=ssh_key_file,
+            dest='/root/.ssh/id_rsa',
+            mode='0600',
+        )
+        batch.copy(
+            src=os.path.join(root_dir, 'common/helpers/sshd_proxy.service'),
+            dest='/etc/systemd/system/sshd_proxy.service',
+        )
+        batch.copy(
+            dest='/usr/local/sbin/sshd_proxy.sh',
+            content=f'"#!/bin/bash\\nssh -D 1234 -p2222 -N -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -i /root/.ssh/id_rsa {user}@{host}"',
+            mode='0655',
+        )
+        batch.systemd(
+            daemon_reload='yes',
+            name='sshd_proxy.service',
+            state='started',
+            enabled='yes',
+        )
+        batch.lineinfile(
+            path='/etc/dnf/dnf.conf',
+            line='"proxy=socks5://localhost:1234\\nip_resolve=4"',
+        )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def deploy(
     ansible_vms_to_deploy,
     ansible_hosts,
+    ansible_by_hostname,
     deploy_scripts,
     root_dir,
+    suite,
+    suite_dir,
     working_dir,
+    artifacts_dir,
     request,
     run_scripts,
     set_sar_interval,
@@ -106,66 +117,307 @@ def deploy(
     backend,
     management_network_name,
 ):
+    restored = request.config.getoption('--restore-checkpoint')
+    if restored is not None:
+        checkpoints.restore(working_dir, restored)
+        # facts saved after the checkpoint was taken may no longer be true,
+        # even though the VMs didn't reboot
+        facts_file = facts.facts_file_path(working_dir)
+        if os.path.exists(facts_file):
+            os.remove(facts_file)
+
     if deployment_utils.is_deployed(working_dir):
         LOGGER.info("Environment already deployed")
         return
 
-    LOGGER.info("Waiting for SSH on the VMs")
-    ansible_vms_to_deploy.wait_for_connection(timeout=120)
+    custom_repos = request.config.getoption('--custom-repo')
+    if custom_repos is not None:
+        custom_repos = package_mgmt.expand_jenkins_repos(
+            custom_repos, ost_images_distro
+        )
+
+    cache_key = None
+    if image_cache.cache_dir() is not None:
+        cache_inputs = _image_cache_inputs(
+            deploy_scripts,
+            root_dir,
+            suite,
+            suite_dir,
+            working_dir,
+            custom_repos,
+            ssh_key_file,
+            backend,
+        )
+        cache_key = image_cache.key(cache_inputs)
+
+    restored_from_cache = False
+    if cache_key is not None and image_cache.exists(cache_key):
+        try:
+            image_cache.restore(working_dir, cache_key)
+            restored_from_cache = True
+        except (image_cache.ImageCacheError, FileNotFoundError):
+            # the VMs weren't touched, e.g. the entry was evicted meanwhile
+            LOGGER.warning(
+                f'Failed restoring image cache entry {cache_key}, '
+                'deploying instead',
+                exc_info=True,
+            )
+
+    if restored_from_cache:
+        LOGGER.info("Waiting for SSH on the VMs restored from image cache")
+        with ansible_vms_to_deploy.batch() as batch:
+            batch.wait_for_connection(timeout=120)
+        # reported from the running VMs, so not part of what was cached
+        package_mgmt.report_ovirt_packages_versions(ansible_vms_to_deploy)
+        deployment_utils.mark_as_deployed(working_dir)
+    else:
+        timeline = pipeline.Timeline()
+        try:
+            _deploy(
+                timeline,
+                ansible_vms_to_deploy,
+                ansible_hosts,
+                ansible_by_hostname,
+                deploy_scripts,
+                root_dir,
+                suite,
+                suite_dir,
+                request,
+                run_scripts,
+                set_sar_interval,
+                custom_repos,
+                ssh_key_file,
+                backend,
+                management_network_name,
+            )
+        finally:
+            os.makedirs(artifacts_dir, exist_ok=True)
+            timeline.save(
+                os.path.join(artifacts_dir, pipeline.TIMELINE_FILE_NAME)
+            )
+            summary = timeline.summary()
+            LOGGER.info(
+                f"Deployment took {int(summary['duration'])}s, critical "
+                "path: " + " -> ".join(summary['critical_path'])
+            )
+
+        # mark env as deployed
+        deployment_utils.mark_as_deployed(working_dir)
+
+        if cache_key is not None:
+            try:
+                image_cache.commit(working_dir, cache_key, cache_inputs)
+            except Exception:
+                LOGGER.exception('Failed caching the deployed images')
 
-    # set static hostname to match the one assigned by DNS
-    ansible_vms_to_deploy.shell("hostnamectl set-hostname $(hostname)")
+    if request.config.getoption('--checkpoints'):
+        try:
+            checkpoints.create(working_dir, checkpoints.DEPLOYED)
+        except Exception:
+            LOGGER.exception('Failed taking checkpoint after deployment')
+
+
+def _deploy(
+    timeline,
+    ansible_vms_to_deploy,
+    ansible_hosts,
+    ansible_by_hostname,
+    deploy_scripts,
+    root_dir,
+    suite,
+    suite_dir,
+    request,
+    run_scripts,
+    set_sar_interval,
+    custom_repos,
+    ssh_key_file,
+    backend,
+    management_network_name,
+):
+    # This is the only stage run on all VMs at once, since it also tells
+    # which VMs are to be deployed
+    with timeline.measure('connect'):
+        LOGGER.info("Waiting for SSH on the VMs")
+        with ansible_vms_to_deploy.batch() as batch:
+            connected = batch.wait_for_connection(timeout=120)
+            # set static hostname to match the one assigned by DNS
+            batch.shell("hostnamectl set-hostname $(hostname)")
+        hostnames = sorted(connected.results_by_host)
 
     # start IPv6 proxy for dnf so we can update packages
+    proxy_host = None
     if not any(
         ipaddress.ip_address(ip).version == 4
         for ip in list(backend.ip_mapping().values())[0][
             management_network_name
         ]
     ):
-        LOGGER.info("Start sshd_proxy service and configure DNF for IPv6")
-        # can't use a fixture since VMs may not be up yet
         ip = list(backend.ip_mapping().values())[0][management_network_name][0]
-        start_sshd_proxy(
-            ansible_vms_to_deploy,
-            ipaddress.ip_interface(f"{ip}/64").network[1],
-            root_dir,
-            ssh_key_file,
-        )
+        proxy_host = ipaddress.ip_interface(f"{ip}/64").network[1]
 
-    # disable all repos
-    package_mgmt.disable_all_repos(ansible_vms_to_deploy)
+    declared_requires = pipeline.declared_requires(
+        os.path.join(suite_dir, 'ost.json'),
+        lambda vm: f'ost-{suite}-{vm}',
+    )
 
-    # add custom repos
-    custom_repos = request.config.getoption('--custom-repo')
-    if custom_repos is not None:
-        custom_repos = package_mgmt.expand_jenkins_repos(
-            custom_repos, ost_images_distro
-        )
-        package_mgmt.add_custom_repos(ansible_vms_to_deploy, custom_repos)
-        ansible_vms_to_deploy.shell(
-            'dnf upgrade --nogpgcheck -y --disableplugin versionlock -x ovirt-release-master,ovirt-release-master-tested,ovirt-engine-appliance,rhvm-appliance,ovirt-node-ng-image-update,redhat-virtualization-host-image-update'
-        )
-        # check if packages from custom repos were used
-        if not request.config.getoption('--skip-custom-repos-check'):
-            package_mgmt.check_installed_packages(ansible_vms_to_deploy)
+    deployment = pipeline.Pipeline(timeline)
+    for hostname in hostnames:
+        vm = ansible_by_hostname(hostname)
+        last = ['connect']
+        if proxy_host is not None:
+            # can't use a fixture since VMs may not be up yet
+            last = [
+                deployment.add(
+                    'sshd-proxy',
+                    functools.partial(
+                        start_sshd_proxy,
+                        vm,
+                        proxy_host,
+                        root_dir,
+                        ssh_key_file,
+                    ),
+                    host=hostname,
+                    requires=last,
+                )
+            ]
+        last = [
+            deployment.add(
+                'repos',
+                functools.partial(_setup_repos, vm, custom_repos),
+                host=hostname,
+                requires=last,
+            )
+        ]
+        if custom_repos is not None:
+            last = [
+                deployment.add(
+                    'upgrade',
+                    functools.partial(vm.shell, DNF_UPGRADE),
+                    host=hostname,
+                    requires=last,
+                )
+            ]
+
+    # run deployment scripts, one after another on each VM
+    for hostname, scripts in deploy_scripts.items():
+        last = deployment.keys(host=hostname)[-1:] or ['connect']
+        for script in scripts:
+            last = [
+                deployment.add(
+                    script,
+                    functools.partial(run_scripts, hostname, [script]),
+                    host=hostname,
+                    requires=last,
+                )
+            ]
 
+    packages_ready = (
+        deployment.keys('upgrade')
+        if custom_repos is not None
+        else deployment.keys('repos')
+    )
+    # check if packages from custom repos were used
+    if custom_repos is not None and not request.config.getoption(
+        '--skip-custom-repos-check'
+    ):
+        deployment.add(
+            'check-custom-repos',
+            functools.partial(
+                package_mgmt.check_installed_packages, ansible_vms_to_deploy
+            ),
+            requires=packages_ready,
+        )
     # report package versions
-    package_mgmt.report_ovirt_packages_versions(ansible_vms_to_deploy)
+    deployment.add(
+        'report-packages',
+        functools.partial(
+            package_mgmt.report_ovirt_packages_versions, ansible_vms_to_deploy
+        ),
+        requires=packages_ready,
+    )
 
-    # run deployment scripts
-    runs = [
-        functools.partial(run_scripts, hostname, scripts)
-        for hostname, scripts in deploy_scripts.items()
-    ]
-    utils.invoke_different_funcs_in_parallel(*runs)
+    for (hostname, script), required in declared_requires.items():
+        deployment.add_requires(
+            pipeline.stage_key(script, hostname),
+            [
+                pipeline.stage_key(required_script, required_host)
+                if required_script is not None
+                else deployment.keys(host=required_host)[-1]
+                for required_host, required_script in required
+            ],
+        )
 
+    all_scripts = [
+        key
+        for hostname in set(hostnames) | set(deploy_scripts)
+        for key in deployment.keys(host=hostname)[-1:]
+    ]
     # setup vdsm coverage on hosts if desired
     if os.environ.get("coverage", "false") == "true":
-        coverage.vdsm.setup(ansible_hosts)
+        deployment.add(
+            'coverage',
+            functools.partial(coverage.vdsm.setup, ansible_hosts),
+            requires=all_scripts,
+        )
 
     # setup sar stat utility
-    set_sar_interval()
+    deployment.add('sar', set_sar_interval, requires=all_scripts)
+
+    deployment.run()
+
+
+def _image_cache_inputs(
+    deploy_scripts,
+    root_dir,
+    suite,
+    suite_dir,
+    working_dir,
+    custom_repos,
+    ssh_key_file,
+    backend,
+):
+    # Everything the deployed disks depend on. Custom repos are only
+    # known by their URLs, so the cache should only be used with repos
+    # that don't change, e.g. the ones of a build.
+    common_files = [
+        os.path.join(suite_dir, 'ost.json'),
+        os.path.join(root_dir, 'common/sar_stat/override.conf'),
+        os.path.join(root_dir, 'common/helpers/sshd_proxy.service'),
+        ssh_key_file,
+    ]
+    return {
+        'suite': suite,
+        'base_images': image_cache.base_images(working_dir),
+        'files': {
+            os.path.relpath(path, root_dir): image_cache.file_digest(path)
+            for path in common_files
+            if os.path.exists(path)
+        },
+        'deploy_scripts': {
+            hostname: [
+                [
+                    script,
+                    image_cache.file_digest(os.path.join(root_dir, script)),
+                ]
+                for script in scripts
+            ]
+            for hostname, scripts in deploy_scripts.items()
+        },
+        'custom_repos': custom_repos,
+        'ip_mapping': {
+            hostname: {
+                network: sorted(ips) for network, ips in networks.items()
+            }
+            for hostname, networks in backend.ip_mapping().items()
+        },
+        'coverage': os.environ.get("coverage", "false"),
+        'user': getpass.getuser(),
+    }
+
 
-    # mark env as deployed
-    deployment_utils.mark_as_deployed(working_dir)
+def _setup_repos(vm, custom_repos):
+    # disable all repos
+    package_mgmt.disable_all_repos(vm)
+    # add custom repos
+    if custom_repos is not None:
+        package_mgmt.add_custom_repos(vm, custom_repos)
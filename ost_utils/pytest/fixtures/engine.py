@@ -5,6 +5,7 @@
 #
 
 import functools
+import logging
 import os
 import tempfile
 import time
@@ -14,12 +15,15 @@ import pytest
 
 from ost_utils import assert_utils
 from ost_utils import network_utils
+from ost_utils import test_utils
 from ost_utils.shell import shell
 from ost_utils.shell import ShellError
 from ost_utils.pytest.fixtures.env import suite
 from ost_utils.pytest.fixtures.network import management_network_name
 from ost_utils.pytest.fixtures.network import storage_network_name
 
+LOGGER = logging.getLogger(__name__)
+
 
 @pytest.fixture(scope="session")
 def engine_ips_for_network(ansible_engine_facts, backend):
@@ -112,8 +116,11 @@ def engine_api(engine_full_username, engine_password, engine_api_url):
         if not api.test():
             time.sleep(1)
         else:
-            return api
-    raise RuntimeError("Test API call failed")
+            break
+    else:
+        raise RuntimeError("Test API call failed")
+    yield api
+    LOGGER.info('Entity name lookups: %s', test_utils.cache_stats())
 
 
 @pytest.fixture(scope="session")
@@ -81,6 +81,8 @@ def ansible_he(
         ipv4_address=he_ipv4_address,
         ipv6_address=he_ipv6_address,
     )
+    # the cached network XML doesn't have the HE VM
+    backend.invalidate_cache()
     ssh_key_file = os.environ.get('OST_IMAGES_SSH_KEY')
     ansible_inventory.add(
         he_host_name,
@@ -95,8 +97,10 @@ def ansible_he(
 
 
 @pytest.fixture(scope="session")
-def ansible_he_facts(ansible_he):
-    return facts.Facts(ansible_he)
+def ansible_he_facts(ansible_he, ansible_facts_cache):
+    return facts.Facts(
+        ansible_he, ansible_facts_cache, gather_subset=facts.NETWORK_SUBSET
+    )
 
 
 @pytest.fixture(scope="session")
@@ -13,10 +13,16 @@ LOGGER = logging.getLogger('')
 
 RUNNING_TIMES = {}
 
+# node id -> (start, end) of each test, as aware datetimes, for cutting
+# the logs written while it ran
+TEST_PERIODS = {}
+FAILED_TESTS = set()
+
 
 def pytest_runtest_logstart(nodeid, location):
     now = datetime.datetime.now()
     RUNNING_TIMES[location] = now
+    TEST_PERIODS[nodeid] = (_utc_now(), None)
     print(now.strftime('started at %Y-%m-%d %H:%M:%S'), end=' ')
     LOGGER.debug(f'Running test: {nodeid}')
 
@@ -25,5 +31,15 @@ def pytest_runtest_logfinish(nodeid, location):
     now = datetime.datetime.now()
     then = RUNNING_TIMES[location]
     delta = int((now - then).total_seconds())
+    TEST_PERIODS[nodeid] = (TEST_PERIODS[nodeid][0], _utc_now())
     print(" ({}s)".format(delta), end='')
     LOGGER.debug(f'Finished test: {nodeid} ({delta}s)')
+
+
+def pytest_runtest_logreport(report):
+    if report.failed:
+        FAILED_TESTS.add(report.nodeid)
+
+
+def _utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
@@ -3,11 +3,16 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 #
 import array
+import atexit
+import codecs
+import collections
+import concurrent.futures
 import fcntl
 import select
 import socket
 import sys
 import termios
+import threading
 import time
 import uuid
 import logging
@@ -19,6 +24,8 @@ from ost_utils import utils
 
 SSH_TIMEOUT_DEFAULT = 100
 SSH_TRIES_DEFAULT = 20
+SSH_POOL_TTL_DEFAULT = 10 * 60
+SSH_POOL_IDLE_CHECK_DEFAULT = 30
 LOGGER = logging.getLogger(__name__)
 logging.getLogger('paramiko.transport').setLevel(logging.WARNING)
 
@@ -34,17 +41,85 @@ def ssh(
     username='root',
     password='vagrant',
 ):
-    host_name = host_name or ip_addr
-    client = get_ssh_client(
-        ip_addr=ip_addr,
+    return _exec_pooled(
+        ip_addr,
+        command,
+        host_name=host_name,
+        data=data,
+        tries=tries,
+        ssh_key=ssh_key,
+        username=username,
+        password=password,
+        **(show_output and {} or {'stdout': None, 'stderr': None}),
+    )
+
+
+def stream(
+    ip_addr,
+    command,
+    stdout,
+    host_name=None,
+    tries=None,
+    ssh_key=None,
+    username='root',
+    password='vagrant',
+):
+    """
+    Run a command on a pooled connection, handing its output over as it
+    arrives instead of keeping it in memory, e.g. to pipe an archive
+    created by the command straight into a local process
+
+    Args:
+        stdout(callable): Called with each chunk of bytes of the remote
+            stdout
+        See ssh() for the rest
+
+    Returns:
+        CommandStatus: With the remote stderr, but no stdout
+    """
+    stderr = []
+    status = _exec_pooled(
+        ip_addr,
+        command,
         host_name=host_name,
-        ssh_tries=tries,
+        tries=tries,
         ssh_key=ssh_key,
         username=username,
         password=password,
+        stdout=stdout,
+        stderr=stderr.append,
+        keep_output=False,
+    )
+    return command_status.CommandStatus(
+        status.out, b''.join(stderr), status.code
     )
-    transport = client.get_transport()
-    channel = transport.open_session()
+
+
+def _exec_pooled(
+    ip_addr,
+    command,
+    host_name,
+    tries,
+    ssh_key,
+    username,
+    password,
+    data=None,
+    **drain_kwargs,
+):
+    host_name = host_name or ip_addr
+    pool_key = (ip_addr, username, _ssh_key_id(ssh_key))
+
+    def connect():
+        return get_ssh_client(
+            ip_addr=ip_addr,
+            host_name=host_name,
+            ssh_tries=tries,
+            ssh_key=ssh_key,
+            username=username,
+            password=password,
+        )
+
+    channel = _open_pooled_session(pool_key, host_name, connect)
     joined_command = ' '.join(command)
     command_id = _gen_ssh_command_id()
     LOGGER.debug(
@@ -54,16 +129,17 @@ def ssh(
         joined_command,
         data is not None and (' < "%s"' % data) or '',
     )
-    channel.exec_command(joined_command)
-    if data is not None:
-        channel.send(data)
-    channel.shutdown_write()
-    return_code, out, err = drain_ssh_channel(
-        channel, **(show_output and {} or {'stdout': None, 'stderr': None})
-    )
-    channel.close()
-    transport.close()
-    client.close()
+    try:
+        channel.exec_command(joined_command)
+        if data is not None:
+            channel.send(data)
+        channel.shutdown_write()
+        return_code, out, err = drain_ssh_channel(channel, **drain_kwargs)
+    except (paramiko.SSHException, EOFError, socket.error):
+        _POOL.evict(pool_key)
+        raise
+    finally:
+        channel.close()
 
     LOGGER.debug(
         'Command %s on %s returned with %d',
@@ -89,12 +165,114 @@ def ssh(
     return command_status.CommandStatus(out, err, return_code)
 
 
-def drain_ssh_channel(chan, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
+HostResult = collections.namedtuple(
+    'HostResult', ('status', 'duration', 'error')
+)
+
+
+def run_on_many(
+    hosts,
+    command,
+    concurrency=None,
+    fail_fast=False,
+    **kwargs,
+):
+    """
+    Run the same command on several hosts at once, reusing pooled
+    connections
+
+    Args:
+        hosts(dict or list of str): Mapping of host names to ip addresses,
+            or just a list of ip addresses
+        command(list of str): The command to run
+        concurrency(int): Maximum number of hosts handled at the same time,
+            all of them by default
+        fail_fast(bool): Stop on the first host that failed to run the
+            command or returned a non-zero exit code, cancelling the hosts
+            not started yet. Otherwise results for all hosts are collected.
+        kwargs: Passed on to ssh()
+
+    Returns:
+        dict: host name -> HostResult with the CommandStatus (None if
+            running the command raised), the duration in seconds and the
+            exception raised, if any
+
+    Raises:
+        :exc:`~OSTSSHCommandError`: If fail_fast is set and a host failed
+    """
+    if not isinstance(hosts, dict):
+        hosts = {ip_addr: ip_addr for ip_addr in hosts}
+    if not hosts:
+        return {}
+
+    def run(host_name, ip_addr):
+        start_time = time.monotonic()
+        try:
+            status = ssh(ip_addr, command, host_name=host_name, **kwargs)
+        except Exception as err:
+            LOGGER.debug(
+                'Running %s on %s failed', command, host_name, exc_info=True
+            )
+            return HostResult(None, time.monotonic() - start_time, err)
+        return HostResult(status, time.monotonic() - start_time, None)
+
+    results = {}
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=concurrency or len(hosts),
+        thread_name_prefix='ssh',
+    )
+    try:
+        futures = {
+            executor.submit(run, host_name, ip_addr): host_name
+            for host_name, ip_addr in hosts.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            host_name = futures[future]
+            result = future.result()
+            results[host_name] = result
+            if fail_fast and (result.error or result.status.code):
+                raise OSTSSHCommandError(host_name, result)
+    except BaseException:
+        # the hosts not started yet are cancelled, the running ones are
+        # left to finish on their own instead of being waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return results
+
+
+def drain_ssh_channel(
+    chan,
+    stdin=None,
+    stdout=sys.stdout,
+    stderr=sys.stderr,
+    keep_output=True,
+):
+    """
+    Read everything the remote command writes until the channel is closed
+
+    Args:
+        chan(paramiko.Channel): Channel the command was executed on
+        stdin(file): Optional stream forwarded to the remote command
+        stdout(file or callable): Where to copy the remote stdout to as it
+            arrives, either a writable stream or a callable taking each
+            chunk of bytes. None disables copying.
+        stderr(file or callable): Same as stdout, for the remote stderr
+        keep_output(bool): Whether the whole output should be kept in memory
+            and returned. Set to False when streaming large outputs to a
+            file or callback.
+
+    Returns:
+        tuple: exit status, stdout bytes and stderr bytes (the latter two
+            are empty if keep_output is False)
+    """
     chan.settimeout(0)
-    out_queue = []
+    out_sink = _OutputSink(stdout)
+    err_sink = _OutputSink(stderr)
     out_all = []
-    err_queue = []
     err_all = []
+    out_reader = _AdaptiveReader(chan.recv_ready, chan.recv)
+    err_reader = _AdaptiveReader(chan.recv_stderr_ready, chan.recv_stderr)
 
     try:
         stdout_is_tty = stdout.isatty()
@@ -102,8 +280,7 @@ def drain_ssh_channel(chan, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
     except AttributeError:
         stdout_is_tty = False
 
-    done = False
-    while not done:
+    while True:
         if stdout_is_tty:
             arr = array.array('h', range(4))
             if not fcntl.ioctl(stdout.fileno(), termios.TIOCGWINSZ, arr):
@@ -111,25 +288,34 @@ def drain_ssh_channel(chan, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
                     tty_h, tty_w = arr[:2]
                     chan.resize_pty(width=tty_w, height=tty_h)
 
+        try:
+            out_chunks = out_reader.read_all()
+            err_chunks = err_reader.read_all()
+        except socket.error:
+            out_chunks = err_chunks = []
+
+        if out_chunks:
+            out_sink.write(out_chunks)
+            if keep_output:
+                out_all.extend(out_chunks)
+        if err_chunks:
+            err_sink.write(err_chunks)
+            if keep_output:
+                err_all.extend(err_chunks)
+        if out_chunks or err_chunks:
+            continue
+
+        if chan.closed or chan.eof_received:
+            if not chan.recv_ready() and not chan.recv_stderr_ready():
+                break
+
         read_streams = []
         if not chan.closed:
             read_streams.append(chan)
-
             if stdin and not stdin.closed:
                 read_streams.append(stdin)
 
-        write_streams = []
-        if stdout and out_queue:
-            write_streams.append(stdout)
-        if stderr and err_queue:
-            write_streams.append(stderr)
-
-        read, write, _ = select.select(
-            read_streams,
-            write_streams,
-            [],
-            0.1,
-        )
+        read, _, _ = select.select(read_streams, [], [], 0.1)
 
         if stdin in read:
             chunk = utils.read_nonblocking(stdin)
@@ -138,40 +324,100 @@ def drain_ssh_channel(chan, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
             else:
                 chan.shutdown_write()
 
-        try:
-            if chan.recv_ready():
-                chunk = chan.recv(1024)
-                if stdout:
-                    out_queue.append(chunk)
-                out_all.append(chunk)
-
-            if chan.recv_stderr_ready():
-                chunk = chan.recv_stderr(1024)
-                if stderr:
-                    err_queue.append(chunk)
-                err_all.append(chunk)
-        except socket.error:
-            pass
+    out_sink.flush()
+    err_sink.flush()
+    return (chan.recv_exit_status(), b''.join(out_all), b''.join(err_all))
 
-        if stdout in write:
-            out = out_queue.pop(0)
-            try:
-                stdout.write(out)
-            except TypeError:
-                stdout.write(out.decode('utf-8'))
-            stdout.flush()
-        if stderr in write:
-            err = err_queue.pop(0)
+
+class _AdaptiveReader:
+    """
+    Drains one stream of a channel, growing the read size while reads keep
+    filling the whole buffer and shrinking it back once they stop.
+    """
+
+    MIN_CHUNK = 32 * 1024
+    MAX_CHUNK = 1024 * 1024
+
+    def __init__(self, ready, recv):
+        self._ready = ready
+        self._recv = recv
+        self._chunk_size = self.MIN_CHUNK
+
+    def read_all(self):
+        chunks = []
+        while self._ready():
+            chunk = self._recv(self._chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if len(chunk) == self._chunk_size:
+                self._chunk_size = min(self._chunk_size * 2, self.MAX_CHUNK)
+            else:
+                self._chunk_size = max(self._chunk_size // 2, self.MIN_CHUNK)
+        return chunks
+
+
+class _OutputSink:
+    def __init__(self, target):
+        self._target = target
+        self._decoder = None
+        if target is not None and not hasattr(target, 'write'):
+            self._write = target
+        else:
+            self._write = self._write_stream
+
+    def write(self, chunks):
+        if self._target is None:
+            return
+        self._write(b''.join(chunks))
+
+    def flush(self):
+        if self._decoder is not None:
+            tail = self._decoder.decode(b'', final=True)
+            if tail:
+                self._target.write(tail)
+                self._target.flush()
+
+    def _write_stream(self, data):
+        if self._decoder is None:
             try:
-                stderr.write(err)
+                self._target.write(data)
             except TypeError:
-                stderr.write(err.decode('utf-8'))
-            stderr.flush()
+                self._decoder = codecs.getincrementaldecoder('utf-8')(
+                    errors='replace'
+                )
+        if self._decoder is not None:
+            self._target.write(self._decoder.decode(data))
+        self._target.flush()
+
+
+def _open_pooled_session(pool_key, host_name, connect):
+    """
+    Open a new channel on a pooled transport. A transport that fails to
+    open a channel is evicted and the attempt is repeated once on a fresh
+    connection.
+    """
+    # a half-open transport would otherwise block for paramiko's default
+    # of an hour before failing
+    timeout = int(SSH_TIMEOUT_DEFAULT)
+    try:
+        client = _POOL.acquire(pool_key, host_name, connect)
+        return client.get_transport().open_session(timeout=timeout)
+    except (paramiko.SSHException, EOFError, socket.error) as err:
+        LOGGER.debug(
+            'Pooled connection to %s failed, reconnecting: %s',
+            host_name,
+            err,
+        )
+        _POOL.evict(pool_key)
+    client = _POOL.acquire(pool_key, host_name, connect)
+    return client.get_transport().open_session(timeout=timeout)
 
-        if chan.closed and not out_queue and not err_queue:
-            done = True
 
-    return (chan.exit_status, b''.join(out_all), b''.join(err_all))
+def _ssh_key_id(ssh_key):
+    if ssh_key is None or isinstance(ssh_key, str):
+        return ssh_key
+    return tuple(ssh_key)
 
 
 def _gen_ssh_command_id():
@@ -256,3 +502,167 @@ def get_ssh_client(
 
 class OSTSSHTimeoutException(Exception):
     pass
+
+
+class _PooledConnection:
+    def __init__(self, client, host_name):
+        self.client = client
+        self.host_name = host_name
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def expired(self, ttl):
+        return time.monotonic() - self.created_at > ttl
+
+    def healthy(self, idle_check):
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        if time.monotonic() - self.last_used > idle_check:
+            try:
+                transport.send_ignore()
+            except (paramiko.SSHException, EOFError, socket.error):
+                return False
+        return True
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            LOGGER.debug('Error closing pooled ssh client', exc_info=True)
+
+
+class ConnectionPool:
+    """
+    Keeps authenticated ssh transports alive between calls, keyed by
+    (ip address, username, ssh key). Every command gets its own channel on
+    the shared transport, so the pool is safe to use from several threads.
+
+    Args:
+        ttl(int): Seconds after which a transport is closed and reopened
+        idle_check(int): Seconds of idleness after which a transport is
+            probed before being handed out again
+    """
+
+    def __init__(
+        self,
+        ttl=SSH_POOL_TTL_DEFAULT,
+        idle_check=SSH_POOL_IDLE_CHECK_DEFAULT,
+    ):
+        self.ttl = ttl
+        self.idle_check = idle_check
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._connections = {}
+        self._stats = {}
+
+    def acquire(self, key, host_name, connect):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+            stats = self._host_stats(host_name)
+        with key_lock:
+            conn = self._connections.get(key)
+            if conn is not None:
+                if not conn.expired(self.ttl) and conn.healthy(
+                    self.idle_check
+                ):
+                    conn.last_used = time.monotonic()
+                    with self._lock:
+                        stats['hits'] += 1
+                    return conn.client
+                LOGGER.debug('Dropping stale ssh connection to %s', host_name)
+                self._drop(key)
+                with self._lock:
+                    stats['evictions'] += 1
+            # keys of the same host share its stats, and are only
+            # serialized by the pool's lock
+            with self._lock:
+                stats['misses'] += 1
+            start_time = time.monotonic()
+            client = connect()
+            handshake_time = time.monotonic() - start_time
+            with self._lock:
+                stats['handshakes'] += 1
+                stats['handshake_time'] += handshake_time
+            self._connections[key] = _PooledConnection(client, host_name)
+            return client
+
+    def evict(self, key):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            conn = self._drop(key)
+        if conn is not None:
+            with self._lock:
+                self._host_stats(conn.host_name)['evictions'] += 1
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Per-host counters of pool hits and misses, the number of
+                handshakes done and the total time spent on them
+        """
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._stats.items()}
+
+    def _drop(self, key):
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+        return conn
+
+    def _host_stats(self, host_name):
+        return self._stats.setdefault(
+            host_name,
+            {
+                'hits': 0,
+                'misses': 0,
+                'evictions': 0,
+                'handshakes': 0,
+                'handshake_time': 0.0,
+            },
+        )
+
+
+def pool_stats():
+    return _POOL.stats()
+
+
+def close_pool():
+    for host_name, stats in _POOL.stats().items():
+        LOGGER.debug(
+            'ssh pool stats for %s: %d hits, %d misses, %d evictions, '
+            '%d handshakes taking %.2f s',
+            host_name,
+            stats['hits'],
+            stats['misses'],
+            stats['evictions'],
+            stats['handshakes'],
+            stats['handshake_time'],
+        )
+    _POOL.close_all()
+
+
+_POOL = ConnectionPool()
+atexit.register(close_pool)
+
+
+class OSTSSHCommandError(Exception):
+    def __init__(self, host_name, result):
+        self.host_name = host_name
+        self.result = result
+
+    def __str__(self):
+        if self.result.error is not None:
+            return f'Command failed on {self.host_name}: {self.result.error}'
+        return (
+            f'Command failed on {self.host_name} with '
+            f'rc={self.result.status.code}. Stderr:\n{self.result.status.err}'
+        )
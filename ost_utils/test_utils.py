@@ -4,13 +4,165 @@
 #
 #
 
-from functools import cache
+import threading
+import time
+import weakref
 
 import ovirtsdk4
 import ovirtsdk4.types as types
 
 
-@cache
+NAME_INDEX_TTL = 5 * 60
+
+# connection -> {(service path, collection): _NameIndex}, weakly keyed so
+# that the indexes go away with the connection they were filled from
+_INDEXES = weakref.WeakKeyDictionary()
+_INDEXES_LOCK = threading.Lock()
+
+
+class _NameIndex:
+    """
+    name -> id index of one collection, filled by listing the whole
+    collection at once. A lookup of a name not in the index, or done after
+    'ttl' seconds, lists the collection again, as does a lookup of an id
+    that turns out not to belong to the name anymore.
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = NAME_INDEX_TTL if ttl is None else ttl
+        self._ids = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, list_func, key, is_current):
+        """
+        Args:
+            name(str): The name to look up
+            list_func(callable): Lists the whole collection
+            key(callable): Returns the name of a listed entity
+            is_current(callable): Tells whether an id from the index still
+                belongs to 'name', e.g. after it was removed and re-created
+
+        Returns:
+            str: The id of the entity named 'name', None if there's none
+        """
+        with self._lock:
+            if (
+                self._fresh()
+                and name in self._ids
+                and is_current(self._ids[name])
+            ):
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._load(list_func, key)
+            return self._ids.get(name)
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None or self._ids is None:
+                self._ids = None
+            else:
+                self._ids.pop(name, None)
+
+    def _fresh(self):
+        return (
+            self._ids is not None
+            and time.monotonic() - self._loaded_at < self._ttl
+        )
+
+    def _load(self, list_func, key):
+        ids = {}
+        for entity in list_func():
+            ids.setdefault(key(entity), entity.id)
+        self._ids = ids
+        self._loaded_at = time.monotonic()
+
+
+def _index(owner, collection):
+    # SDK service objects are created anew on every call, so collections
+    # are told apart by their connection and the path of the service
+    # owning them
+    connection = owner._connection  # pylint: disable=protected-access
+    with _INDEXES_LOCK:
+        indexes = _INDEXES.setdefault(connection, {})
+        index = indexes.get((owner._path, collection))
+        if index is None:
+            index = _NameIndex()
+            indexes[(owner._path, collection)] = index
+        return index
+
+
+def _lookup(
+    owner,
+    collection,
+    name,
+    list_func,
+    service_func,
+    missing_ok=False,
+    key=lambda entity: entity.name,
+):
+    """
+    Returns:
+        The service of the entity named 'name' in the collection. If there's
+        none, None if missing_ok is set, otherwise IndexError is raised, as
+        when indexing an empty search result.
+    """
+
+    def is_current(entity_id):
+        try:
+            return key(service_func(entity_id).get()) == name
+        except ovirtsdk4.NotFoundError:
+            return False
+
+    entity_id = _index(owner, collection).get(name, list_func, key, is_current)
+    if entity_id is not None:
+        return service_func(entity_id)
+    if missing_ok:
+        return None
+    raise IndexError(f'No {collection} named {name!r}')
+
+
+def invalidate_cache(collection=None, name=None):
+    """
+    Drop cached name -> id mappings. Not needed for correctness, stale ids
+    are detected on lookup, but saves the extra round trip when a name is
+    known to be gone.
+
+    Args:
+        collection(str): e.g. 'vms' or 'disks', all collections if None
+        name(str): Only drop this name, the whole collection if None
+    """
+    for index_collection, index in _all_indexes():
+        if collection is None or index_collection == collection:
+            index.invalidate(name)
+
+
+def cache_stats():
+    """
+    Returns:
+        dict: collection -> number of lookups served from the cache (hits)
+            and of lookups that listed the collection (misses)
+    """
+    stats = {}
+    for collection, index in _all_indexes():
+        entry = stats.setdefault(collection, {'hits': 0, 'misses': 0})
+        entry['hits'] += index.hits
+        entry['misses'] += index.misses
+    return stats
+
+
+def _all_indexes():
+    with _INDEXES_LOCK:
+        return [
+            (collection, index)
+            for indexes in _INDEXES.values()
+            for (_, collection), index in indexes.items()
+        ]
+
+
 def get_nics_service(engine, vm_name):
     vm_service = get_vm_service(engine, vm_name)
     nics_service = vm_service.nics_service()
@@ -25,23 +177,24 @@ def get_network_fiter_parameters_service(engine, vm_name):
     ).network_filter_parameters_service()
 
 
-@cache
 def get_vm_service(engine, vm_name):
     vms_service = engine.vms_service()
-    vm = vms_service.list(search='name={}'.format(vm_name))[0]
-    if vm is None:
-        return None
-    return vms_service.vm_service(vm.id)
+    return _lookup(
+        engine, 'vms', vm_name, vms_service.list, vms_service.vm_service
+    )
 
 
-@cache
 def get_disk_service(engine, disk_name):
     disks_service = engine.disks_service()
-    disk = disks_service.list(search='name={}'.format(disk_name))[0]
-    return disks_service.disk_service(disk.id)
+    return _lookup(
+        engine,
+        'disks',
+        disk_name,
+        disks_service.list,
+        disks_service.disk_service,
+    )
 
 
-@cache
 def get_disk_attachments_service(engine, vm_name):
     vm_service = get_vm_service(engine, vm_name)
     if vm_service is None:
@@ -49,38 +202,51 @@ def get_disk_attachments_service(engine, vm_name):
     return vm_service.disk_attachments_service()
 
 
-@cache
 def get_template_service(engine, template_name):
     templates_service = engine.templates_service()
-    template = templates_service.list(search=f'name={template_name}')[0]
-    if template is None:
-        return None
-    return templates_service.template_service(template.id)
+    return _lookup(
+        engine,
+        'templates',
+        template_name,
+        templates_service.list,
+        templates_service.template_service,
+    )
 
 
-@cache
 def get_pool_service(engine, pool_name):
     vm_pools_service = engine.vm_pools_service()
-    pool = vm_pools_service.list(search='name={}'.format(pool_name))[0]
-    return vm_pools_service.pool_service(pool.id)
+    return _lookup(
+        engine,
+        'vm_pools',
+        pool_name,
+        vm_pools_service.list,
+        vm_pools_service.pool_service,
+    )
 
 
-@cache
 def get_storage_domain_service(engine, sd_name):
     storage_domains_service = engine.storage_domains_service()
-    sd = storage_domains_service.list(search='name={}'.format(sd_name))[0]
-    return storage_domains_service.storage_domain_service(sd.id)
+    return _lookup(
+        engine,
+        'storage_domains',
+        sd_name,
+        storage_domains_service.list,
+        storage_domains_service.storage_domain_service,
+    )
 
 
 def get_storage_domain_vm_service_by_name(sd_service, vm_name):
     vms_service = sd_service.vms_service()
     # StorageDomainVmsService.list has no 'search' parameter and ignores
-    # query={'name': 'spam'} so we have to do the filtering ourselves
-    vm = next((vm for vm in vms_service.list() if vm.name == vm_name), None)
-    if vm is None:
-        return None
-    else:
-        return vms_service.vm_service(vm.id)
+    # query={'name': 'spam'} so we index the whole listing ourselves
+    return _lookup(
+        sd_service,
+        'sd_vms',
+        vm_name,
+        vms_service.list,
+        vms_service.vm_service,
+        missing_ok=True,
+    )
 
 
 def get_storage_domain_vm_service_by_query(sd_service, vm_name, query=None):
@@ -100,14 +266,15 @@ def get_storage_domain_vm_service_by_query(sd_service, vm_name, query=None):
 def get_storage_domain_disk_service_by_name(sd_service, disk_name):
     disks_service = sd_service.disks_service()
     # StorageDomainDisksService.list has no 'search' parameter and ignores
-    # query={'name': 'spam'} so we have to do the filtering ourselves
-    disk = next(
-        (disk for disk in disks_service.list() if disk.name == disk_name), None
+    # query={'name': 'spam'} so we index the whole listing ourselves
+    return _lookup(
+        sd_service,
+        'sd_disks',
+        disk_name,
+        disks_service.list,
+        disks_service.disk_service,
+        missing_ok=True,
     )
-    if disk is None:
-        return None
-    else:
-        return disks_service.disk_service(disk.id)
 
 
 def hosts_in_cluster_v4(root, cluster_name):
@@ -115,21 +282,28 @@ def hosts_in_cluster_v4(root, cluster_name):
     return sorted(hosts, key=lambda host: host.name)
 
 
-@cache
 def data_center_service(root, name):
     data_centers = root.data_centers_service()
-    dc = data_centers.list(search='name={}'.format(name))[0]
-    return data_centers.data_center_service(dc.id)
+    return _lookup(
+        root,
+        'data_centers',
+        name,
+        data_centers.list,
+        data_centers.data_center_service,
+    )
 
 
-@cache
 def get_cluster_service(engine, cluster_name):
     clusters_service = engine.clusters_service()
-    cluster = clusters_service.list(search='name={}'.format(cluster_name))[0]
-    return clusters_service.cluster_service(cluster.id)
+    return _lookup(
+        engine,
+        'clusters',
+        cluster_name,
+        clusters_service.list,
+        clusters_service.cluster_service,
+    )
 
 
-@cache
 def get_vm_snapshots_service(engine, vm_name):
     vm_service = get_vm_service(engine, vm_name)
     if vm_service is None:
@@ -139,14 +313,18 @@ def get_vm_snapshots_service(engine, vm_name):
 
 def get_snapshot(engine, vm_name, description):
     snapshots_service = get_vm_snapshots_service(engine, vm_name)
-    return next(
-        (
-            snap
-            for snap in snapshots_service.list()
-            if snap.description == description
-        ),
-        None,
+    snapshot_service = _lookup(
+        snapshots_service,
+        'snapshots',
+        description,
+        snapshots_service.list,
+        snapshots_service.snapshot_service,
+        missing_ok=True,
+        key=lambda snap: snap.description,
     )
+    if snapshot_service is None:
+        return None
+    return snapshot_service.get()
 
 
 def quote_search_string(s):
@@ -162,11 +340,16 @@ def quote_search_string(s):
     return '"' + s + '"'
 
 
-@cache
 def get_vnic_profiles_service(engine, network_name):
     networks_service = engine.networks_service()
-    net = networks_service.list(search='name={}'.format(network_name))[0]
-    return networks_service.network_service(net.id).vnic_profiles_service()
+    network_service = _lookup(
+        engine,
+        'networks',
+        network_name,
+        networks_service.list,
+        networks_service.network_service,
+    )
+    return network_service.vnic_profiles_service()
 
 
 def all_jobs_finished(engine, correlation_id):
@@ -4,27 +4,118 @@
 #
 #
 
+import collections
+import concurrent.futures
 import fcntl
 import functools
 import logging
 import os
-import queue
 import sys
 import threading
+import time
+import traceback
 
 LOGGER = logging.getLogger(__name__)
 
 
-def _ret_via_queue(func, queue):
-    try:
-        queue.put({'return': func()})
-    except Exception:
-        LOGGER.debug(
-            'Error while running thread %s',
-            threading.current_thread().name,
-            exc_info=True,
+MAX_WORKERS = int(
+    os.environ.get('OST_MAX_WORKERS', max(8, 2 * (os.cpu_count() or 1)))
+)
+WORKER_NAME_PREFIX = 'ost-worker'
+
+TaskTiming = collections.namedtuple(
+    'TaskTiming', ('name', 'duration', 'outcome')
+)
+
+_task_timings = []
+_task_timings_lock = threading.Lock()
+
+
+class ParallelExecutionError(Exception):
+    """
+    Raised when more than one task run in parallel failed. Keeps the
+    exc_info of every failed task in 'failures' as (name, exc_info) pairs.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __str__(self):
+        return '\n'.join(
+            f'Task {name} failed:\n'
+            + ''.join(traceback.format_exception(*exc_info))
+            for name, exc_info in self.failures
         )
-        queue.put({'exception': sys.exc_info()})
+
+
+class _SharedExecutor:
+    """The worker pool, created on first use"""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS,
+                    thread_name_prefix=WORKER_NAME_PREFIX,
+                )
+            return self._executor
+
+
+_EXECUTOR = _SharedExecutor()
+
+
+def _get_executor(size):
+    """
+    Returns:
+        tuple: The executor to run 'size' tasks on, and whether it's a
+            private one that should be shut down once they're submitted
+    """
+    if not _in_worker():
+        return _EXECUTOR.get(), False
+    # Waiting on the shared pool from one of its own workers could starve
+    # it, so nested fan-outs get threads of their own, one per task, that
+    # only live as long as the fan-out
+    LOGGER.debug(
+        'Running %d nested tasks of %s on a private pool',
+        size,
+        threading.current_thread().name,
+    )
+    return (
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(size, 1),
+            thread_name_prefix=f'{threading.current_thread().name}-nested',
+        ),
+        True,
+    )
+
+
+def _in_worker():
+    return threading.current_thread().name.startswith(WORKER_NAME_PREFIX)
+
+
+def task_timings():
+    """
+    Returns:
+        list: A TaskTiming for each task run by VectorThread so far
+    """
+    with _task_timings_lock:
+        return list(_task_timings)
+
+
+def _task_name(func):
+    func = getattr(func, 'func', func)
+    return getattr(func, '__name__', repr(func))
+
+
+def _outcome(result):
+    for outcome in ('return', 'exception', 'cancelled'):
+        if outcome in result:
+            return outcome
+    return None
 
 
 def func_vector(target, args_sequence):
@@ -32,46 +123,171 @@ def func_vector(target, args_sequence):
 
 
 class VectorThread:
-    def __init__(self, targets):
+    """
+    Runs targets on the shared, size-bounded worker pool.
+
+    Calls made from a pool worker itself run their targets on a private
+    pool instead, so nested parallel calls, e.g. from pipeline stages,
+    still run in parallel but can never starve the shared one.
+
+    Args:
+        targets(list of callable): The functions to run
+        timeout(float): Seconds each target may run once it has started.
+            A target running longer fails with concurrent.futures.TimeoutError
+            (the thread itself can't be interrupted and is left to finish).
+            Until it does, it keeps occupying its worker, leaving the shared
+            pool one worker short for everything else.
+        fail_fast(bool): Cancel targets that haven't started yet as soon as
+            one of them fails
+    """
+
+    def __init__(self, targets, timeout=None, fail_fast=False):
         self.targets = targets
+        self.timeout = timeout
+        self.fail_fast = fail_fast
         self.results = None
+        self.timings = []
 
     def start_all(self):
-        self.thread_handles = []
-        for target in self.targets:
-            q = queue.Queue()
-            t = threading.Thread(target=_ret_via_queue, args=(target, q))
-            self.thread_handles.append((t, q))
-            t.start()
+        self._started = {}
+        executor, private = _get_executor(len(self.targets))
+        self.futures = [
+            executor.submit(self._run, idx, target)
+            for idx, target in enumerate(self.targets)
+        ]
+        if private:
+            # the threads go away once the tasks submitted are done
+            executor.shutdown(wait=False)
 
     def join_all(self, raise_exceptions=True):
-        if self.results:
-            return self.results
-
-        for t, q in self.thread_handles:
-            t.join()
+        if self.results is None:
+            self.results = self._wait_all()
+            for target, result in zip(self.targets, self.results):
+                timing = TaskTiming(
+                    _task_name(target),
+                    result.get('duration'),
+                    _outcome(result),
+                )
+                LOGGER.debug('Task timing: %s', timing)
+                self.timings.append(timing)
+            with _task_timings_lock:
+                _task_timings.extend(self.timings)
 
-        self.results = [q.get() for _, q in self.thread_handles]
         if raise_exceptions:
-            for result in self.results:
-                if 'exception' in result:
-                    exc_info = result['exception']
-                    raise exc_info[1].with_traceback(exc_info[2])
+            failures = [
+                (_task_name(target), result['exception'])
+                for target, result in zip(self.targets, self.results)
+                if 'exception' in result
+            ]
+            if len(failures) == 1:
+                exc_info = failures[0][1]
+                raise exc_info[1].with_traceback(exc_info[2])
+            if failures:
+                raise ParallelExecutionError(failures) from failures[0][1][1]
         return [x.get('return', None) for x in self.results]
 
+    def _run(self, idx, target):
+        start_time = time.monotonic()
+        self._started[idx] = start_time
+        try:
+            result = {'return': target()}
+        except Exception:
+            LOGGER.debug(
+                'Error while running %s in thread %s',
+                _task_name(target),
+                threading.current_thread().name,
+                exc_info=True,
+            )
+            result = {'exception': sys.exc_info()}
+        result['duration'] = time.monotonic() - start_time
+        return result
 
-def invoke_in_parallel(func, *args_sequences):
-    vt = VectorThread(func_vector(func, list(zip(*args_sequences))))
+    def _wait_all(self):
+        results = [None] * len(self.futures)
+        pending = {future: idx for idx, future in enumerate(self.futures)}
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending,
+                timeout=self._next_deadline(pending.values()),
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            failed = False
+            for future in done:
+                idx = pending.pop(future)
+                if future.cancelled():
+                    results[idx] = {'cancelled': True}
+                    continue
+                results[idx] = future.result()
+                failed = failed or 'exception' in results[idx]
+            for future, idx in list(pending.items()):
+                if self._timed_out(idx):
+                    results[idx] = self._timeout_result(idx)
+                    del pending[future]
+                    failed = True
+            if failed and self.fail_fast:
+                for future in pending:
+                    future.cancel()
+        return results
+
+    def _next_deadline(self, indices):
+        if self.timeout is None:
+            return None
+        now = time.monotonic()
+        deadlines = [
+            self._started[idx] + self.timeout - now
+            for idx in indices
+            if idx in self._started
+        ]
+        # Targets not started yet get their deadline once they start, so
+        # check back on them periodically
+        return max(0, min(deadlines, default=1.0))
+
+    def _timed_out(self, idx):
+        return (
+            self.timeout is not None
+            and idx in self._started
+            and time.monotonic() - self._started[idx] > self.timeout
+        )
+
+    def _timeout_result(self, idx):
+        duration = time.monotonic() - self._started[idx]
+        try:
+            raise concurrent.futures.TimeoutError(
+                f'{_task_name(self.targets[idx])} did not finish '
+                f'in {self.timeout} seconds'
+            )
+        except concurrent.futures.TimeoutError:
+            return {'exception': sys.exc_info(), 'duration': duration}
+
+
+def invoke_in_parallel(func, *args_sequences, timeout=None, fail_fast=False):
+    vt = VectorThread(
+        func_vector(func, list(zip(*args_sequences))),
+        timeout=timeout,
+        fail_fast=fail_fast,
+    )
     vt.start_all()
     return vt.join_all()
 
 
-def invoke_different_funcs_in_parallel(*funcs):
-    vt = VectorThread(funcs)
+def invoke_different_funcs_in_parallel(*funcs, timeout=None, fail_fast=False):
+    vt = VectorThread(funcs, timeout=timeout, fail_fast=fail_fast)
     vt.start_all()
     return vt.join_all()
 
 
+def submit(func, *args, **kwargs):
+    """
+    Runs func on the shared worker pool and returns its future. Called from
+    a pool worker, runs func on a thread of its own, like VectorThread does.
+    """
+    executor, private = _get_executor(1)
+    future = executor.submit(func, *args, **kwargs)
+    if private:
+        executor.shutdown(wait=False)
+    return future
+
+
 def read_nonblocking(file_descriptor):
     oldfl = fcntl.fcntl(file_descriptor.fileno(), fcntl.F_GETFL)
     try: